@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+blob存储的引用计数
+<cache_dir>/blobs/refs.json 记录每个镜像缓存条目（按缓存文件名）用到的manifest、config和层的digest，
+blob的引用计数即引用它的镜像数。删除镜像或重新拉取后不再被任何镜像引用的blob从存储中回收，
+磁盘占用随不同的层数增长，而不是随镜像数增长。
+没有引用记录的blob（本功能之前拉取的、拉取失败留下的）不会被自动删除。
+"""
+
+import logging
+import os
+
+from .blob_store import BlobIndex, BlobStore, TagIndex, digest_hex
+from .layer_cache import LayerCache
+from .registry_cache import JsonStateFile
+
+logger = logging.getLogger(__name__)
+
+
+def image_blob_digests(info):
+    """缓存信息中镜像用到的blob：manifest list、平台manifest、config和各层"""
+    digests = [info.get('manifest_digest'), info.get('platform_digest'), info.get('config_digest')]
+    digests.extend(info.get('layers') or [])
+    return sorted({digest for digest in digests if isinstance(digest, str) and digest.startswith('sha256:')})
+
+
+class BlobRefs:
+    """镜像对blob存储的引用（<cache_dir>/blobs/refs.json）"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.state = JsonStateFile(os.path.join(cache_dir, 'blobs', 'refs.json'))
+
+    @staticmethod
+    def _key(cache_path):
+        return os.path.basename(cache_path)
+
+    def count(self, digest):
+        """引用该blob的镜像数"""
+        return sum(digest in digests for digests in self.state.load().values())
+
+    def record(self, cache_path, info):
+        """记录镜像引用的blob，并回收重新拉取后不再被引用的旧blob"""
+        digests = image_blob_digests(info)
+        if not digests:
+            return 0
+        return self._update(cache_path, digests)
+
+    def release(self, cache_path):
+        """删除镜像时释放其引用，回收不再被任何镜像引用的blob，返回释放的字节数"""
+        return self._update(cache_path, None)
+
+    def _update(self, cache_path, digests):
+        key = self._key(cache_path)
+        released = []
+
+        def mutate(data):
+            old = data.pop(key, [])
+            if digests:
+                data[key] = digests
+            referenced = {digest for entry in data.values() for digest in entry}
+            released[:] = [digest for digest in old if digest not in referenced]
+
+        try:
+            self.state.update(mutate)
+        except OSError as e:
+            logger.warning(f"保存blob引用记录失败: {e}")
+            return 0
+        return self._collect(released)
+
+    def _collect(self, digests):
+        """从存储中删除blob及其文件清单、层提取结果、索引和指向它的tag记录"""
+        if not digests:
+            return 0
+        store = BlobStore(os.path.join(self.cache_dir, 'blobs', 'sha256'))
+        layer_cache = LayerCache(self.cache_dir)
+        freed = 0
+        for digest in digests:
+            layer_cache.remove(digest)
+            path = store.path(digest)
+            listing_path = os.path.join(self.cache_dir, 'blobs', 'listings', digest_hex(digest) + '.json')
+            # 一并删除校验失败时移到一旁的副本
+            for candidate in (path, path + '.corrupt', listing_path):
+                try:
+                    size = os.path.getsize(candidate)
+                    os.remove(candidate)
+                except OSError:
+                    continue
+                if candidate != listing_path:
+                    freed += size
+        BlobIndex(os.path.join(self.cache_dir, 'blobs', 'index.json')).forget(digests)
+        TagIndex(os.path.join(self.cache_dir, 'blobs', 'tags.json')).forget(digests)
+        logger.info(f"回收 {len(digests)} 个不再被引用的blob，释放 {freed / 1024 / 1024:.2f} MB")
+        return freed
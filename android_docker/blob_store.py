@@ -0,0 +1,753 @@
+#!/usr/bin/env python3
+"""
+blob存储与断点续传
+已完成的blob按digest保存在缓存目录中，未完成的下载保存为 <digest>.partial，
+并在 <digest>.partial.json 中记录已落盘的长度，下次拉取时用Range请求继续下载。
+下载过程中边写边计算digest，只有校验通过的blob才会以digest命名。
+大blob可拆成多个Range并行下载（RangedBlob），完成后整体校验。
+存储在多个进程间共享，同一blob的下载（从检查断点到提交）在 BlobLock（<digest>.lock 上的flock）内进行。
+BlobIndex 记录每个blob来自哪些registry/仓库，同一registry的其他镜像可直接复用共享的基础层；
+存储中的blob在提交时或第一次复用时校验digest，BlobIndex 记下校验过的文件（大小和mtime），之后复用不再计算。
+manifest也按digest保存在存储中，TagIndex 记录tag指向的manifest。
+流水线模式下，BlobStream 可以在blob仍在下载时跟随文件读取数据（分段下载的blob读取从头开始已连续完成的部分）
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台只有进程内的保护
+    fcntl = None
+
+from .registry_cache import JsonStateFile
+
+logger = logging.getLogger(__name__)
+
+
+def digest_hex(digest):
+    """去掉 sha256: 前缀，得到用作文件名的十六进制部分"""
+    if digest.startswith('sha256:'):
+        return digest[7:]
+    return digest
+
+
+def file_digest(path, algorithm='sha256'):
+    """计算文件的digest（"<算法>:<hex>"）；算法不受支持时返回None"""
+    if algorithm not in hashlib.algorithms_guaranteed:
+        return None
+    hasher = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return f"{algorithm}:{hasher.hexdigest()}"
+
+
+def parse_content_range_start(value):
+    """解析 Content-Range: bytes <start>-<end>/<total> 中的起始偏移"""
+    if not value or not value.startswith('bytes '):
+        return None
+    try:
+        return int(value[6:].split('-', 1)[0])
+    except ValueError:
+        return None
+
+
+class BlobDigestMismatch(Exception):
+    """下载内容与manifest中的digest或大小不一致"""
+
+
+class BlobDownloadCancelled(Exception):
+    """并发下载中其他blob失败，当前下载被取消"""
+
+
+class BlobLock:
+    """同一blob跨进程的排他锁（对 <path>.lock 加 flock）
+
+    持有者独占该blob的断点文件和最终文件的写入；等待者拿到锁后应先检查blob是否已被持有者提交。
+    """
+
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, path):
+        self.path = path + '.lock'
+        self._fd = None
+
+    def acquire(self, blocking=True, cancel_event=None):
+        """获取锁；blocking 为 False 时锁被占用立即返回False。等待期间 cancel_event 被设置时抛出 BlobDownloadCancelled"""
+        if fcntl is None:
+            return True
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if not blocking:
+                        os.close(fd)
+                        return False
+                if cancel_event is not None and cancel_event.wait(self.POLL_INTERVAL):
+                    raise BlobDownloadCancelled(f"等待blob锁时下载已取消: {self.path}")
+                elif cancel_event is None:
+                    time.sleep(self.POLL_INTERVAL)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class PartialBlob:
+    """可断点续传的blob下载文件
+
+    数据写入 <path>.partial，已确认落盘（fsync）的长度记录在 <path>.partial.json；
+    写入的同时计算digest，下载完成并校验通过后原子地重命名为 <path>。
+    调用方需在 BlobLock 内从 resume_offset() 执行到 commit()，否则其他进程可能同时截断或写入断点文件。
+    """
+
+    CHECKPOINT_BYTES = 4 * 1024 * 1024
+
+    def __init__(self, path, digest=None, size=None):
+        self.path = path
+        self.partial_path = path + '.partial'
+        self.meta_path = self.partial_path + '.json'
+        self.digest = digest
+        self.size = size
+        self.length = 0
+        self.verified_digest = None
+        self._checkpointed = 0
+        self._file = None
+        self._reset_hasher()
+
+    def _reset_hasher(self):
+        algorithm = self.digest.split(':', 1)[0] if self.digest and ':' in self.digest else None
+        self._hasher = hashlib.new(algorithm) if algorithm in hashlib.algorithms_guaranteed else None
+        self._hashed = 0
+
+    def _hash_file_until(self, length):
+        """对文件中尚未计算过的部分补算digest（续传的前缀、curl写入的数据）"""
+        if self._hasher is None or self._hashed >= length:
+            return
+        with open(self.partial_path, 'rb') as f:
+            f.seek(self._hashed)
+            remaining = length - self._hashed
+            while remaining > 0:
+                chunk = f.read(min(1024 * 1024, remaining))
+                if not chunk:
+                    break
+                self._hasher.update(chunk)
+                remaining -= len(chunk)
+        self._hashed = length - remaining
+
+    def _load_meta(self):
+        try:
+            with open(self.meta_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_meta(self):
+        meta = {'digest': self.digest, 'size': self.size, 'length': self.length}
+        tmp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def resume_offset(self):
+        """返回可以续传的起始偏移；与记录不一致的断点文件会被丢弃"""
+        meta = self._load_meta()
+        if not meta or not os.path.exists(self.partial_path):
+            self.discard()
+            return 0
+
+        recorded = meta.get('length', 0)
+        actual = os.path.getsize(self.partial_path)
+        if (meta.get('digest') != self.digest or actual < recorded
+                or (self.size and recorded > self.size)):
+            logger.warning(f"断点文件与记录不一致，重新下载: {self.partial_path}")
+            self.discard()
+            return 0
+
+        if actual > recorded:
+            # 记录之后写入的尾部可能没有完整落盘，截掉后再续传
+            with open(self.partial_path, 'r+b') as f:
+                f.truncate(recorded)
+        self.length = recorded
+        return recorded
+
+    def open(self, offset=0):
+        """从offset处开始写入；offset为0时清空已有内容"""
+        if offset and os.path.exists(self.partial_path):
+            self._file = open(self.partial_path, 'r+b')
+        else:
+            offset = 0
+            self._file = open(self.partial_path, 'wb')
+        self._file.seek(offset)
+        self._file.truncate()
+        self.length = offset
+        self._checkpointed = offset
+        self._reset_hasher()
+        self._hash_file_until(offset)
+        self._save_meta()
+
+    def restart(self):
+        """服务器忽略了Range请求时，从头开始写入"""
+        self._file.seek(0)
+        self._file.truncate()
+        self.length = 0
+        self._checkpointed = 0
+        self._reset_hasher()
+        self._save_meta()
+
+    def write(self, chunk):
+        if self.size is not None and self.length + len(chunk) > self.size:
+            raise BlobDigestMismatch(f"blob大小超过manifest声明的 {self.size} 字节: {self.digest}")
+        self._file.write(chunk)
+        if self._hasher is not None:
+            self._hasher.update(chunk)
+            self._hashed += len(chunk)
+        self.length += len(chunk)
+        if self.length - self._checkpointed >= self.CHECKPOINT_BYTES:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """把已写入的数据落盘并记录长度"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._checkpointed = self.length
+        self._save_meta()
+
+    def close(self):
+        if self._file is None:
+            return
+        try:
+            self.checkpoint()
+        finally:
+            self._file.close()
+            self._file = None
+
+    def record_file_length(self, length=None):
+        """由外部进程（curl）写入后，记录文件长度；length小于文件长度时先截断"""
+        if length is not None and os.path.getsize(self.partial_path) > length:
+            with open(self.partial_path, 'r+b') as f:
+                f.truncate(length)
+        self.length = os.path.getsize(self.partial_path)
+        self._save_meta()
+
+    def verify(self):
+        """校验大小和digest，不一致时丢弃断点文件并抛出 BlobDigestMismatch"""
+        if self.size is not None and self.length != self.size:
+            self.discard()
+            raise BlobDigestMismatch(f"blob大小不匹配: {self.digest} 期望 {self.size} 字节")
+        if self._hasher is None:
+            logger.warning(f"不支持的digest算法，跳过校验: {self.digest}")
+            return None
+        self._hash_file_until(self.length)
+        actual = f"{self._hasher.name}:{self._hasher.hexdigest()}"
+        if actual != self.digest:
+            self.discard()
+            raise BlobDigestMismatch(f"blob digest不匹配: 期望 {self.digest}, 实际 {actual}")
+        self.verified_digest = actual
+        return actual
+
+    def commit(self):
+        """下载完成：校验digest后原子地重命名为最终文件"""
+        self.close()
+        self.verify()
+        os.replace(self.partial_path, self.path)
+        if os.path.exists(self.meta_path):
+            os.remove(self.meta_path)
+        return self.path
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for path in (self.partial_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.length = 0
+
+
+class RangedBlob:
+    """按字节范围并行下载的blob文件
+
+    数据文件 <path>.ranges 预分配到完整大小，各分片用 pwrite 写入各自的偏移，
+    分片进度记录在 <path>.ranges.json，中断后各分片从记录处继续。
+    全部完成后整体校验digest，再原子地重命名为 <path>。
+    下载中的分段blob登记在本进程内，BlobStream 可以读取从头开始已连续写入的部分。
+    与 PartialBlob 一样，调用方需在 BlobLock 内从 prepare() 执行到 commit()。
+    """
+
+    CHECKPOINT_BYTES = 4 * 1024 * 1024
+    # 本进程中正在下载的分段blob：数据文件路径 -> RangedBlob
+    _active = {}
+    _active_lock = threading.Lock()
+
+    def __init__(self, path, digest, size, part_count):
+        self.path = path
+        self.data_path = path + '.ranges'
+        self.meta_path = self.data_path + '.json'
+        self.digest = digest
+        self.size = size
+        self.part_count = part_count
+        self.parts = []
+        self.resumed = False
+        self.verified_digest = None
+        self._fd = None
+        self._unsynced = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def available(cls, data_path):
+        """正在下载的分段blob从头开始已连续写入的字节数；不在下载中时返回None"""
+        with cls._active_lock:
+            ranged = cls._active.get(data_path)
+        if ranged is None:
+            return None
+        available = 0
+        with ranged._lock:
+            for start, end, written in ranged.parts:
+                available = start + written
+                if available < end:
+                    break
+        return available
+
+    def _register(self, active):
+        with self._active_lock:
+            if active:
+                self._active[self.data_path] = self
+            elif self._active.get(self.data_path) is self:
+                del self._active[self.data_path]
+
+    def _split(self):
+        part_size = -(-self.size // self.part_count)
+        return [[start, min(start + part_size, self.size), 0] for start in range(0, self.size, part_size)]
+
+    def _load_parts(self):
+        try:
+            with open(self.meta_path, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (meta.get('digest') != self.digest or meta.get('size') != self.size
+                or not os.path.exists(self.data_path) or os.path.getsize(self.data_path) != self.size):
+            return None
+        return meta.get('parts') or None
+
+    def _save_meta(self, parts):
+        tmp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'digest': self.digest, 'size': self.size, 'parts': parts}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def prepare(self):
+        """打开（必要时创建并预分配）数据文件，返回未完成分片的 (序号, 起始偏移, 结束偏移) 列表"""
+        parts = self._load_parts()
+        self.resumed = parts is not None
+        if parts is None:
+            self.discard()
+            parts = self._split()
+        self.parts = parts
+        self._fd = os.open(self.data_path, os.O_RDWR | os.O_CREAT, 0o644)
+        if not self.resumed:
+            try:
+                os.posix_fallocate(self._fd, 0, self.size)
+            except (AttributeError, OSError):
+                # 文件系统不支持预分配时退化为稀疏文件
+                os.ftruncate(self._fd, self.size)
+        self._save_meta(parts)
+        self._register(True)
+        return [(index, start + written, end)
+                for index, (start, end, written) in enumerate(parts) if start + written < end]
+
+    def write(self, index, chunk):
+        """把分片数据写入其当前偏移（可由多个线程并发调用）"""
+        start, end, written = self.parts[index]
+        position = start + written
+        if position + len(chunk) > end:
+            raise BlobDigestMismatch(f"分片数据超出请求的范围: {self.digest}")
+        view = memoryview(chunk)
+        while view:
+            count = os.pwrite(self._fd, view, position)
+            view = view[count:]
+            position += count
+        with self._lock:
+            self.parts[index][2] += len(chunk)
+            self._unsynced += len(chunk)
+            checkpoint = self._unsynced >= self.CHECKPOINT_BYTES
+        if checkpoint:
+            self.checkpoint()
+
+    def remaining(self, index):
+        start, end, written = self.parts[index]
+        return end - start - written
+
+    def checkpoint(self):
+        """先取进度快照再落盘，记录的进度不会超过已落盘的数据"""
+        with self._lock:
+            snapshot = [list(part) for part in self.parts]
+            self._unsynced = 0
+        os.fsync(self._fd)
+        self._save_meta(snapshot)
+
+    def close(self):
+        self._register(False)
+        if self._fd is None:
+            return
+        try:
+            self.checkpoint()
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def commit(self):
+        """所有分片完成后整体校验digest，通过后重命名为最终文件"""
+        self.close()
+        actual = file_digest(self.data_path, self.digest.split(':', 1)[0])
+        if actual is None:
+            logger.warning(f"不支持的digest算法，跳过校验: {self.digest}")
+        else:
+            if actual != self.digest:
+                self.discard()
+                raise BlobDigestMismatch(f"blob digest不匹配: 期望 {self.digest}, 实际 {actual}")
+            self.verified_digest = actual
+        os.replace(self.data_path, self.path)
+        if os.path.exists(self.meta_path):
+            os.remove(self.meta_path)
+        return self.path
+
+    def discard(self):
+        self._register(False)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        for path in (self.data_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class BlobStore:
+    """按digest保存blob的目录（<root>/<hex>），跨多次拉取保留"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest_hex(digest))
+
+    def has(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def verify(self, digest):
+        """重新计算已存储blob的digest，一致（或算法不受支持）时返回True"""
+        actual = file_digest(self.path(digest), digest.split(':', 1)[0])
+        return actual is None or actual == digest
+
+    def quarantine(self, digest, checked_stat=None):
+        """把损坏的blob移到 <hex>.corrupt，腾出位置重新下载
+
+        在该blob的 BlobLock 内进行，不会与其他进程的下载提交交错；文件在检查之后已被替换（与 checked_stat 不同）时保留。
+        已打开该文件的读取方不受影响。返回是否移走了文件。
+        """
+        path = self.path(digest)
+        with BlobLock(path):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                return False
+            if checked_stat is not None and (st.st_ino, st.st_mtime_ns) != (checked_stat.st_ino,
+                                                                            checked_stat.st_mtime_ns):
+                return False
+            os.replace(path, path + '.corrupt')
+        logger.warning(f"已将损坏的blob移到 {path}.corrupt")
+        return True
+
+    def link_into(self, digest, target_dir):
+        """把blob放进OCI目录：优先硬链接，跨文件系统时复制"""
+        source = self.path(digest)
+        target = os.path.join(target_dir, digest_hex(digest))
+        if os.path.abspath(source) == os.path.abspath(target) or os.path.exists(target):
+            return target
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+        return target
+
+
+class BlobIndex:
+    """blob存储的digest索引（<cache_dir>/blobs/index.json）
+
+    与仓库无关地记录已获取的每个blob：大小、media type、来源 registry -> 仓库列表和最近使用时间，
+    以及校验过digest的文件（verified: [大小, mtime_ns]）。
+    """
+
+    def __init__(self, path):
+        self.state = JsonStateFile(path)
+
+    def get(self, digest):
+        return self.state.load().get(digest)
+
+    def record(self, registry, repository, blobs):
+        """记录一次拉取用到的blob；blobs 为 (digest, size, media_type) 列表"""
+        now = time.time()
+
+        def mutate(data):
+            for digest, size, media_type in blobs:
+                entry = data.setdefault(digest, {})
+                if size:
+                    entry['size'] = size
+                if media_type:
+                    entry['media_type'] = media_type
+                repositories = entry.setdefault('sources', {}).setdefault(registry, [])
+                if repository not in repositories:
+                    repositories.append(repository)
+                entry['last_used'] = now
+
+        try:
+            self.state.update(mutate)
+        except OSError as e:
+            logger.debug(f"保存blob索引失败: {e}")
+
+    def is_verified(self, digest, st):
+        """该blob文件（os.stat 结果）是否已校验过digest；文件被替换或修改后需要重新校验"""
+        entry = self.get(digest) or {}
+        return entry.get('verified') == [st.st_size, st.st_mtime_ns]
+
+    def mark_verified(self, blobs):
+        """记录已校验digest的blob；blobs 为 (digest, 文件路径) 列表"""
+        marks = {}
+        for digest, path in blobs:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            marks[digest] = [st.st_size, st.st_mtime_ns]
+
+        def mutate(data):
+            for digest, mark in marks.items():
+                data.setdefault(digest, {})['verified'] = mark
+
+        if not marks:
+            return
+        try:
+            self.state.update(mutate)
+        except OSError as e:
+            logger.debug(f"保存blob索引失败: {e}")
+
+    def forget(self, digests):
+        """删除已从存储中回收的blob的记录"""
+        def mutate(data):
+            for digest in digests:
+                data.pop(digest, None)
+
+        try:
+            self.state.update(mutate)
+        except OSError as e:
+            logger.debug(f"保存blob索引失败: {e}")
+
+
+class TagIndex:
+    """tag到manifest digest的记录（<cache_dir>/blobs/tags.json），manifest本身按digest保存在blob存储中
+
+    键为 "<registry>/<仓库>:<tag>"，供 serve-cache 按tag返回已拉取的manifest。
+    """
+
+    def __init__(self, path):
+        self.state = JsonStateFile(path)
+
+    def record(self, registry, repository, tag, digest, media_type):
+        entry = {'registry': registry, 'repository': repository, 'tag': tag,
+                 'digest': digest, 'media_type': media_type, 'updated_at': time.time()}
+
+        def mutate(data):
+            data[f"{registry}/{repository}:{tag}"] = entry
+
+        try:
+            self.state.update(mutate)
+        except OSError as e:
+            logger.debug(f"保存tag记录失败: {e}")
+
+    def forget(self, digests):
+        """删除指向已回收manifest的tag记录"""
+        digests = set(digests)
+
+        def mutate(data):
+            for key in [key for key, entry in data.items() if entry.get('digest') in digests]:
+                del data[key]
+
+        try:
+            self.state.update(mutate)
+        except OSError as e:
+            logger.debug(f"保存tag记录失败: {e}")
+
+    def get(self, registry, repository, tag):
+        """按规范化的 registry、仓库名和tag精确查找，找不到返回None"""
+        return self.state.load().get(f"{registry}/{repository}:{tag}")
+
+    def resolve(self, name, tag, default_registry='docker.io'):
+        """按请求的仓库名查找tag；仓库名可带registry前缀（如 ghcr.io/owner/app），找不到返回None"""
+        data = self.state.load()
+        registry, _, repository = name.partition('/')
+        if repository and ('.' in registry or ':' in registry or registry == 'localhost'):
+            entry = data.get(f"{registry}/{repository}:{tag}")
+            if entry:
+                return entry
+        entry = data.get(f"{default_registry}/{name}:{tag}")
+        if entry:
+            return entry
+        # 其他registry下同名仓库的镜像
+        matches = [e for e in data.values() if e.get('repository') == name and e.get('tag') == tag]
+        return max(matches, key=lambda e: e.get('updated_at', 0)) if matches else None
+
+
+class DownloadTracker:
+    """记录流水线中各blob的下载状态，供 BlobStream 等待和感知失败"""
+
+    def __init__(self, pending_digests, cancel_event):
+        self._pending = set(pending_digests)
+        self._errors = {}
+        self._cond = threading.Condition()
+        self.cancel_event = cancel_event
+
+    def finish(self, digest, error=None):
+        with self._cond:
+            self._pending.discard(digest)
+            if error is not None:
+                self._errors[digest] = error
+            self._cond.notify_all()
+
+    def is_done(self, digest):
+        with self._cond:
+            return digest not in self._pending
+
+    def check(self, digest):
+        """该blob下载失败，或整体下载已取消时抛出异常"""
+        with self._cond:
+            error = self._errors.get(digest)
+            pending = digest in self._pending
+        if error is not None:
+            raise error
+        if pending and self.cancel_event.is_set():
+            raise BlobDownloadCancelled(f"下载已取消: {digest}")
+
+    def wait(self, digest):
+        """等待blob下载结束；失败时抛出下载错误"""
+        with self._cond:
+            while digest in self._pending:
+                self._cond.wait()
+        self.check(digest)
+
+
+class BlobStream(io.RawIOBase):
+    """跟随正在下载的blob读取数据的只读流
+
+    先读 <path>.partial，下载完成后文件被重命名为 <path>（已打开的文件描述符仍然有效）；
+    断点文件被丢弃重建时，按当前位置重新打开（同一digest的内容相同）。
+    分段下载的 <path>.ranges 预分配到完整大小，只读取从头开始已连续写入的部分，
+    后面的分段要等前面的分段写完才可读，完成并重命名为 <path> 后不再限制。
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, path, digest, tracker):
+        super().__init__()
+        self.path = path
+        self.partial_path = path + '.partial'
+        self.ranges_path = path + '.ranges'
+        self.digest = digest
+        self.tracker = tracker
+        self._file = None
+        self._ranged = False
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def _open_current(self):
+        for candidate in (self.path, self.partial_path, self.ranges_path):
+            try:
+                f = open(candidate, 'rb')
+            except FileNotFoundError:
+                continue
+            f.seek(self._pos)
+            self._ranged = candidate == self.ranges_path
+            return f
+        return None
+
+    def _is_stale(self):
+        """持有的文件已不是当前的下载文件（断点被丢弃后重新创建）"""
+        for candidate in (self.path, self.partial_path, self.ranges_path):
+            try:
+                return os.stat(candidate).st_ino != os.fstat(self._file.fileno()).st_ino
+            except FileNotFoundError:
+                continue
+        return False
+
+    def _readable_end(self):
+        """当前文件可读到的位置；None 表示不限"""
+        if not self._ranged:
+            return None
+        available = RangedBlob.available(self.ranges_path)
+        if available is not None:
+            return available
+        # 不在下载中：已校验并重命名为最终文件时可以读完，否则（重试之间、已丢弃）等待
+        try:
+            if os.stat(self.path).st_ino == os.fstat(self._file.fileno()).st_ino:
+                self._ranged = False
+                return None
+        except FileNotFoundError:
+            pass
+        return self._pos
+
+    def readinto(self, buffer):
+        while True:
+            self.tracker.check(self.digest)
+            # 先取完成状态再读：完成后读到EOF才是真正的结尾
+            done = self.tracker.is_done(self.digest)
+            if self._file is None:
+                self._file = self._open_current()
+            if self._file is not None:
+                end = self._readable_end()
+                view = memoryview(buffer) if end is None else memoryview(buffer)[:max(0, end - self._pos)]
+                n = self._file.readinto(view) if len(view) else 0
+                if n:
+                    self._pos += n
+                    return n
+                if self._is_stale():
+                    self._file.close()
+                    self._file = None
+                    continue
+                if done and end is None:
+                    return 0
+            elif done:
+                raise FileNotFoundError(self.path)
+            time.sleep(self.POLL_INTERVAL)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        super().close()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+本地镜像缓存的只读OCI registry
+通过OCI distribution规范中的GET/HEAD接口提供已拉取的manifest和blob：
+    GET /v2/
+    GET|HEAD /v2/<name>/manifests/<tag或digest>
+    GET|HEAD /v2/<name>/blobs/<digest>（支持Range，可断点续传和分段下载）
+局域网内的其他设备把它配置为mirror后，同一blob只需经WAN下载一次。
+"""
+
+import json
+import logging
+import os
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .blob_store import BlobIndex, BlobStore, TagIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SERVE_PORT = 5000
+OCI_MANIFEST = 'application/vnd.oci.image.manifest.v1+json'
+
+_ROUTE = re.compile(r'^/v2/(?P<name>[a-z0-9._/-]+)/(?P<kind>manifests|blobs)/(?P<reference>[A-Za-z0-9_.:-]+)$')
+_DIGEST = re.compile(r'^sha256:[a-f0-9]{64}$')
+_RANGE = re.compile(r'^bytes=(\d+)-(\d*)$')
+
+
+class CacheRegistryHandler(BaseHTTPRequestHandler):
+    """处理registry请求；cache_dir 由 CacheRegistryServer 提供"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'android-docker-cache'
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    @property
+    def store(self):
+        return self.server.store
+
+    def do_GET(self):
+        self._handle(send_body=True)
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
+    def _handle(self, send_body):
+        path = self.path.split('?', 1)[0]
+        if path in ('/v2', '/v2/'):
+            return self._reply(200, b'{}', {'Content-Type': 'application/json'}, send_body)
+
+        match = _ROUTE.match(path)
+        if not match:
+            return self._error(404, 'NAME_UNKNOWN', '不支持的路径', send_body)
+
+        name, kind, reference = match.group('name', 'kind', 'reference')
+        if kind == 'manifests':
+            return self._serve_manifest(name, reference, send_body)
+        return self._serve_blob(reference, send_body)
+
+    def _serve_manifest(self, name, reference, send_body):
+        media_type = None
+        if _DIGEST.match(reference):
+            digest = reference
+        else:
+            entry = self.server.tags.resolve(name, reference)
+            if not entry:
+                return self._error(404, 'MANIFEST_UNKNOWN', f"未缓存 {name}:{reference}", send_body)
+            digest, media_type = entry['digest'], entry.get('media_type')
+
+        if not self.store.has(digest):
+            return self._error(404, 'MANIFEST_UNKNOWN', f"未缓存 {digest}", send_body)
+        with open(self.store.path(digest), 'rb') as f:
+            data = f.read()
+        if not media_type:
+            media_type = (self.server.index.get(digest) or {}).get('media_type')
+        if not media_type:
+            try:
+                media_type = json.loads(data).get('mediaType') or OCI_MANIFEST
+            except ValueError:
+                return self._error(404, 'MANIFEST_UNKNOWN', f"{digest} 不是manifest", send_body)
+
+        logger.info(f"提供manifest {name}:{reference} -> {self.client_address[0]}")
+        self._reply(200, data, {'Content-Type': media_type, 'Docker-Content-Digest': digest}, send_body)
+
+    def _serve_blob(self, digest, send_body):
+        if not _DIGEST.match(digest) or not self.store.has(digest):
+            return self._error(404, 'BLOB_UNKNOWN', f"未缓存 {digest}", send_body)
+
+        path = self.store.path(digest)
+        size = os.path.getsize(path)
+        start, end, status = 0, size - 1, 200
+        headers = {'Content-Type': 'application/octet-stream', 'Docker-Content-Digest': digest,
+                   'Accept-Ranges': 'bytes'}
+
+        requested = _RANGE.match(self.headers.get('Range') or '')
+        if requested:
+            start = int(requested.group(1))
+            end = min(int(requested.group(2)), size - 1) if requested.group(2) else size - 1
+            if start > end:
+                headers['Content-Range'] = f"bytes */{size}"
+                return self._reply(416, b'', headers, send_body)
+            status = 206
+            headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+
+        length = end - start + 1
+        headers['Content-Length'] = str(length)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        if not send_body:
+            return
+
+        logger.debug(f"提供blob {digest[:19]}（{length} 字节）-> {self.client_address[0]}")
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(remaining, 256 * 1024))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def _error(self, status, code, message, send_body):
+        body = json.dumps({'errors': [{'code': code, 'message': message}]}).encode('utf-8')
+        self._reply(status, body, {'Content-Type': 'application/json'}, send_body)
+
+    def _reply(self, status, body, headers, send_body):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+
+class CacheRegistryServer(ThreadingHTTPServer):
+    """以只读registry的形式提供 <cache_dir>/blobs 中的内容"""
+
+    daemon_threads = True
+
+    def __init__(self, cache_dir, host='0.0.0.0', port=DEFAULT_SERVE_PORT):
+        blobs_dir = os.path.join(cache_dir, 'blobs')
+        self.store = BlobStore(os.path.join(blobs_dir, 'sha256'))
+        self.index = BlobIndex(os.path.join(blobs_dir, 'index.json'))
+        self.tags = TagIndex(os.path.join(blobs_dir, 'tags.json'))
+        super().__init__((host, port), CacheRegistryHandler)
@@ -16,26 +16,159 @@ import json
 import hashlib
 import tarfile
 import gzip
+import io
 import time
+import base64
+import http.client
 from pathlib import Path
 from urllib.parse import urlparse
 import platform
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .blob_store import (BlobDigestMismatch, BlobDownloadCancelled, BlobIndex, BlobLock, BlobStore, BlobStream,
+                         DownloadTracker, PartialBlob, RangedBlob, TagIndex, parse_content_range_start)
+from .http_transport import (DEFAULT_CONNECT_TIMEOUT, LOW_SPEED_LIMIT, LOW_SPEED_TIME, HttpTransport,
+                             HttpTransportError, RetryPolicy, is_transient_error)
+from .image_reference import ImageReference
+from .incremental_rootfs import LayerListingCache, common_prefix_length, normalize_member_name
+from .layer_cache import LAYER_CACHE_ENV, LayerCache, layer_cache_enabled
+from .layer_compression import detect_layer_compression, open_layer_tar, open_zstd_stream, sniff_layer_compression
+from .manifest_cache import ManifestCache, OfflineImageUnavailable, OfflineRegistryClient
+from .pull_progress import NULL_BLOB_PROGRESS, PROGRESS_MODES, PullProgress
+from .registry_cache import (ChallengeCache, RateLimitBudget, TokenCache, parse_auth_challenge, parse_retry_after,
+                             same_auth_challenge)
+from .registry_mirrors import DOCKER_HUB, MirrorSelector, RegistryEndpoint, normalize_registry_host
+from .rootfs_snapshot import (IMAGE_STORE_ENV, IMAGE_STORES, commit_snapshot, copy_tree, discard_snapshot,
+                              resolve_image_store, tree_size)
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+HTTP_BACKEND_ENV = "ANDROID_DOCKER_HTTP_BACKEND"
+PIPELINE_ENV = "ANDROID_DOCKER_PULL_PIPELINE"
+DEFAULT_MAX_CONCURRENT_DOWNLOADS = 3
+HTTP_BACKENDS = ('native', 'curl')
+
+
+def resolve_http_backend(backend=None):
+    """确定HTTP后端：显式参数 > ANDROID_DOCKER_HTTP_BACKEND > native
+
+    原生传输不支持socks代理，此时自动回退到curl。
+    """
+    backend = (backend or os.environ.get(HTTP_BACKEND_ENV) or 'native').strip().lower()
+    if backend not in HTTP_BACKENDS:
+        logger.warning(f"未知的HTTP后端 '{backend}'，使用 native")
+        backend = 'native'
+    if backend == 'native' and not HttpTransport.is_proxy_supported():
+        logger.info("检测到原生传输不支持的代理类型，回退到curl后端")
+        backend = 'curl'
+    return backend
+
+
+# 拉取元数据文件后缀（<输出文件>.pull.json）
+PULL_INFO_SUFFIX = '.pull.json'
+
+# curl在服务器不支持续传时的退出码
+CURL_RANGE_ERROR = 33
+
+
+# 可重试的HTTP状态码和curl退出码（连接失败、超时、传输中断、低速等）
+RETRYABLE_STATUSES = (408, 500, 502, 503, 504)
+CURL_RETRYABLE_ERRORS = (6, 7, 18, 28, 35, 52, 55, 56)
+
+
+class RangeRequestIgnored(Exception):
+    """服务器忽略了Range请求，返回了完整内容"""
+
+
+class RegistryHTTPError(RuntimeError):
+    """registry返回了错误状态码"""
+
+    def __init__(self, status_code, body=''):
+        super().__init__(f"HTTP {status_code}: {body}")
+        self.status_code = status_code
+
+
+class RateLimitExhausted(RuntimeError):
+    """registry的拉取配额已用尽（收到429，或记录的剩余配额不足）"""
+
+    def __init__(self, registry, retry_after):
+        super().__init__(f"{registry} 拉取配额已用尽，约 {retry_after:.0f} 秒后恢复")
+        self.registry = registry
+        self.retry_after = retry_after
+
+
+def is_retryable_error(error):
+    """判断错误是否为可通过重试恢复的临时故障"""
+    if isinstance(error, RegistryHTTPError):
+        return error.status_code in RETRYABLE_STATUSES
+    if isinstance(error, subprocess.CalledProcessError):
+        return error.returncode in CURL_RETRYABLE_ERRORS
+    return is_transient_error(error)
+
+
 class DockerRegistryClient:
-    """Docker Registry API客户端，使用curl下载镜像"""
+    """Docker Registry API客户端，默认使用原生连接池传输，curl作为后备后端"""
+
+    # 不小于该大小的blob拆成多个Range并行下载（仅原生后端）
+    RANGED_DOWNLOAD_THRESHOLD = 64 * 1024 * 1024
+    RANGED_DOWNLOAD_PARTS = 4
+    # 一次拉取最多发出的计入配额的manifest GET请求数（manifest list + 子manifest）
+    MANIFEST_REQUESTS_PER_PULL = 2
 
-    def __init__(self, registry_url, image_name, tag='latest', username=None, password=None):
+    def __init__(self, registry_url, image_name, tag='latest', username=None, password=None,
+                 backend=None, transport=None, token_cache=None, challenge_cache=None, retry_policy=None,
+                 rate_limits=None):
         self.registry_url = registry_url
         self.image_name = image_name
         self.tag = tag
         self.auth_token = None
+        # 跨进程复用的bearer token缓存（可选）
+        self.token_cache = token_cache
+        self._token_from_cache = False
+        # 每个registry的认证质询缓存（可选），用于跳过匿名探测
+        self.challenge_cache = challenge_cache
+        self._challenge = None
+        self._challenge_from_cache = False
+        # get_manifest() 获取到的tag对应的manifest digest
+        self.manifest_digest = None
+        # get_manifest() 获取到的原始manifest内容
+        self.manifest_body = None
         self.user_agent = 'docker-rootfs-creator/1.0'
         self.username = username
         self.password = password
+        self.backend = 'native' if transport is not None else resolve_http_backend(backend)
+        self.transport = transport
+        if self.backend == 'native' and self.transport is None:
+            self.transport = HttpTransport(user_agent=self.user_agent)
+        self.retry_policy = retry_policy or RetryPolicy()
+        # 跨进程共享的拉取配额记录（可选），用于在429之前推迟manifest请求
+        self.rate_limits = rate_limits
+        # 推送时token需要push权限，并可读取跨仓库挂载的来源仓库
+        self.push_access = False
+        self.mount_sources = []
+
+    def _with_retries(self, action, description, cancel_event=None):
+        """执行action，遇到临时故障时按指数退避加随机抖动重试；下载类操作会从断点继续"""
+        attempt = 1
+        while True:
+            try:
+                return action()
+            except Exception as e:
+                if attempt >= self.retry_policy.attempts or not is_retryable_error(e):
+                    raise
+                if cancel_event is not None and cancel_event.is_set():
+                    raise
+                delay = self.retry_policy.delay(attempt)
+                logger.warning(f"{description}失败（第{attempt}次）: {e}，{delay:.1f}秒后重试")
+                if cancel_event is not None:
+                    if cancel_event.wait(delay):
+                        raise BlobDownloadCancelled(f"下载已取消: {description}")
+                else:
+                    time.sleep(delay)
+                attempt += 1
 
     def _run_curl_command(self, cmd, print_cmd=True):
         """执行并打印curl命令"""
@@ -64,122 +197,9 @@ class DockerRegistryClient:
 ---\n{e.stderr.strip()}""")
             raise
 
-    def _get_auth_token(self, www_authenticate_header):
-        """从WWW-Authenticate头获取认证token"""
-        if not www_authenticate_header:
-            return None
-
-        # 解析Bearer token信息
-        if www_authenticate_header.startswith('Bearer '):
-            auth_info = {}
-            bearer_info = www_authenticate_header[7:]  # 移除'Bearer '
-
-            for item in bearer_info.split(','):
-                if '=' in item:
-                    key, value = item.split('=', 1)
-                    auth_info[key.strip()] = value.strip('"')
-
-            if 'realm' in auth_info:
-                # 构建认证URL
-                auth_url = auth_info['realm']
-                params = []
-                if 'service' in auth_info:
-                    params.append(f"service={auth_info['service']}")
-                if 'scope' in auth_info:
-                    params.append(f"scope={auth_info['scope']}")
-
-                if params:
-                    auth_url += '?' + '&'.join(params)
-
-                # 使用curl获取token
-                try:
-                    cmd = ['curl', '-v'] # Token获取不需要-i
-                    if self.username and self.password:
-                        cmd.extend(['-u', f'{self.username}:{self.password}'])
-                    cmd.extend(['-H', f'User-Agent: {self.user_agent}', auth_url])
-                    
-                    # 为了简单起见，我们直接调用，不再通过_run_curl_command
-                    # 因为代理已经通过环境变量设置
-                    logger.info("""---
-[ 步骤 2/3: 获取认证Token ]
----""")
-                    result = self._run_curl_command(cmd)
-                    token_data = json.loads(result.stdout)
-                    return token_data.get('token')
-                except (subprocess.CalledProcessError, json.JSONDecodeError) as e:
-                    logger.warning(f"获取认证token失败: {e}")
-                    # 在失败时打印可手动执行的命令
-                    if isinstance(e, subprocess.CalledProcessError):
-                        logger.warning(f"您可以手动运行以下命令测试token获取:\n{' '.join(cmd)}")
-                    return None
-
-        return None
-
-    def _make_registry_request(self, path, headers=None, output_file=None):
-        """向registry发送请求，处理认证"""
-        # 步骤1：先发一个请求获取认证头
-        if not self.auth_token:
-            url = f"{self.registry_url}/v2/{path}"
-            cmd = ['curl', '-v', '-i', '--insecure', url]
-            logger.info("""---
-[ 步骤 1/3: 探测认证服务器 ]
----""")
-            result = self._run_curl_command(cmd)
-            
-            auth_header = None
-            for line in result.stdout.split('\n'):
-                if line.lower().startswith('www-authenticate:'):
-                    auth_header = line.split(':', 1)[1].strip()
-                    break
-            
-            if auth_header:
-                # 步骤2：使用认证头获取token
-                token = self._get_auth_token(auth_header)
-                if token:
-                    self.auth_token = token
-                    logger.info("✓ 成功获取认证Token")
-                else:
-                    logger.error("✗ 获取认证Token失败，将尝试匿名访问...")
-            else:
-                logger.warning("未找到 'Www-Authenticate' 头，尝试匿名请求...")
-
-        # 步骤3：使用token（或匿名）发送最终请求
-        url = f"{self.registry_url}/v2/{path}"
-        cmd = ['curl', '-v', '-i', '--insecure', '-H', f'User-Agent: {self.user_agent}']
-
-        # Always include comprehensive Accept headers for manifest requests
-        # This ensures compatibility with both OCI and Docker v2 registries
-        if 'manifests' in path:
-            comprehensive_accept = ', '.join([
-                'application/vnd.oci.image.manifest.v1+json',
-                'application/vnd.oci.image.index.v1+json',
-                'application/vnd.docker.distribution.manifest.v2+json',
-                'application/vnd.docker.distribution.manifest.list.v2+json'
-            ])
-            cmd.extend(['-H', f'Accept: {comprehensive_accept}'])
-
-        if headers:
-            for key, value in headers.items():
-                # Skip Accept header if we already added comprehensive one
-                if key.lower() == 'accept' and 'manifests' in path:
-                    continue
-                cmd.extend(['-H', f'{key}: {value}'])
-
-        if self.auth_token:
-            cmd.extend(['-H', f'Authorization: Bearer {self.auth_token}'])
-
-        if output_file:
-            cmd.extend(['-o', output_file])
-
-        cmd.append(url)
-        logger.info("""---
-[ 步骤 3/3: 获取镜像Manifest ]
----""")
-        result = self._run_curl_command(cmd)
-
-        # 解析响应，处理可能存在的多个HTTP头（例如重定向）
-        response_text = result.stdout
-        
+    @staticmethod
+    def _parse_curl_response(response_text):
+        """解析curl -i / -D - 的输出，处理可能存在的多个HTTP头（例如重定向）"""
         # 找到最后一个HTTP头块
         last_header_block_start = response_text.rfind('HTTP/')
         
@@ -215,22 +235,313 @@ class DockerRegistryClient:
                 key, value = line.split(':', 1)
                 response_headers[key.strip().lower()] = value.strip()
 
-        # 如果需要认证且还没有token
-        # 由于我们已经预先获取了token，这里不再需要处理401
-
-        if status_code >= 400:
-            raise Exception(f"HTTP {status_code}: {body}")
-
         return {
             'status_code': status_code,
             'headers': response_headers,
             'body': body
         }
 
-    def get_manifest(self):
-        """获取镜像manifest"""
-        logger.info(f"获取镜像manifest: {self.image_name}:{self.tag}")
+    def _curl_request(self, method, url, headers=None, output_file=None, verify=True,
+                      follow_redirects=False, credentials=None, resume_from=0):
+        """使用curl发送请求（后备后端）"""
+        cmd = ['curl', '-v', '--connect-timeout', str(DEFAULT_CONNECT_TIMEOUT),
+               '--speed-limit', str(LOW_SPEED_LIMIT), '--speed-time', str(LOW_SPEED_TIME)]
+        if resume_from:
+            cmd.extend(['-C', str(resume_from)])
+        if output_file:
+            # 响应头输出到stdout，响应体写入文件
+            cmd.extend(['-D', '-'])
+        elif method == 'HEAD':
+            cmd.append('-I')
+        else:
+            cmd.append('-i')
+        if method not in ('GET', 'HEAD'):
+            cmd.extend(['-X', method])
+        if not verify:
+            cmd.append('--insecure')
+        if follow_redirects:
+            cmd.append('-L')
+        if credentials:
+            cmd.extend(['-u', credentials])
+        cmd.extend(['-H', f'User-Agent: {self.user_agent}'])
+        for key, value in (headers or {}).items():
+            cmd.extend(['-H', f'{key}: {value}'])
+        if output_file:
+            cmd.extend(['-o', output_file])
+        cmd.append(url)
+
+        result = self._run_curl_command(cmd)
+        return self._parse_curl_response(result.stdout)
+
+    def _http_request(self, method, url, headers=None, output_file=None, verify=True,
+                      follow_redirects=False, credentials=None, cancel_event=None, body=None):
+        """按当前后端发送请求，返回 {'status_code', 'headers', 'body'}
+
+        不带请求体的请求遇到网络故障和 5xx/408 响应时退避重试，重试用尽后抛出异常。
+        带请求体的请求（上传块、PUT）只发送一次：registry可能已处理了失败前的请求，
+        由调用方查询上传状态后决定如何继续。
+        """
+        def send():
+            response = self._http_request_once(method, url, headers, output_file, verify,
+                                               follow_redirects, credentials, cancel_event, body)
+            if response['status_code'] in RETRYABLE_STATUSES:
+                raise RegistryHTTPError(response['status_code'], response['body'])
+            return response
+
+        if body is not None:
+            return send()
+        return self._with_retries(send, f"{method} {url}", cancel_event)
+
+    def _http_request_once(self, method, url, headers=None, output_file=None, verify=True,
+                           follow_redirects=False, credentials=None, cancel_event=None, body=None):
+        if self.backend == 'curl':
+            if body is not None:
+                raise RuntimeError("curl后端不支持发送请求体（推送镜像），请使用原生HTTP后端")
+            response = self._curl_request(
+                method, url, headers=headers, output_file=output_file, verify=verify,
+                follow_redirects=follow_redirects, credentials=credentials,
+            )
+            if output_file and response['status_code'] >= 400 and os.path.exists(output_file):
+                os.remove(output_file)
+            return response
+
+        headers = dict(headers or {})
+        if credentials:
+            headers['Authorization'] = 'Basic ' + base64.b64encode(credentials.encode()).decode()
+        logger.debug(f"{method} {url}")
+
+        if not output_file:
+            return self.transport.request(
+                method, url, headers=headers, body=body, verify=verify, follow_redirects=follow_redirects
+            )
+
+        try:
+            with open(output_file, 'wb') as f:
+                def sink(chunk):
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise BlobDownloadCancelled(f"下载已取消: {url}")
+                    f.write(chunk)
+
+                response = self.transport.request(
+                    method, url, headers=headers, sink=sink, verify=verify,
+                    follow_redirects=follow_redirects,
+                )
+        except Exception:
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            raise
+        if response['status_code'] >= 400 and os.path.exists(output_file):
+            os.remove(output_file)
+        return response
+
+    def _get_auth_token(self, www_authenticate_header):
+        """从WWW-Authenticate头获取认证token"""
+        return self._fetch_token(parse_auth_challenge(www_authenticate_header))
+
+    def _fetch_token(self, challenge):
+        """按认证质询获取bearer token（优先使用缓存），失败返回None"""
+        if not challenge or challenge.get('scheme') != 'bearer' or 'realm' not in challenge:
+            return None
 
+        realm = challenge['realm']
+        service = challenge.get('service')
+        scope = challenge.get('scope')
+        if self.token_cache:
+            token = self.token_cache.get(realm, service, scope, self.username)
+            if token:
+                logger.info("使用缓存的认证Token")
+                self._token_from_cache = True
+                return token
+
+        # 构建认证URL
+        auth_url = realm
+        params = []
+        if service:
+            params.append(f"service={service}")
+        if scope:
+            # 推送时可能同时请求多个仓库的权限，每个scope单独作为一个参数
+            params.extend(f"scope={item}" for item in scope.split(' '))
+
+        if params:
+            auth_url += '?' + '&'.join(params)
+
+        credentials = None
+        if self.username and self.password:
+            credentials = f'{self.username}:{self.password}'
+
+        logger.info("""---
+[ 步骤 2/3: 获取认证Token ]
+---""")
+        try:
+            response = self._http_request('GET', auth_url, credentials=credentials, follow_redirects=True)
+            if response['status_code'] >= 400:
+                raise RuntimeError(f"HTTP {response['status_code']}: {response['body']}")
+            token_data = json.loads(response['body'])
+            if self.token_cache:
+                self.token_cache.put(realm, service, scope, token_data,
+                                     registry=self.registry_url, account=self.username)
+            self._token_from_cache = False
+            return token_data.get('token') or token_data.get('access_token')
+        except (subprocess.CalledProcessError, json.JSONDecodeError, OSError, RuntimeError,
+                HttpTransportError, http.client.HTTPException) as e:
+            logger.warning(f"获取认证token失败: {e}")
+            # 在失败时打印可手动执行的命令
+            if isinstance(e, subprocess.CalledProcessError):
+                logger.warning(f"您可以手动运行以下命令测试token获取:\ncurl -v {auth_url}")
+            return None
+
+    def _auth_scope(self):
+        """token的scope：本仓库的pull（推送时为pull,push），以及跨仓库挂载来源仓库的pull"""
+        actions = 'pull,push' if self.push_access else 'pull'
+        scopes = [f"repository:{self.image_name}:{actions}"]
+        scopes.extend(f"repository:{source}:pull" for source in self.mount_sources if source != self.image_name)
+        return ' '.join(scopes)
+
+    def _scoped(self, challenge):
+        """推送时用本次需要的scope代替认证质询中的scope"""
+        if challenge and self.push_access:
+            return dict(challenge, scope=self._auth_scope())
+        return challenge
+
+    def _apply_challenge(self, challenge):
+        """根据认证质询获取token（或确定匿名访问）"""
+        self._challenge = challenge
+        if challenge:
+            # 步骤2：使用认证头获取token
+            token = self._fetch_token(challenge)
+            if token:
+                self.auth_token = token
+                logger.info("✓ 成功获取认证Token")
+            else:
+                logger.error("✗ 获取认证Token失败，将尝试匿名访问...")
+        else:
+            logger.warning("未找到 'Www-Authenticate' 头，尝试匿名请求...")
+
+    def _authenticate(self, url):
+        """确定认证方式：缓存的token → 缓存的认证质询 → 匿名探测"""
+        # 其他进程已为同一registry和仓库获取过有效token时，跳过探测和token交换
+        if self.token_cache:
+            token = self.token_cache.find(self.registry_url, self._auth_scope(), self.username)
+            if token:
+                logger.info("使用缓存的认证Token，跳过认证探测")
+                self.auth_token = token
+                self._token_from_cache = True
+                return
+
+        cached = self.challenge_cache.get(self.registry_url) if self.challenge_cache else None
+        if cached is not None:
+            logger.info("使用缓存的认证质询，跳过认证探测")
+            self._challenge_from_cache = True
+            if cached.get('scheme') == 'none':
+                self._challenge = None
+                return
+            self._apply_challenge(dict(cached, scope=self._auth_scope()))
+            return
+
+        # 步骤1：先发一个请求获取认证头
+        logger.info("""---
+[ 步骤 1/3: 探测认证服务器 ]
+---""")
+        probe = self._http_request('GET', url, verify=False)
+        challenge = parse_auth_challenge(probe['headers'].get('www-authenticate'))
+        if self.challenge_cache and (challenge or probe['status_code'] < 400):
+            self.challenge_cache.put(self.registry_url, challenge)
+        self._challenge_from_cache = False
+        self._apply_challenge(self._scoped(challenge))
+
+    def _should_reauthenticate(self, challenge):
+        """401时判断是否值得重新认证：缓存的token被拒绝，或认证质询与缓存不同"""
+        if challenge is None:
+            return False
+        if self._token_from_cache:
+            return True
+        return self._challenge_from_cache and not same_auth_challenge(challenge, self._challenge)
+
+    def _make_registry_request(self, path, headers=None, output_file=None, method='GET', _retried=False, body=None):
+        """向registry发送请求，处理认证；path 为 /v2/ 之后的路径，或完整URL（如上传会话的Location）"""
+        url = path if path.startswith(('http://', 'https://')) else f"{self.registry_url}/v2/{path}"
+
+        if not self.auth_token and not _retried:
+            self._authenticate(url)
+
+        # 步骤3：使用token（或匿名）发送最终请求
+        request_headers = {}
+
+        # Always include comprehensive Accept headers for manifest requests
+        # This ensures compatibility with both OCI and Docker v2 registries
+        if 'manifests' in path:
+            comprehensive_accept = ', '.join([
+                'application/vnd.oci.image.manifest.v1+json',
+                'application/vnd.oci.image.index.v1+json',
+                'application/vnd.docker.distribution.manifest.v2+json',
+                'application/vnd.docker.distribution.manifest.list.v2+json'
+            ])
+            request_headers['Accept'] = comprehensive_accept
+
+        if headers:
+            for key, value in headers.items():
+                # Skip Accept header if we already added comprehensive one
+                if key.lower() == 'accept' and 'manifests' in path:
+                    continue
+                request_headers[key] = value
+
+        if self.auth_token:
+            request_headers['Authorization'] = f'Bearer {self.auth_token}'
+
+        if 'manifests' in path and method == 'GET':
+            logger.info("""---
+[ 步骤 3/3: 获取镜像Manifest ]
+---""")
+        response = self._http_request(method, url, headers=request_headers, output_file=output_file, verify=False,
+                                      body=body)
+
+        if response['status_code'] == 401 and not _retried:
+            challenge = parse_auth_challenge(response['headers'].get('www-authenticate'))
+            if self._should_reauthenticate(challenge):
+                # 401响应本身带有最新的认证质询，无需再单独探测
+                logger.info("缓存的认证信息已失效，按registry返回的认证质询重新认证")
+                if self._token_from_cache:
+                    self.token_cache.invalidate(self.auth_token)
+                if self.challenge_cache:
+                    self.challenge_cache.put(self.registry_url, challenge)
+                self.auth_token = None
+                self._token_from_cache = False
+                self._challenge_from_cache = False
+                self._apply_challenge(self._scoped(challenge))
+                return self._make_registry_request(path, headers, output_file, method=method, _retried=True,
+                                                   body=body)
+
+        self._record_rate_limit(response)
+        if response['status_code'] >= 400:
+            raise RegistryHTTPError(response['status_code'], response['body'])
+
+        return response
+
+    def _record_rate_limit(self, response):
+        """记录响应中的配额头；429时抛出 RateLimitExhausted"""
+        registry = normalize_registry_host(self.registry_url)
+        headers = response['headers']
+        entry = self.rate_limits.record(registry, headers) if self.rate_limits else None
+        if entry and entry.get('limit') and entry['remaining'] <= entry['limit'] // 10:
+            logger.warning(f"{registry} 拉取配额即将用尽：剩余 {entry['remaining']}/{entry['limit']}")
+
+        if response['status_code'] == 429:
+            retry_after = parse_retry_after(headers.get('retry-after'))
+            if self.rate_limits:
+                retry_after = self.rate_limits.record_exhausted(registry, retry_after)
+            raise RateLimitExhausted(registry, retry_after if retry_after is not None else RateLimitBudget.MIN_WAIT)
+
+    def _check_rate_limit(self, needed):
+        """按记录的剩余配额判断能否发送 needed 个计数的manifest请求，不足时抛出 RateLimitExhausted"""
+        if not self.rate_limits:
+            return
+        registry = normalize_registry_host(self.registry_url)
+        wait = self.rate_limits.wait_time(registry, needed)
+        if wait > 0:
+            raise RateLimitExhausted(registry, wait)
+
+    @staticmethod
+    def _manifest_accept_headers():
         # 支持多种manifest格式
         accept_headers = [
             'application/vnd.docker.distribution.manifest.v2+json',
@@ -238,49 +549,279 @@ class DockerRegistryClient:
             'application/vnd.oci.image.manifest.v1+json',
             'application/vnd.oci.image.index.v1+json'
         ]
+        return {'Accept': ', '.join(accept_headers)}
 
-        headers = {
-            'Accept': ', '.join(accept_headers)
-        }
+    def get_manifest(self):
+        """获取镜像manifest，并记录tag当前指向的manifest digest（self.manifest_digest）"""
+        logger.info(f"获取镜像manifest: {self.image_name}:{self.tag}")
 
         path = f"{self.image_name}/manifests/{self.tag}"
-        response = self._make_registry_request(path, headers)
+        # manifest list还需再取一次子manifest，按两次计数预留配额，避免拉取中途遇到429
+        self._check_rate_limit(self.MANIFEST_REQUESTS_PER_PULL)
+        response = self._make_registry_request(path, self._manifest_accept_headers())
 
         manifest = json.loads(response['body'])
         content_type = response['headers'].get('content-type', '')
+        self.manifest_body = response['body']
+        self.manifest_digest = (response['headers'].get('docker-content-digest')
+                                or 'sha256:' + hashlib.sha256(response['body'].encode('utf-8')).hexdigest())
 
         logger.info(f"Manifest类型: {content_type}")
         return manifest, content_type
 
-    def download_blob(self, digest, output_path):
-        """下载blob到指定路径"""
+    def get_manifest_by_digest(self, digest):
+        """按digest获取manifest（如manifest list中选中的子manifest），返回 (manifest, content_type, 原始内容)"""
+        response = self._make_registry_request(f"{self.image_name}/manifests/{digest}")
+        return json.loads(response['body']), response['headers'].get('content-type', ''), response['body']
+
+    def head_manifest(self):
+        """用HEAD请求获取tag当前指向的manifest digest，不下载manifest和任何blob
+
+        registry未返回Docker-Content-Digest时退回到GET manifest并自行计算digest。
+        """
+        logger.info(f"检查镜像manifest digest: {self.image_name}:{self.tag}")
+        path = f"{self.image_name}/manifests/{self.tag}"
+        response = self._make_registry_request(path, self._manifest_accept_headers(), method='HEAD')
+        digest = response['headers'].get('docker-content-digest')
+        if digest:
+            return digest
+        logger.debug("HEAD响应中没有Docker-Content-Digest，改用GET获取manifest")
+        self.get_manifest()
+        return self.manifest_digest
+
+    def download_blob(self, digest, output_path, cancel_event=None, size=None, progress=None):
+        """下载blob到指定路径（跟随重定向到CDN，支持断点续传）
+
+        数据先写入 <output_path>.partial 并记录长度，中断后再次调用会用Range请求继续下载，
+        完成后原子地重命名为 output_path。连接中断、超时或卡住时会退避重试并从断点继续。
+        cancel_event 被设置后，原生后端会在下一个数据块到达时中止下载。
+        progress（BlobProgress）用于上报接收字节数和校验耗时。
+        """
+        progress = progress or NULL_BLOB_PROGRESS
+        # 存储在多个进程间共享：同一blob同时只有一个进程写断点文件，其他进程等待后直接使用提交的结果
+        lock = BlobLock(output_path)
+        if not lock.acquire(blocking=False):
+            logger.info(f"其他进程正在下载 {digest[:19]}，等待其完成")
+            lock.acquire(cancel_event=cancel_event)
+        try:
+            if os.path.exists(output_path):
+                logger.info(f"使用其他进程已下载的blob: {digest[:19]}")
+                return output_path
+            return self._with_retries(
+                lambda: self._download_blob_once(digest, output_path, cancel_event, size, progress),
+                f"下载blob {digest}", cancel_event,
+            )
+        finally:
+            lock.release()
+
+    def _download_blob_once(self, digest, output_path, cancel_event=None, size=None, progress=NULL_BLOB_PROGRESS):
         logger.info(f"下载blob: {digest}")
 
         path = f"{self.image_name}/blobs/{digest}"
+        url = f"{self.registry_url}/v2/{path}"
 
-        # 直接下载到文件
-        cmd = ['curl', '-v', '-L', '-H', f'User-Agent: {self.user_agent}']
-
+        headers = {}
         # 如果有认证token，添加Authorization头
         if self.auth_token:
-            cmd.extend(['-H', f'Authorization: Bearer {self.auth_token}'])
+            headers['Authorization'] = f'Bearer {self.auth_token}'
+
+        partial = PartialBlob(output_path, digest=digest, size=size)
+        offset = partial.resume_offset()
+        progress.resume(offset)
+        if offset:
+            logger.info(f"从断点继续下载 {digest}: 已有 {offset / 1024 / 1024:.2f} MB")
+        elif self.backend != 'curl' and size and size >= self.RANGED_DOWNLOAD_THRESHOLD:
+            ranged = RangedBlob(output_path, digest, size, self.RANGED_DOWNLOAD_PARTS)
+            try:
+                return self._download_blob_in_ranges(url, headers, ranged, cancel_event, progress)
+            except RangeRequestIgnored:
+                logger.info("服务器不支持Range请求，改为单连接下载")
+                ranged.discard()
+            except BlobDigestMismatch as e:
+                if not ranged.resumed:
+                    raise
+                logger.warning(f"续传后校验失败，重新完整下载: {e}")
+                return self._download_blob_once(digest, output_path, cancel_event, size, progress)
 
-        url = f"{self.registry_url}/v2/{path}"
-        cmd.extend(['-o', output_path, url])
+        if self.backend == 'curl':
+            response = self._download_blob_with_curl(url, headers, partial, offset)
+            if response['status_code'] < 400:
+                progress.advance(partial.length - offset)
+        else:
+            response = self._download_blob_with_transport(url, headers, partial, offset, cancel_event, progress)
 
-        self._run_curl_command(cmd)
+        if response['status_code'] >= 400:
+            raise RegistryHTTPError(response['status_code'], response['body'])
 
-        logger.debug(f"Blob已保存到: {output_path}")
+        try:
+            with progress.phase('verify'):
+                partial.commit()
+        except BlobDigestMismatch as e:
+            if not offset:
+                raise
+            # 断点文件中的旧数据可能已损坏，丢弃后完整重下一次
+            logger.warning(f"续传后校验失败，重新完整下载: {e}")
+            return self._download_blob_once(digest, output_path, cancel_event, size, progress)
+
+        logger.debug(f"Blob已校验并保存到: {output_path} ({partial.verified_digest})")
         return output_path
 
+    def _download_blob_in_ranges(self, url, headers, ranged, cancel_event=None, progress=NULL_BLOB_PROGRESS):
+        """把大blob拆成多个Range，在多个连接上并行下载并用pwrite写入预分配的文件"""
+        pending = ranged.prepare()
+        progress.resume(ranged.size - sum(end - pos for _, pos, end in pending))
+        logger.info(f"分 {len(ranged.parts)} 段并行下载 {ranged.digest} "
+                    f"({ranged.size / 1024 / 1024:.1f} MB, 剩余 {len(pending)} 段)")
+        abort_event = threading.Event()
+
+        def fetch(index, start, end):
+            def on_response(status, response_headers):
+                if status == 206:
+                    if parse_content_range_start(response_headers.get('content-range')) != start:
+                        raise RuntimeError(f"Content-Range与请求不匹配: {response_headers.get('content-range')}")
+                elif 200 <= status < 300:
+                    raise RangeRequestIgnored(f"HTTP {status}")
+
+            def sink(chunk):
+                if abort_event.is_set() or (cancel_event is not None and cancel_event.is_set()):
+                    raise BlobDownloadCancelled(f"下载已取消: {url}")
+                ranged.write(index, chunk)
+                progress.advance(len(chunk))
+
+            response = self.transport.request('GET', url, headers=dict(headers, Range=f'bytes={start}-{end - 1}'),
+                                              sink=sink, follow_redirects=True, on_response=on_response)
+            if response['status_code'] >= 400:
+                raise RegistryHTTPError(response['status_code'], response['body'])
+            if ranged.remaining(index):
+                raise RuntimeError(f"分片 {index} 数据不完整，缺少 {ranged.remaining(index)} 字节")
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(pending) or 1, thread_name_prefix='blob-range') as executor:
+                futures = [executor.submit(fetch, *part) for part in pending]
+                try:
+                    for future in as_completed(futures):
+                        future.result()
+                except BaseException:
+                    # 一个分片失败时让其他分片尽快停止，已写入的进度保留用于续传
+                    abort_event.set()
+                    raise
+        finally:
+            ranged.close()
+
+        with progress.phase('verify'):
+            ranged.commit()
+        logger.debug(f"Blob已校验并保存到: {ranged.path} ({ranged.verified_digest})")
+        return ranged.path
+
+    def _download_blob_with_transport(self, url, headers, partial, offset, cancel_event=None,
+                                      progress=NULL_BLOB_PROGRESS):
+        """使用原生传输下载到断点文件；异常时保留已下载部分"""
+        if offset:
+            headers = dict(headers, Range=f'bytes={offset}-')
+        partial.open(offset)
+
+        def on_response(status, response_headers):
+            if status == 206:
+                start = parse_content_range_start(response_headers.get('content-range'))
+                if start != partial.length:
+                    raise RuntimeError(f"Content-Range与断点不匹配: {response_headers.get('content-range')}")
+            elif 200 <= status < 300 and partial.length:
+                logger.info("服务器未处理Range请求，从头下载")
+                partial.restart()
+                progress.resume(0)
+
+        def sink(chunk):
+            if cancel_event is not None and cancel_event.is_set():
+                raise BlobDownloadCancelled(f"下载已取消: {url}")
+            partial.write(chunk)
+            progress.advance(len(chunk))
+
+        logger.debug(f"GET {url}")
+        try:
+            return self.transport.request('GET', url, headers=headers, sink=sink,
+                                          follow_redirects=True, on_response=on_response)
+        except BlobDigestMismatch:
+            partial.discard()
+            raise
+        finally:
+            partial.close()
+
+    def _download_blob_with_curl(self, url, headers, partial, offset):
+        """使用curl下载到断点文件（curl -C 续传）"""
+        try:
+            response = self._curl_request('GET', url, headers=headers, output_file=partial.partial_path,
+                                          follow_redirects=True, resume_from=offset)
+        except subprocess.CalledProcessError as e:
+            if offset and e.returncode == CURL_RANGE_ERROR:
+                # 服务器不支持Range，丢弃断点后从头下载
+                logger.info("服务器不支持Range请求，从头下载")
+                partial.discard()
+                return self._download_blob_with_curl(url, headers, partial, 0)
+            if os.path.exists(partial.partial_path):
+                partial.record_file_length()
+            raise
+
+        if response['status_code'] >= 400:
+            # 错误响应体被追加到了断点文件中，截回原来的长度
+            partial.record_file_length(offset)
+        else:
+            partial.record_file_length()
+        return response
+
+    def describe_connection_stats(self):
+        """返回连接复用统计（仅原生后端）"""
+        if self.transport is None:
+            return None
+        return self.transport.describe_stats()
+
+    def close(self):
+        """关闭连接池中的空闲连接"""
+        if self.transport is not None:
+            self.transport.close()
+
 class DockerImageToRootFS:
-    def __init__(self, image_url, output_path=None, username=None, password=None, architecture=None):
+    # 流水线提取时读取下载中blob的块大小
+    STREAM_CHUNK_SIZE = 256 * 1024
+    # 等待registry拉取配额恢复的最长总时间（秒），超过后放弃拉取
+    RATE_LIMIT_MAX_WAIT = 15 * 60
+
+    def __init__(self, image_url, output_path=None, username=None, password=None, architecture=None,
+                 http_backend=None, max_concurrent_downloads=None, cache_dir=None, pipeline=None,
+                 base_rootfs=None, base_layers=None, progress=None, offline=False, image_store=None,
+                 layer_cache=None):
         self.image_url = image_url
         self.output_path = output_path or f"{self._get_image_name()}_rootfs.tar"
         self.temp_dir = None
         self.username = username
         self.password = password
         self.architecture = architecture or self._get_current_architecture()
+        self.http_backend = http_backend
+        self.max_concurrent_downloads = max_concurrent_downloads or DEFAULT_MAX_CONCURRENT_DOWNLOADS
+        # 指定缓存目录时，blob保存在 <cache_dir>/blobs/sha256 中，拉取失败后也会保留
+        self.cache_dir = cache_dir
+        # 下载时已校验过digest的blob，后续阶段无需再次读取校验
+        self.verified_digests = set()
+        # 本次拉取的元数据（manifest digest等），成功后写入 <输出文件>.pull.json
+        self.pull_info = None
+        # 流水线模式：层一边下载一边按顺序解压提取，下载与提取重叠进行
+        if pipeline is None:
+            pipeline = os.environ.get(PIPELINE_ENV, '').strip().lower() in ('1', 'true', 'yes', 'on')
+        self.pipeline = pipeline
+        # 流水线模式下已在下载阶段提取好的根文件系统目录
+        self.pipelined_rootfs_dir = None
+        # 增量更新：缓存中旧版本镜像的根文件系统tar包及其层digest列表
+        self.base_rootfs = base_rootfs
+        self.base_layers = list(base_layers or [])
+        # 与旧版本有共同前缀层时的增量计划（见 _plan_incremental）
+        self.incremental_plan = None
+        # 每个blob的接收字节数、速率、各阶段耗时和缓存命中情况（见 pull_progress）
+        self.progress = PullProgress(progress or 'plain', image=image_url)
+        # 离线模式：manifest和blob只从本地缓存读取，不发出任何网络请求
+        self.offline = offline
+        # 镜像存储模式：archive 输出tar.gz，snapshot 把根文件系统保存为只读快照目录（见 rootfs_snapshot）
+        self.image_store = resolve_image_store(image_store)
+        # 层提取结果缓存（<cache_dir>/layers），构建根文件系统时复用已提取的层
+        self.layer_cache = LayerCache(cache_dir) if cache_dir and layer_cache_enabled(layer_cache) else None
         logger.info(f"目标架构: {self.architecture}")
         
     def _get_current_architecture(self):
@@ -316,16 +857,18 @@ class DockerImageToRootFS:
         return image_name
     
     def _check_dependencies(self):
-        """检查curl是否已安装"""
+        """检查curl和tar是否已安装（原生HTTP后端下curl仅作为后备）"""
         # 检查curl
         try:
             subprocess.run(['curl', '--version'],
                          capture_output=True, check=True)
             logger.info("✓ curl 已安装")
         except (subprocess.CalledProcessError, FileNotFoundError):
-            logger.error("✗ curl 未安装")
-            logger.info("请安装curl命令行工具")
-            return False
+            if resolve_http_backend(self.http_backend) == 'curl':
+                logger.error("✗ curl 未安装")
+                logger.info("请安装curl命令行工具")
+                return False
+            logger.warning("curl 未安装，将仅使用原生HTTP传输")
 
         # 检查tar命令
         try:
@@ -372,101 +915,134 @@ class DockerImageToRootFS:
             logger.info(f"清理临时目录: {self.temp_dir}")
 
     def _parse_image_url(self):
-        """解析镜像URL，提取registry、镜像名和标签"""
-        image_url = self.image_url
-
-        # 默认值
-        registry = "registry-1.docker.io"
-        image_name = ""
-        tag = "latest"
-
-        # 移除docker://前缀（如果存在）
-        if image_url.startswith('docker://'):
-            image_url = image_url[9:]
-
-        # 分离标签
-        # 改进的标签分离逻辑
-        if ':' in image_url:
-            # 检查冒号是否在最后一个斜杠之后，或者根本没有斜杠
-            last_colon = image_url.rfind(':')
-            last_slash = image_url.rfind('/')
-            if last_colon > last_slash:
-                # 适用于 a/b:tag, a:123/b:tag, a:tag
-                image_url, tag = image_url.rsplit(':', 1)
-
-        # 分离registry和镜像名
-        if '/' in image_url:
-            parts = image_url.split('/', 1)
-            if '.' in parts[0] or ':' in parts[0]:  # 包含域名
-                registry = parts[0]
-                image_name = parts[1]
-            else:  # Docker Hub的简写形式
-                registry = "registry-1.docker.io"
-                image_name = image_url
-                # Docker Hub的library镜像需要添加library/前缀
-                if '/' not in image_name:
-                    image_name = f"library/{image_name}"
-        else:
-            # 只有镜像名，使用Docker Hub
-            registry = "registry-1.docker.io"
-            image_name = f"library/{image_url}"
-
-        # 确保registry有协议前缀
-        if not registry.startswith(('http://', 'https://')):
-            registry = f"https://{registry}"
-
-        logger.info(f"解析镜像URL: registry={registry}, image={image_name}, tag={tag}")
-        return registry, image_name, tag
+        """解析镜像URL，返回 (registry地址, 仓库名, tag或digest)"""
+        reference = ImageReference.parse(self.image_url)
+        # Docker Hub的API地址是 registry-1.docker.io
+        host = 'registry-1.docker.io' if reference.registry == DOCKER_HUB else reference.registry
+        registry = f"https://{host}"
+        tag = reference.reference
+
+        logger.info(f"解析镜像URL: registry={registry}, image={reference.repository}, tag={tag}")
+        return registry, reference.repository, tag
     
     def _download_image_with_python(self):
         """使用Python下载Docker镜像到OCI格式"""
         oci_dir = os.path.join(self.temp_dir, 'oci')
         os.makedirs(oci_dir, exist_ok=True)
 
-        # 解析镜像URL
+        if self.offline:
+            return self._download_image_with_client(self._create_offline_client(), oci_dir)
+        return self._run_with_registry_fallback(
+            lambda client: self._download_image_with_client(client, oci_dir), record=True
+        )
+
+    def _create_registry_client(self, endpoint=None):
+        """解析镜像URL并创建registry客户端（有缓存目录时启用token和认证质询缓存）
+
+        endpoint 为mirror时，仓库名加上mirror的前缀，且不向mirror发送上游的登录凭证。
+        """
         registry, image_name, tag = self._parse_image_url()
+        endpoint = endpoint or RegistryEndpoint(registry)
+        username, password = (None, None) if endpoint.is_mirror else (self.username, self.password)
+        token_cache = TokenCache(self.cache_dir) if self.cache_dir else None
+        challenge_cache = ChallengeCache(self.cache_dir) if self.cache_dir else None
+        rate_limits = RateLimitBudget(self.cache_dir) if self.cache_dir else None
+        return DockerRegistryClient(endpoint.registry_url, endpoint.repository(image_name), tag, username, password,
+                                    backend=self.http_backend, token_cache=token_cache,
+                                    challenge_cache=challenge_cache, rate_limits=rate_limits)
+
+    def _create_offline_client(self):
+        """离线模式下从本地manifest缓存解析镜像的客户端"""
+        if not self.cache_dir:
+            raise OfflineImageUnavailable("离线模式需要指定缓存目录（--cache-dir）")
+        return OfflineRegistryClient(ManifestCache(self.cache_dir), self._parse_image_url()[0],
+                                     ImageReference.parse(self.image_url))
+
+    def _get_mirror_selector(self):
+        if not self.cache_dir:
+            return None
+        # curl后端通常意味着需要socks代理，原生探测无法使用，此时按配置顺序尝试
+        return MirrorSelector(self.cache_dir, probe=resolve_http_backend(self.http_backend) == 'native')
 
-        # 创建registry客户端
-        client = DockerRegistryClient(registry, image_name, tag, self.username, self.password)
+    def _run_with_registry_fallback(self, action, record=False):
+        """依次在mirror和上游registry上执行 action(client)；所有地址都因配额用尽而失败时等待配额恢复后重试"""
+        waited = 0
+        while True:
+            try:
+                return self._run_on_registry_endpoints(action, record)
+            except RateLimitExhausted as e:
+                if waited + e.retry_after > self.RATE_LIMIT_MAX_WAIT:
+                    logger.error(f"{e}，超过最长等待时间（{self.RATE_LIMIT_MAX_WAIT} 秒）；"
+                                 f"请稍后重试，或登录/配置registry mirror")
+                    raise
+                logger.warning(f"{e.registry} 拉取配额已用尽，等待 {e.retry_after:.0f} 秒后继续拉取...")
+                time.sleep(e.retry_after)
+                waited += e.retry_after
+
+    def _run_on_registry_endpoints(self, action, record=False):
+        """依次在mirror和上游registry上执行 action(client)，出错时回退到下一个地址"""
+        registry = self._parse_image_url()[0]
+        selector = self._get_mirror_selector()
+        endpoints = selector.candidates(registry) if selector else [RegistryEndpoint(registry)]
+
+        last_error = None
+        for index, endpoint in enumerate(endpoints):
+            if endpoint.is_mirror:
+                logger.info(f"通过mirror拉取: {endpoint.label}")
+            client = self._create_registry_client(endpoint)
+            start = time.monotonic()
+            try:
+                result = action(client)
+            except Exception as e:
+                last_error = e
+                # 配额用尽与地址本身的可用性无关，不计入mirror统计
+                if record and selector and not isinstance(e, RateLimitExhausted):
+                    selector.record_result(registry, endpoint, success=False)
+                if index + 1 < len(endpoints):
+                    logger.warning(f"从 {endpoint.label} 拉取失败: {e}，切换到 {endpoints[index + 1].label}")
+                continue
+            finally:
+                stats = client.describe_connection_stats()
+                if stats and record:
+                    logger.info(f"连接统计: {stats}")
+                client.close()
+
+            if record and selector:
+                received = client.transport.stats['bytes_received'] if client.transport else None
+                selector.record_result(registry, endpoint, success=True, bytes_received=received,
+                                       elapsed=time.monotonic() - start)
+            if self.pull_info is not None and endpoint.is_mirror:
+                self.pull_info['upstream_registry'] = registry
+            return result
+
+        raise last_error
+
+    def get_remote_manifest_digest(self):
+        """返回registry中tag当前指向的manifest digest（一次HEAD请求；离线模式下从本地记录解析）"""
+        if self.offline:
+            return self._create_offline_client().head_manifest()
+        return self._run_with_registry_fallback(lambda client: client.head_manifest())
 
+    def _download_image_with_client(self, client, oci_dir):
+        """使用已创建的registry客户端下载manifest、层和config"""
         # 获取manifest
         manifest, content_type = client.get_manifest()
+        self._store_manifest(client, client.manifest_body, client.manifest_digest, content_type, tag=client.tag)
 
         # 如果是manifest list，根据架构选择一个具体的manifest
+        platform_digest = client.manifest_digest
         if 'manifest.list' in content_type or 'image.index' in content_type:
             logger.info("检测到manifest list，正在寻找匹配的架构...")
-            
-            selected_manifest_descriptor = None
-            for manifest_descriptor in manifest.get('manifests', []):
-                platform_info = manifest_descriptor.get('platform', {})
-                manifest_arch = platform_info.get('architecture')
-                
-                # 架构等效性检查：aarch64 和 arm64 视为等效
-                arch_match = (manifest_arch == self.architecture or 
-                             (self.architecture == 'arm64' and manifest_arch == 'aarch64') or
-                             (self.architecture == 'aarch64' and manifest_arch == 'arm64'))
-                
-                if arch_match:
-                    # 优先选择与OS匹配的，如果没有os字段则直接匹配
-                    if platform_info.get('os') == 'linux' or 'os' not in platform_info:
-                        selected_manifest_descriptor = manifest_descriptor
-                        break
-            
-            if selected_manifest_descriptor:
-                target_digest = selected_manifest_descriptor['digest']
-                logger.info(f"找到匹配架构 '{self.architecture}' 的manifest: {target_digest}")
-                
-                # 获取子manifest
-                logger.info(f"""---
+            platform_digest = self._select_platform_manifest(manifest)['digest']
+            logger.info(f"找到匹配架构 '{self.architecture}' 的manifest: {platform_digest}")
+
+            # 获取子manifest
+            logger.info(f"""---
 [ 步骤 3/3: 获取镜像Manifest ]
 ---""")
-                response = client._make_registry_request(f"{client.image_name}/manifests/{target_digest}")
-                manifest = json.loads(response['body'])
-                content_type = response['headers'].get('content-type', '') # 更新content_type
-                logger.info(f"已选择子manifest，类型: {content_type}")
-            else:
-                available_archs = [m.get('platform', {}).get('architecture') for m in manifest.get('manifests', [])]
-                raise ValueError(f"在manifest list中找不到适用于架构 '{self.architecture}' 的镜像。可用架构: {', '.join(filter(None, available_archs))}")
+            manifest, content_type, body = client.get_manifest_by_digest(platform_digest)
+            self._store_manifest(client, body, platform_digest, content_type)
+            logger.info(f"已选择子manifest，类型: {content_type}")
 
         # 创建OCI目录结构
         blobs_dir = os.path.join(oci_dir, 'blobs', 'sha256')
@@ -478,6 +1054,19 @@ class DockerImageToRootFS:
         # 下载所有层和config
         self._download_layers(client, manifest, blobs_dir)
 
+        # 记录本次拉取的manifest digest，供之后的新鲜度检查（HEAD）比较
+        self.pull_info = {
+            'manifest_digest': client.manifest_digest,
+            'platform_digest': platform_digest,
+            'oci_manifest_digest': manifest_digest,
+            'registry': client.registry_url,
+            'repository': client.image_name,
+            'tag': client.tag,
+            'architecture': self.architecture,
+            'layers': [layer.get('digest') for layer in manifest.get('layers', [])],
+            'config_digest': manifest.get('config', {}).get('digest'),
+        }
+
         # 转换config blob为OCI格式
         if 'config' in manifest:
             self._convert_config_blob(client, manifest['config'], blobs_dir)
@@ -491,6 +1080,50 @@ class DockerImageToRootFS:
         logger.info(f"镜像已下载到OCI格式: {oci_dir}")
         return oci_dir
 
+    def _select_platform_manifest(self, manifest_list):
+        """在manifest list中选择与目标架构匹配的子manifest描述符"""
+        for manifest_descriptor in manifest_list.get('manifests', []):
+            platform_info = manifest_descriptor.get('platform', {})
+            manifest_arch = platform_info.get('architecture')
+
+            # 架构等效性检查：aarch64 和 arm64 视为等效
+            arch_match = (manifest_arch == self.architecture or
+                         (self.architecture == 'arm64' and manifest_arch == 'aarch64') or
+                         (self.architecture == 'aarch64' and manifest_arch == 'arm64'))
+
+            # 优先选择与OS匹配的，如果没有os字段则直接匹配
+            if arch_match and (platform_info.get('os') == 'linux' or 'os' not in platform_info):
+                return manifest_descriptor
+
+        available_archs = [m.get('platform', {}).get('architecture') for m in manifest_list.get('manifests', [])]
+        raise ValueError(f"在manifest list中找不到适用于架构 '{self.architecture}' 的镜像。可用架构: {', '.join(filter(None, available_archs))}")
+
+    def _store_manifest(self, client, body, digest, media_type, tag=None):
+        """把registry返回的原始manifest按digest存入blob存储，并记录tag（供 serve-cache 和离线模式使用）"""
+        if not self.cache_dir or self.offline or not body or not digest:
+            return
+        data = body.encode('utf-8')
+        if 'sha256:' + hashlib.sha256(data).hexdigest() != digest:
+            logger.debug(f"manifest内容与digest不符，不保存: {digest}")
+            return
+        store = BlobStore(os.path.join(self.cache_dir, 'blobs', 'sha256'))
+        path = store.path(digest)
+        if not store.has(digest):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+        registry = normalize_registry_host(client.registry_url)
+        media_type = media_type.split(';')[0].strip() or json.loads(body).get('mediaType')
+        self._get_blob_index().record(registry, client.image_name, [(digest, len(data), media_type)])
+        if tag and not tag.startswith('sha256:'):
+            # 按上游的规范化引用记录（经mirror拉取时也是如此），离线模式据此解析tag
+            reference = ImageReference.parse(self.image_url)
+            TagIndex(os.path.join(self.cache_dir, 'blobs', 'tags.json')).record(
+                reference.registry, reference.repository, tag, digest, media_type)
+
     def _save_manifest(self, oci_dir, manifest, content_type):
         """保存manifest并返回其digest，转换为OCI格式"""
         # 转换Docker格式的manifest为OCI格式
@@ -561,9 +1194,11 @@ class DockerImageToRootFS:
             # 转换Docker config为OCI config
             oci_config = self._convert_docker_config_to_oci(config_data)
 
-            # 重新保存转换后的config
-            with open(config_path, 'w') as f:
+            # 重新保存转换后的config（写入新文件再替换，不修改缓存中硬链接的原始blob）
+            tmp_path = config_path + '.tmp'
+            with open(tmp_path, 'w') as f:
                 json.dump(oci_config, f, separators=(',', ':'))
+            os.replace(tmp_path, config_path)
 
             logger.debug(f"已转换config blob为OCI格式: {digest}")
 
@@ -601,7 +1236,7 @@ class DockerImageToRootFS:
         return oci_config
 
     def _download_layers(self, client, manifest, blobs_dir):
-        """下载镜像的所有层"""
+        """并发下载镜像的所有层和config（并发数由max_concurrent_downloads限制）"""
         # 处理不同类型的manifest
         layers = []
 
@@ -620,23 +1255,278 @@ class DockerImageToRootFS:
         elif not layers:
             raise ValueError("Manifest中没有找到'layers'或'fsLayers'字段，或者它们为空")
 
+        store = self._get_blob_store(blobs_dir)
+        index = self._get_blob_index()
+        registry = normalize_registry_host(client.registry_url)
+        if manifest.get('layers'):
+            self.incremental_plan = self._plan_incremental(manifest['layers'], store)
+        # 增量更新时前缀层已包含在旧的根文件系统中，本地没有的不必下载
+        skipped = self.incremental_plan['skip'] if self.incremental_plan else set()
+
+        # 去重（部分镜像包含重复的空层），并跳过已存在的blob
+        pending = []
+        digests = []
+        reused_bytes = 0
         for layer in layers:
             digest = layer.get('digest') or layer.get('blobSum')
-            if digest:
-                # 移除sha256:前缀用于文件名
-                if digest.startswith('sha256:'):
-                    digest_hash = digest[7:]
-                else:
-                    digest_hash = digest
+            if not digest or digest in digests or digest in skipped:
+                continue
+            digests.append(digest)
+            kind = 'config' if digest == manifest.get('config', {}).get('digest') else 'layer'
+            if self._reuse_stored_blob(store, index, digest, layer.get('size'), registry, client.image_name):
+                self.verified_digests.add(digest)
+                reused_bytes += layer.get('size') or 0
+                self.progress.blob(digest, layer.get('size'), kind, cached=True)
+            else:
+                pending.append((digest, store.path(digest), layer.get('size') or 0))
+                self.progress.blob(digest, layer.get('size'), kind, cached=False)
+
+        if pending and self.offline:
+            missing = ', '.join(digest[:19] for digest, _, _ in pending)
+            raise OfflineImageUnavailable(f"离线模式: 本地缺少 {len(pending)} 个blob（{missing}），请先在联网时拉取该镜像")
+
+        if len(pending) < len(digests):
+            logger.info(f"复用本地已有的 {len(digests) - len(pending)} 个blob（{reused_bytes / 1024 / 1024:.2f} MB），"
+                        f"需下载 {len(pending)} 个")
+
+        try:
+            if self.pipeline and manifest.get('layers') and not self.incremental_plan:
+                self._download_and_extract_layers(client, manifest['layers'], store, pending)
+            elif pending:
+                self._download_blobs(client, pending)
+        finally:
+            # 下载的blob在提交前已校验digest（拉取失败时也包括已完成的），之后复用不必再计算
+            if index is not None:
+                index.mark_verified([(digest, blob_path) for digest, blob_path, _ in pending
+                                     if digest in self.verified_digests])
+
+        for digest in digests:
+            store.link_into(digest, blobs_dir)
+
+        if index is not None:
+            index.record(registry, client.image_name, [
+                (layer.get('digest'), layer.get('size'), layer.get('mediaType'))
+                for layer in layers if layer.get('digest') and layer.get('digest') not in skipped
+            ])
+
+    def _plan_incremental(self, layers, store):
+        """与缓存的旧版本比较层列表，返回 {'prefix', 'old_suffix', 'new_suffix', 'skip'}，无法增量时返回None
 
-                blob_path = os.path.join(blobs_dir, digest_hash)
-                if not os.path.exists(blob_path):
+        需要回退旧版本独有的层时，这些层和前缀层都要在blob存储中，才能确定写入了哪些文件；
+        只是追加新层时，前缀层无需下载（列入 skip）。
+        """
+        if not self.base_layers or not self.base_rootfs or not os.path.exists(self.base_rootfs):
+            return None
+        new_layers = [layer['digest'] for layer in layers]
+        prefix = common_prefix_length(self.base_layers, new_layers)
+        if prefix == 0:
+            return None
+        old_suffix = self.base_layers[prefix:]
+        needed = old_suffix + new_layers[:prefix] if old_suffix else []
+        missing = [digest for digest in needed if not store.has(digest)]
+        if missing:
+            logger.info(f"旧版本的 {len(missing)} 个层已不在本地存储中，执行完整提取")
+            return None
+        logger.info(f"增量更新：前 {prefix} 层与缓存镜像相同，回退 {len(old_suffix)} 层，"
+                    f"应用 {len(layers) - prefix} 个新层")
+        skip = {digest for digest in new_layers[:prefix] if not store.has(digest)} - set(new_layers[prefix:])
+        return {'prefix': layers[:prefix], 'old_suffix': old_suffix, 'new_suffix': layers[prefix:], 'skip': skip}
+
+    def _reuse_stored_blob(self, store, index, digest, size, registry, repository):
+        """存储中已有该digest（可能来自其他仓库）且大小一致、digest校验通过时直接复用
+
+        每个文件只在第一次复用时计算digest，校验结果记在blob索引中；损坏的blob移到一旁后重新下载。
+        """
+        path = store.path(digest)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if size and st.st_size != size:
+            logger.warning(f"已存储的blob大小与manifest不一致，重新下载: {digest}")
+            store.quarantine(digest, st)
+            return False
+        if index is None or not index.is_verified(digest, st):
+            if not store.verify(digest):
+                logger.warning(f"已存储的blob digest校验失败，重新下载: {digest}")
+                store.quarantine(digest, st)
+                return False
+            if index is not None:
+                index.mark_verified([(digest, path)])
+        entry = index.get(digest) if index is not None else None
+        sources = (entry or {}).get('sources', {})
+        if sources and repository not in sources.get(registry, []):
+            origin = next(iter(sources.items()))
+            logger.info(f"跨仓库复用blob {digest[:19]}（来自 {origin[0]}/{origin[1][0]}）")
+        return True
+
+    def _get_blob_index(self):
+        """有缓存目录时返回跨仓库的blob索引"""
+        if not self.cache_dir:
+            return None
+        return BlobIndex(os.path.join(self.cache_dir, 'blobs', 'index.json'))
+
+    def _get_blob_store(self, blobs_dir):
+        """返回blob存储：有缓存目录时使用持久化目录，否则直接写入OCI目录"""
+        if self.cache_dir:
+            return BlobStore(os.path.join(self.cache_dir, 'blobs', 'sha256'))
+        return BlobStore(blobs_dir)
+
+    def _download_blobs(self, client, pending, tracker=None, during=None):
+        """并发下载 (digest, path, size) 列表，大的blob先开始
+
+        流水线模式下按给定顺序（层顺序）下载，每个blob结束时通知 tracker，
+        并在下载进行的同时于当前线程执行 during()。
+        """
+        if tracker is None:
+            # 大的层先开始：总耗时取决于最慢的那一层，先启动大层可以缩短尾部等待
+            pending = sorted(pending, key=lambda item: item[2], reverse=True)
+        workers = max(1, min(self.max_concurrent_downloads, len(pending) or 1))
+        logger.info(f"开始下载 {len(pending)} 个blob（并发数: {workers}）")
+
+        cancel_event = tracker.cancel_event if tracker else threading.Event()
+
+        def download(digest, blob_path, size):
+            try:
+                if cancel_event.is_set():
+                    raise BlobDownloadCancelled(f"下载已取消: {digest}")
+                blob_progress = self.progress.get(digest)
+                with blob_progress.phase('download'):
+                    result = client.download_blob(digest, blob_path, cancel_event=cancel_event, size=size or None,
+                                                  progress=blob_progress)
+            except Exception as e:
+                # 在工作线程中立即标记取消，避免排队中的任务在主线程处理失败前开始
+                cancel_event.set()
+                if tracker:
+                    tracker.finish(digest, e)
+                raise
+            if tracker:
+                tracker.finish(digest)
+            return result
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='blob-download') as executor:
+            futures = {
+                executor.submit(download, digest, blob_path, size): digest
+                for digest, blob_path, size in pending
+            }
+            try:
+                if during:
+                    during()
+                for future in as_completed(futures):
+                    digest = futures[future]
                     try:
-                        client.download_blob(digest, blob_path)
-                        logger.debug(f"已下载层: {digest}")
+                        future.result()
                     except Exception as e:
                         logger.error(f"下载层失败 {digest}: {e}")
                         raise
+                    self.verified_digests.add(digest)
+                    logger.debug(f"已下载并校验层: {digest}")
+            except BaseException:
+                # 一个blob失败时取消尚未开始的任务，并通知进行中的下载尽快中止
+                cancel_event.set()
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def _download_and_extract_layers(self, client, layers, store, pending):
+        """流水线模式：并发下载的同时，按层顺序边读边解压提取到根文件系统"""
+        rootfs_dir = os.path.join(self.temp_dir, 'rootfs')
+        # mirror回退时会重新执行，丢弃上一次提取了一半的结果
+        if os.path.exists(rootfs_dir):
+            shutil.rmtree(rootfs_dir)
+        os.makedirs(rootfs_dir)
+
+        # 先规整遗留的断点文件（截掉未记录的尾部），提取线程只会读到已确认写入的数据；
+        # 其他进程正在下载的blob由其持有锁写入，不去改动
+        for digest, blob_path, size in pending:
+            lock = BlobLock(blob_path)
+            if lock.acquire(blocking=False):
+                try:
+                    PartialBlob(blob_path, digest, size or None).resume_offset()
+                finally:
+                    lock.release()
+
+        # 提取按层顺序进行，下载也按层顺序开始，使前面的层尽早可用
+        order = {layer.get('digest'): index for index, layer in enumerate(layers)}
+        pending = sorted(pending, key=lambda item: order.get(item[0], len(layers)))
+        tracker = DownloadTracker([digest for digest, _, _ in pending], threading.Event())
+
+        def extract_all():
+            logger.info(f"流水线模式：边下载边提取 {len(layers)} 个层")
+            for i, layer in enumerate(layers, 1):
+                digest = layer['digest']
+                logger.info(f"提取层 {i}/{len(layers)}: {digest}")
+                with self.progress.get(digest).phase('extract'):
+                    self._extract_layer_streaming(store.path(digest), digest, tracker, rootfs_dir, i == 1,
+                                                  media_type=layer.get('mediaType'))
+            logger.info(f"根文件系统已提取到: {rootfs_dir}")
+
+        self._download_blobs(client, pending, tracker=tracker, during=extract_all)
+        self.pipelined_rootfs_dir = rootfs_dir
+
+    def _extract_layer_streaming(self, blob_path, digest, tracker, rootfs_dir, is_first_layer=False,
+                                 media_type=None):
+        """跟随下载中的blob提取单个层；流式提取失败时等下载完成后按文件重新提取"""
+        try:
+            with io.BufferedReader(BlobStream(blob_path, digest, tracker), self.STREAM_CHUNK_SIZE) as stream:
+                if self._is_android_environment():
+                    self._extract_stream_with_python(stream, rootfs_dir, media_type)
+                else:
+                    self._extract_stream_with_tar(stream, rootfs_dir, is_first_layer, media_type)
+            return
+        except (BlobDownloadCancelled, BlobDigestMismatch):
+            raise
+        except Exception as e:
+            # 下载本身失败时直接抛出下载错误
+            tracker.wait(digest)
+            logger.warning(f"流式提取失败: {e}，下载完成后按文件重新提取")
+        self._extract_layer(blob_path, rootfs_dir, is_first_layer, media_type)
+
+    def _extract_stream_with_python(self, stream, rootfs_dir, media_type=None):
+        """使用Python tarfile从不可seek的流中提取层"""
+        compression, stream = sniff_layer_compression(stream, media_type)
+        if compression == 'zstd':
+            with open_zstd_stream(stream) as decoded:
+                with tarfile.open(fileobj=decoded, mode='r|') as tar:
+                    self._safe_extract_tar(tar, rootfs_dir)
+        else:
+            with tarfile.open(fileobj=stream, mode='r|*') as tar:
+                self._safe_extract_tar(tar, rootfs_dir)
+
+    def _extract_stream_with_tar(self, stream, rootfs_dir, is_first_layer=False, media_type=None):
+        """把层数据通过管道交给tar命令提取，解压在独立进程中与下载并行"""
+        compression, stream = sniff_layer_compression(stream, media_type)
+        if compression == 'zstd':
+            # tar命令不一定支持zstd（如busybox/toybox），解压后以未压缩tar交给tar命令
+            with open_zstd_stream(stream) as decoded:
+                self._pipe_to_tar(decoded, '-xf', rootfs_dir, is_first_layer)
+        else:
+            self._pipe_to_tar(stream, '-xzf' if compression == 'gzip' else '-xf', rootfs_dir, is_first_layer)
+
+    def _pipe_to_tar(self, stream, mode, rootfs_dir, is_first_layer=False):
+        """把tar数据写入tar命令的标准输入进行提取"""
+        cmd = ['tar', mode, '-', '-C', rootfs_dir] + self._tar_extract_options(is_first_layer)
+
+        # stderr写入临时文件，避免警告较多时管道写满导致死锁
+        with tempfile.TemporaryFile() as stderr_file:
+            process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=stderr_file)
+            try:
+                shutil.copyfileobj(stream, process.stdin, self.STREAM_CHUNK_SIZE)
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            except BaseException:
+                process.kill()
+                process.wait()
+                raise
+            returncode = process.wait()
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode('utf-8', 'replace')
+
+        if returncode == 2:
+            logger.info("tar提取完成（有警告，但文件已提取）")
+        elif returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd, stderr[:1000])
 
     def _create_oci_index(self, oci_dir, manifest_digest, content_type):
         """创建OCI index.json文件"""
@@ -762,6 +1652,7 @@ class DockerImageToRootFS:
 
         # 提取所有层
         layers = manifest.get('layers', [])
+        cache_hits = 0
         for i, layer in enumerate(layers, 1):
             layer_digest = layer['digest']
             layer_path = os.path.join(oci_dir, 'blobs', 'sha256', layer_digest[7:])
@@ -770,32 +1661,123 @@ class DockerImageToRootFS:
 
             # 第一层使用严格模式，后续层使用宽松模式
             is_first_layer = (i == 1)
-            self._extract_layer(layer_path, rootfs_dir, is_first_layer)
+            with self.progress.get(layer_digest).phase('extract'):
+                cache_hits += self._apply_layer(layer_path, layer_digest, rootfs_dir, is_first_layer,
+                                                layer.get('mediaType'))
 
+        if self.layer_cache:
+            logger.info(f"层缓存命中 {cache_hits}/{len(layers)}，只解压了 {len(layers) - cache_hits} 个层")
         logger.info(f"根文件系统已提取到: {rootfs_dir}")
         
-        # 验证关键文件是否存在
+        self._check_critical_files(rootfs_dir)
+        return rootfs_dir
+
+    def _apply_layer(self, layer_path, digest, rootfs_dir, is_first_layer=False, media_type=None):
+        """把一个层应用到根文件系统，命中层缓存时返回1
+
+        开启层缓存时先查找已提取的结果，命中则直接叠加；未命中时提取到缓存后再叠加。
+        """
+        if not self.layer_cache:
+            self._extract_layer(layer_path, rootfs_dir, is_first_layer, media_type)
+            return 0
+        layer_dir, meta = self.layer_cache.lookup(digest)
+        hit = layer_dir is not None
+        if hit:
+            logger.info(f"使用已提取的层: {digest}")
+        else:
+            layer_dir, meta = self.layer_cache.build(
+                digest, layer_path, lambda target: self._extract_layer(layer_path, target, True, media_type),
+                media_type)
+        self.layer_cache.apply(layer_dir, meta, rootfs_dir)
+        return int(hit)
+
+    def _patch_base_rootfs(self, oci_dir):
+        """增量更新：解开旧版本的根文件系统，回退旧版本独有的层，再应用新层"""
+        plan = self.incremental_plan
+        rootfs_dir = os.path.join(self.temp_dir, 'rootfs')
+        os.makedirs(rootfs_dir, exist_ok=True)
+
+        logger.info(f"解开缓存的根文件系统: {self.base_rootfs}")
+        if os.path.isdir(self.base_rootfs):
+            # snapshot 模式下旧版本是快照目录，复制即可
+            copy_tree(self.base_rootfs, rootfs_dir)
+        else:
+            self._extract_layer(self.base_rootfs, rootfs_dir, is_first_layer=True)
+        if plan['old_suffix']:
+            self._revert_layers(rootfs_dir, plan['prefix'], plan['old_suffix'])
+
+        new_suffix = plan['new_suffix']
+        for i, layer in enumerate(new_suffix, 1):
+            layer_path = os.path.join(oci_dir, 'blobs', 'sha256', layer['digest'][7:])
+            logger.info(f"应用新层 {i}/{len(new_suffix)}: {layer['digest']}")
+            with self.progress.get(layer['digest']).phase('extract'):
+                self._extract_layer(layer_path, rootfs_dir, False, layer.get('mediaType'))
+
+        self._check_critical_files(rootfs_dir)
+        return rootfs_dir
+
+    def _revert_layers(self, rootfs_dir, prefix, old_suffix):
+        """撤销旧版本独有的层：删除它们写入的路径，并从前缀层中恢复被覆盖的文件"""
+        store = BlobStore(os.path.join(self.cache_dir, 'blobs', 'sha256'))
+        listings = LayerListingCache(self.cache_dir)
+
+        touched, added_dirs = set(), set()
+        for digest in old_suffix:
+            listing = listings.get(digest, store.path(digest))
+            touched.update(listing['files'])
+            added_dirs.update(listing['dirs'])
+
+        # 被覆盖的文件由前缀中最后一个包含它的层恢复
+        owners, prefix_dirs = {}, set()
+        for layer in prefix:
+            listing = listings.get(layer['digest'], store.path(layer['digest']), layer.get('mediaType'))
+            prefix_dirs.update(listing['dirs'])
+            for name in touched.intersection(listing['files']):
+                owners[name] = layer
+
+        for name in touched:
+            path = os.path.join(rootfs_dir, name)
+            if os.path.islink(path) or os.path.isfile(path):
+                os.remove(path)
+
+        restore = {}
+        for name, layer in owners.items():
+            restore.setdefault(layer['digest'], (layer, set()))[1].add(name)
+        for digest, (layer, names) in restore.items():
+            logger.debug(f"从层 {digest[:19]} 恢复 {len(names)} 个文件")
+            with open_layer_tar(store.path(digest), layer.get('mediaType')) as tar:
+                self._safe_extract_tar(tar, rootfs_dir, only=names)
+
+        # 旧层新建的目录（前缀层中没有）在清空后删除，深的先删
+        for name in sorted(added_dirs - prefix_dirs, key=lambda n: n.count('/'), reverse=True):
+            try:
+                os.rmdir(os.path.join(rootfs_dir, name))
+            except OSError:
+                pass
+
+        logger.info(f"已回退 {len(old_suffix)} 个旧层：删除 {len(touched)} 个路径，恢复 {len(owners)} 个")
+
+    def _check_critical_files(self, rootfs_dir):
+        """验证关键文件是否存在，缺少时抛出异常"""
         missing_files = self._validate_critical_files(rootfs_dir)
         if missing_files:
             error_msg = f"提取后缺少关键文件: {', '.join(missing_files)}"
             logger.error(error_msg)
             raise RuntimeError(error_msg)
-        
-        return rootfs_dir
 
-    def _extract_layer(self, layer_path, rootfs_dir, is_first_layer=False):
+    def _extract_layer(self, layer_path, rootfs_dir, is_first_layer=False, media_type=None):
         """提取单个层到根文件系统目录"""
         # 在Android环境中优先使用Python tarfile，因为它能更好地处理硬链接
         if self._is_android_environment():
             try:
                 logger.debug("Android环境：使用Python tarfile模块提取")
-                self._extract_layer_with_python(layer_path, rootfs_dir)
+                self._extract_layer_with_python(layer_path, rootfs_dir, media_type)
                 return
             except Exception as e:
                 logger.warning(f"Python tarfile提取失败: {e}")
                 logger.info("尝试使用tar命令...")
                 try:
-                    self._extract_layer_with_tar(layer_path, rootfs_dir, is_first_layer)
+                    self._extract_layer_with_tar(layer_path, rootfs_dir, is_first_layer, media_type)
                     return
                 except Exception as e2:
                     logger.error(f"tar命令也失败: {e2}")
@@ -803,24 +1785,29 @@ class DockerImageToRootFS:
 
         # 非Android环境：优先使用tar命令
         try:
-            self._extract_layer_with_tar(layer_path, rootfs_dir, is_first_layer)
+            self._extract_layer_with_tar(layer_path, rootfs_dir, is_first_layer, media_type)
             return
         except Exception as e:
             logger.warning(f"tar命令提取失败: {e}")
             logger.info("尝试使用Python tarfile模块...")
-            self._extract_layer_with_python(layer_path, rootfs_dir)
+            self._extract_layer_with_python(layer_path, rootfs_dir, media_type)
 
-    def _extract_layer_with_python(self, layer_path, rootfs_dir):
+    def _extract_layer_with_python(self, layer_path, rootfs_dir, media_type=None):
         """使用Python tarfile模块提取层"""
         import tarfile
         import gzip
 
         # 检测文件类型
         with open(layer_path, 'rb') as f:
-            magic = f.read(2)
+            compression = detect_layer_compression(f.read(4), media_type)
+
+        if compression == 'zstd':
+            with open(layer_path, 'rb') as f:
+                self._extract_stream_with_python(f, rootfs_dir, media_type)
+            return
 
         try:
-            if magic == b'\x1f\x8b':  # gzip magic number
+            if compression == 'gzip':
                 # 这是一个gzip压缩的tar文件
                 with gzip.open(layer_path, 'rb') as gz_file:
                     with tarfile.open(fileobj=gz_file, mode='r|*') as tar:
@@ -832,16 +1819,20 @@ class DockerImageToRootFS:
         except Exception as e:
             # 如果流式读取失败，尝试非流式
             logger.debug(f"流式提取失败，尝试非流式: {e}")
-            if magic == b'\x1f\x8b':
+            if compression == 'gzip':
                 with tarfile.open(layer_path, 'r:gz') as tar:
                     self._safe_extract_tar(tar, rootfs_dir)
             else:
                 with tarfile.open(layer_path, 'r') as tar:
                     self._safe_extract_tar(tar, rootfs_dir)
 
-    def _safe_extract_tar(self, tar, rootfs_dir):
-        """安全地提取tar文件，处理特殊情况（增强Android支持）"""
+    def _safe_extract_tar(self, tar, rootfs_dir, only=None):
+        """安全地提取tar文件，处理特殊情况（增强Android支持）
+
+        指定 only（规范化后的成员名集合）时只提取其中的成员，全部提取后提前结束。
+        """
         whiteout_count = 0
+        remaining = set(only) if only is not None else None
         
         # 设置提取过滤器以避免警告
         def extract_filter(member, path):
@@ -880,6 +1871,13 @@ class DockerImageToRootFS:
 
         # 手动处理每个成员，更好地控制提取过程
         for member in tar:
+            if remaining is not None:
+                if not remaining:
+                    break
+                name = normalize_member_name(member.name)
+                if name not in remaining:
+                    continue
+                remaining.discard(name)
             try:
                 # 应用过滤器
                 filtered_member = extract_filter(member, rootfs_dir)
@@ -1056,19 +2054,45 @@ class DockerImageToRootFS:
         
         return missing_files
 
-    def _extract_layer_with_tar(self, layer_path, rootfs_dir, is_first_layer=False):
+    def _extract_layer_with_tar(self, layer_path, rootfs_dir, is_first_layer=False, media_type=None):
         """使用tar命令提取层（增强Android支持）"""
         # 检测文件类型并使用适当的tar选项
         with open(layer_path, 'rb') as f:
-            magic = f.read(2)
+            compression = detect_layer_compression(f.read(4), media_type)
+
+        if compression == 'zstd':
+            with open(layer_path, 'rb') as f:
+                self._extract_stream_with_tar(f, rootfs_dir, is_first_layer, media_type)
+            return
 
         # 构建基础命令
-        if magic == b'\x1f\x8b':  # gzip
+        if compression == 'gzip':
             base_cmd = ['tar', '-xzf', layer_path, '-C', rootfs_dir]
         else:
             base_cmd = ['tar', '-xf', layer_path, '-C', rootfs_dir]
 
-        # 根据是否为第一层和环境选择不同的选项
+        cmd = base_cmd + self._tar_extract_options(is_first_layer)
+
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            
+            if result.returncode == 0:
+                logger.debug("tar提取成功")
+            elif result.returncode == 2:
+                # tar退出码2通常表示有警告（如硬链接失败），但文件已提取
+                logger.info("tar提取完成（有警告，但文件已提取）")
+                if self._is_android_environment():
+                    logger.debug("Android环境：忽略硬链接相关警告")
+            else:
+                # 其他错误码，尝试fallback
+                logger.warning(f"tar命令失败（退出码{result.returncode}），尝试宽松模式")
+                self._extract_with_fallback(base_cmd, rootfs_dir)
+        except Exception as e:
+            logger.warning(f"tar命令异常: {e}，尝试宽松模式")
+            self._extract_with_fallback(base_cmd, rootfs_dir)
+
+    def _tar_extract_options(self, is_first_layer=False):
+        """根据是否为第一层和环境选择tar提取选项"""
         if self._is_android_environment():
             # Android环境使用增强的宽松选项
             tar_options = [
@@ -1091,26 +2115,7 @@ class DockerImageToRootFS:
                 '--no-same-owner',
                 '--no-same-permissions'
             ]
-
-        cmd = base_cmd + tar_options
-
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                logger.debug("tar提取成功")
-            elif result.returncode == 2:
-                # tar退出码2通常表示有警告（如硬链接失败），但文件已提取
-                logger.info("tar提取完成（有警告，但文件已提取）")
-                if self._is_android_environment():
-                    logger.debug("Android环境：忽略硬链接相关警告")
-            else:
-                # 其他错误码，尝试fallback
-                logger.warning(f"tar命令失败（退出码{result.returncode}），尝试宽松模式")
-                self._extract_with_fallback(base_cmd, rootfs_dir)
-        except Exception as e:
-            logger.warning(f"tar命令异常: {e}，尝试宽松模式")
-            self._extract_with_fallback(base_cmd, rootfs_dir)
+        return tar_options
 
     def _extract_with_fallback(self, base_cmd, rootfs_dir):
         """使用最宽松的选项重试tar提取"""
@@ -1147,18 +2152,37 @@ class DockerImageToRootFS:
     def _create_tar_archive(self, rootfs_dir):
         """创建tar归档文件"""
         output_path = os.path.abspath(self.output_path)
+        # 先写入临时文件再原子替换，读取缓存的其他进程不会看到写了一半的归档
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
         
         # 使用tar命令创建归档，保持权限和所有者信息
         cmd = [
             'tar', 
-            '-czf', output_path,
+            '-czf', tmp_path,
             '-C', rootfs_dir,
             '.'
         ]
         
-        self._run_command(cmd)
+        try:
+            self._run_command(cmd)
+            os.replace(tmp_path, output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        # 从 snapshot 模式切换回来时，删除同一条目的旧快照
+        discard_snapshot(output_path)
         logger.info(f"根文件系统tar包已创建: {output_path}")
         return output_path
+
+    def _create_snapshot(self, rootfs_dir):
+        """把根文件系统保存为只读快照目录，代替压缩成tar.gz"""
+        output_path = os.path.abspath(self.output_path)
+        snapshot_dir = commit_snapshot(rootfs_dir, output_path)
+        if self.pull_info is not None:
+            self.pull_info['image_store'] = 'snapshot'
+            self.pull_info['rootfs_size'] = tree_size(snapshot_dir)
+        logger.info(f"根文件系统快照已保存: {snapshot_dir}")
+        return snapshot_dir
     
     def _optimize_for_proot(self, rootfs_dir):
         """为proot优化根文件系统"""
@@ -1231,7 +2255,14 @@ class DockerImageToRootFS:
             
             # 使用Python提取根文件系统
             logger.info("步骤 2/4: 使用Python提取根文件系统...")
-            rootfs_dir = self._extract_rootfs_with_python(oci_dir)
+            if self.pipelined_rootfs_dir:
+                # 流水线模式下层已在下载时提取完成
+                rootfs_dir = self.pipelined_rootfs_dir
+                self._check_critical_files(rootfs_dir)
+            elif self.incremental_plan:
+                rootfs_dir = self._patch_base_rootfs(oci_dir)
+            else:
+                rootfs_dir = self._extract_rootfs_with_python(oci_dir)
             
                 # 保存镜像配置
             logger.info("步骤 3/5: 保存镜像配置...")
@@ -1241,10 +2272,22 @@ class DockerImageToRootFS:
             logger.info("步骤 4/5: 为proot优化根文件系统...")
             self._optimize_for_proot(rootfs_dir)
 
+            if self.image_store == 'snapshot':
+                # 保存快照，不压缩（使用时也无需解压）
+                logger.info("步骤 5/5: 保存根文件系统快照...")
+                snapshot_dir = self._create_snapshot(rootfs_dir)
+                self._save_pull_info(os.path.abspath(self.output_path))
+                self.progress.finish(success=True)
+                logger.info(f"✓ 成功创建根文件系统快照: {snapshot_dir}")
+                return True
+
             # 创建tar归档
             logger.info("步骤 5/5: 创建tar归档...")
             output_file = self._create_tar_archive(rootfs_dir)
             
+            self._save_pull_info(output_file)
+            self.progress.finish(success=True)
+
             logger.info(f"✓ 成功创建根文件系统tar包: {output_file}")
             logger.info(f"文件大小: {os.path.getsize(output_file) / 1024 / 1024:.2f} MB")
             
@@ -1255,11 +2298,19 @@ class DockerImageToRootFS:
             
         except Exception as e:
             logger.error(f"处理失败: {str(e)}")
+            self.progress.finish(success=False)
             return False
         finally:
             # 清理临时目录
             self._cleanup_temp_directory()
     
+    def _save_pull_info(self, output_file):
+        """把拉取元数据写到 <输出文件>.pull.json，由调用方合并进缓存信息"""
+        if not self.pull_info:
+            return
+        with open(output_file + PULL_INFO_SUFFIX, 'w') as f:
+            json.dump(self.pull_info, f, indent=2)
+
     def _print_usage_instructions(self, tar_file):
         """打印使用说明"""
         logger.info("\n" + "="*50)
@@ -1314,6 +2365,69 @@ def main():
         '--arch',
         help='指定目标架构 (例如: amd64, arm64)。默认为自动检测。'
     )
+
+    parser.add_argument(
+        '--max-concurrent-downloads',
+        type=int,
+        default=DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+        help=f'并发下载的blob数量 (默认: {DEFAULT_MAX_CONCURRENT_DOWNLOADS})'
+    )
+
+    parser.add_argument(
+        '--cache-dir',
+        help='持久化blob缓存目录；中断的下载会保留断点，下次拉取时续传'
+    )
+
+    parser.add_argument(
+        '--pipeline',
+        action='store_true',
+        default=None,
+        help=f'流水线模式：层一边下载一边解压提取。也可通过环境变量 {PIPELINE_ENV}=1 开启'
+    )
+
+    parser.add_argument(
+        '--progress',
+        choices=PROGRESS_MODES,
+        default='auto',
+        help='进度输出: auto(默认), tty(终端内刷新), plain(结束后输出每层统计), json(每行一个JSON事件，输出到stdout)'
+    )
+
+    parser.add_argument(
+        '--base-rootfs',
+        help='增量更新：缓存中旧版本镜像的根文件系统tar包或快照目录（需同时指定 --base-layers）'
+    )
+
+    parser.add_argument(
+        '--base-layers',
+        help='增量更新：旧版本镜像的层digest列表，以逗号分隔'
+    )
+
+    parser.add_argument(
+        '--offline',
+        action='store_true',
+        help='离线模式：只使用本地缓存的manifest和blob，缺少数据时立即失败，不访问网络'
+    )
+
+    parser.add_argument(
+        '--image-store',
+        choices=IMAGE_STORES,
+        help=f'镜像存储模式: archive(默认，输出tar.gz) 或 snapshot(保存为只读根文件系统快照目录，'
+             f'输出路径只用于确定快照位置)。也可通过环境变量 {IMAGE_STORE_ENV} 设置'
+    )
+
+    parser.add_argument(
+        '--layer-cache',
+        action='store_true',
+        default=None,
+        help=f'缓存每个层的提取结果（<cache_dir>/layers），共用前几层的镜像直接复用已提取的层。'
+             f'也可通过环境变量 {LAYER_CACHE_ENV}=1 开启'
+    )
+
+    parser.add_argument(
+        '--http-backend',
+        choices=HTTP_BACKENDS,
+        help=f'HTTP后端: native(默认，连接复用) 或 curl。也可通过环境变量 {HTTP_BACKEND_ENV} 设置'
+    )
     
     args = parser.parse_args()
     
@@ -1323,7 +2437,17 @@ def main():
     logger.info(f"开始处理Docker镜像: {args.image_url}")
     
     # 将代理参数传递给处理器
-    processor = DockerImageToRootFS(args.image_url, args.output, args.username, args.password, args.arch)
+    processor = DockerImageToRootFS(args.image_url, args.output, args.username, args.password, args.arch,
+                                    http_backend=args.http_backend,
+                                    max_concurrent_downloads=args.max_concurrent_downloads,
+                                    cache_dir=args.cache_dir, pipeline=args.pipeline,
+                                    base_rootfs=args.base_rootfs,
+                                    base_layers=args.base_layers.split(',') if args.base_layers else None,
+                                    progress=args.progress, offline=args.offline,
+                                    image_store=args.image_store, layer_cache=args.layer_cache)
+    # 终端进度视图代替逐条的信息日志
+    if processor.progress.mode == 'tty' and not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
     # 在客户端中也需要设置代理
     if args.proxy:
         # 这是个简化处理，理想情况下应该在DockerRegistryClient中处理
@@ -22,6 +22,9 @@ from urllib.parse import urlparse
 # 导入现有模块
 from .proot_runner import ProotRunner
 from .create_rootfs_tar import DockerImageToRootFS
+from .image_reference import ImageReference
+from .pull_progress import PROGRESS_MODES
+from .rootfs_snapshot import cached_rootfs_size, list_cache_entries
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -44,6 +47,11 @@ def parse_image_reference(image_url):
     """Split image url into repository and tag."""
     if not image_url:
         return "unknown", "latest"
+    try:
+        reference = ImageReference.parse(image_url)
+        return reference.familiar_name, reference.tag or "<none>"
+    except ValueError:
+        pass
     last_slash = image_url.rfind("/")
     last_colon = image_url.rfind(":")
     if last_colon > last_slash:
@@ -238,39 +246,40 @@ class DockerCLI:
         logger.info(f"登录成功: {server}")
         return True
 
-    def pull(self, image_url, force=False):
-        """拉取镜像"""
-        logger.info(f"拉取镜像: {image_url}")
-
-        # 检查是否已缓存
-        if not force and self.runner._is_image_cached(image_url):
-            cache_info = self.runner._load_cache_info(image_url)
-            if cache_info:
-                logger.info(f"镜像已存在于缓存中")
-                logger.info(f"缓存时间: {cache_info.get('created_time_str', 'Unknown')}")
-                return True
-
-        # 加载凭证
-        config = self._load_config()
-        auths = config.get('auths', {})
+    def _find_credentials(self, image_url):
+        """按镜像URL的registry查找 docker login 保存的凭证，返回 (username, password)"""
+        auths = self._load_config().get('auths', {})
         
         # 简单的匹配逻辑，实际可能需要更复杂的匹配
         # 这里我们假设镜像URL的域名部分能匹配到auths中的key
-        username, password = None, None
         for server, creds in auths.items():
             server_name = urlparse(server).hostname or server
             if server_name in image_url or (server_name == "index.docker.io" and '/' not in image_url.split(':')[0]):
-                username = creds.get('username')
-                password = creds.get('password')
                 logger.info(f"找到 {server} 的凭证")
-                break
+                return creds.get('username'), creds.get('password')
+        return None, None
+
+    def pull(self, image_url, force=False, max_concurrent_downloads=None, pull_policy='always', progress=None,
+             offline=False):
+        """拉取镜像
+
+        默认策略为always：已缓存的镜像只用一次HEAD请求检查manifest是否变化，未变化时不下载任何blob。
+        offline 为 True 时只按本地manifest缓存解析和构建，不访问网络。
+        """
+        logger.info(f"拉取镜像: {image_url}")
+
+        username, password = self._find_credentials(image_url)
         
         # 现在pull直接调用runner的下载方法
         cache_path = self.runner._download_image(
             image_url,
             force_download=force,
             username=username,
-            password=password
+            password=password,
+            max_concurrent_downloads=max_concurrent_downloads,
+            pull_policy=pull_policy,
+            progress=progress,
+            offline=offline,
         )
 
         if cache_path:
@@ -282,10 +291,24 @@ class DockerCLI:
             
     def run(self, image_url, command=None, name=None, **kwargs):
         """运行容器"""
-        # 确保在运行前镜像存在
-        if not self.runner._is_image_cached(image_url) or kwargs.get('force_download', False):
-            logger.info(f"镜像不存在或需要强制下载，执行 'pull' 操作...")
-            pull_success = self.pull(image_url, force=kwargs.get('force_download', False))
+        # 确保在运行前镜像存在（按拉取策略决定是否检查更新）
+        pull_policy = kwargs.get('pull_policy') or ProotRunner.DEFAULT_PULL_POLICY
+        force_download = kwargs.get('force_download', False)
+        offline = kwargs.get('offline', False)
+        is_cached = self.runner._is_image_cached(image_url)
+        if not is_cached and pull_policy == 'never' and not force_download and not offline:
+            logger.error(f"镜像不在本地缓存中，且拉取策略为 never: {image_url}")
+            return None
+        # 离线模式下已缓存的镜像不检查更新
+        if not is_cached or force_download or (pull_policy == 'always' and not offline):
+            logger.info(f"镜像不存在、需要强制下载或拉取策略为 always，执行 'pull' 操作...")
+            pull_success = self.pull(
+                image_url,
+                force=force_download,
+                max_concurrent_downloads=kwargs.get('max_concurrent_downloads'),
+                pull_policy=pull_policy,
+                offline=offline,
+            )
             if not pull_success:
                 logger.error(f"无法运行容器，因为镜像拉取失败: {image_url}")
                 return None
@@ -308,6 +331,7 @@ class DockerCLI:
                 self.detach = kwargs.get('detach', False)
                 self.interactive = kwargs.get('interactive', False)
                 self.force_download = kwargs.get('force_download', False)
+                self.offline = offline
                 self.username = kwargs.get('username')
                 self.password = kwargs.get('password')
                 self.command = command
@@ -435,6 +459,8 @@ class DockerCLI:
         # 添加从docker_cli传递过来的参数
         if args.force_download:
             cmd.append('--force-download')
+        if getattr(args, 'offline', False):
+            cmd.append('--offline')
         if args.workdir:
             cmd.extend(['--workdir', args.workdir])
         if args.interactive:
@@ -954,14 +980,13 @@ class DockerCLI:
         if not os.path.isdir(self.cache_dir):
             return entries
 
-        for filename in os.listdir(self.cache_dir):
-            if not filename.endswith('.tar.gz'):
-                continue
-            cache_path = os.path.join(self.cache_dir, filename)
+        for cache_path in list_cache_entries(self.cache_dir):
+            filename = os.path.basename(cache_path)
             info_path = cache_path + '.info'
 
             image_url = 'unknown:latest'
             created = 'unknown'
+            info = None
             if os.path.exists(info_path):
                 try:
                     with open(info_path, 'r', encoding='utf-8') as f:
@@ -973,7 +998,7 @@ class DockerCLI:
 
             repository, tag = parse_image_reference(image_url)
             image_id = filename[:-7].rsplit('_', 1)[-1] if '_' in filename[:-7] else filename[:-7]
-            size_mb = os.path.getsize(cache_path) / 1024 / 1024
+            size_mb = cached_rootfs_size(cache_path, info) / 1024 / 1024
             entries.append({
                 "Repository": repository,
                 "Tag": tag,
@@ -1033,6 +1058,49 @@ class DockerCLI:
             logger.error(f"✗ 加载镜像失败: {error_msg}")
             return False
         
+    def push(self, image_url, target=None, max_concurrent_uploads=None):
+        """推送缓存中的镜像；target 为推送目标引用，默认与 image_url 相同"""
+        from .image_push import ImagePusher
+
+        target = target or image_url
+        cache_info = self.runner._load_cache_info(image_url)
+        if not cache_info or not self.runner._is_image_cached(image_url):
+            logger.error(f"镜像不在本地缓存中: {image_url}")
+            return False
+
+        username, password = self._find_credentials(target)
+        logger.info(f"推送镜像: {image_url} -> {target}")
+        pusher = ImagePusher(self.cache_dir, username, password, max_concurrent_uploads=max_concurrent_uploads)
+        try:
+            digest = pusher.push(cache_info, target)
+        except Exception as e:
+            logger.error(f"✗ 镜像推送失败: {e}")
+            return False
+        logger.info(f"✓ 镜像推送成功: {target}（{digest}）")
+        return True
+
+    def serve_cache(self, host='0.0.0.0', port=None):
+        """以只读registry的形式向局域网提供本地缓存的镜像"""
+        from .cache_registry import DEFAULT_SERVE_PORT, CacheRegistryServer
+
+        port = DEFAULT_SERVE_PORT if port is None else port
+        try:
+            server = CacheRegistryServer(self.cache_dir, host, port)
+        except OSError as e:
+            logger.error(f"无法监听 {host}:{port}: {e}")
+            return False
+
+        address = f"{server.server_address[0]}:{server.server_address[1]}"
+        logger.info(f"只读registry已启动: http://{address}（缓存目录: {self.cache_dir}）")
+        logger.info("其他设备可在 <缓存目录>/config.json 中配置: "
+                    f'{{"registry-mirrors": {{"docker.io": ["http://<本机IP>:{server.server_address[1]}"]}}}}')
+        logger.info("按 Ctrl+C 停止")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+        return True
+
     def rmi(self, image_url):
         """删除镜像"""
         logger.info(f"删除镜像: {image_url}")
@@ -1266,6 +1334,17 @@ def create_parser():
     pull_parser.add_argument('image', help='镜像URL')
     pull_parser.add_argument('--force', action='store_true', help='强制重新下载')
     pull_parser.add_argument('--platform', help='目标平台（当前仅接受并提示，不改变实际拉取架构）')
+    pull_parser.add_argument('--max-concurrent-downloads', type=int, help='并发下载的层数（默认3）')
+    pull_parser.add_argument('--progress', choices=PROGRESS_MODES,
+                             help='进度输出: auto(默认), tty, plain, json(每行一个JSON事件，便于监控汇总)')
+    pull_parser.add_argument('--offline', action='store_true',
+                             help='只按本地manifest缓存解析和构建镜像，不访问网络，缺少数据时立即失败')
+
+    # push 命令
+    push_parser = subparsers.add_parser('push', help='推送缓存中的镜像到registry')
+    push_parser.add_argument('image', help='缓存中的镜像')
+    push_parser.add_argument('target', nargs='?', help='推送目标（如 registry.example.com/team/app:v1），默认与镜像相同')
+    push_parser.add_argument('--max-concurrent-uploads', type=int, help='并发上传的层数（默认3）')
 
     # run 命令
     run_parser = subparsers.add_parser('run', help='运行容器')
@@ -1284,6 +1363,11 @@ def create_parser():
     run_parser.add_argument('--dns', action='append', default=[], help='额外DNS服务器')
     run_parser.add_argument('--rm', action='store_true', help='容器退出后自动删除（后台容器将在状态刷新时清理）')
     run_parser.add_argument('--force-download', action='store_true', help='强制重新下载镜像')
+    run_parser.add_argument('--max-concurrent-downloads', type=int, help='拉取镜像时并发下载的层数（默认3）')
+    run_parser.add_argument('--pull', choices=ProotRunner.PULL_POLICIES, default=ProotRunner.DEFAULT_PULL_POLICY,
+                            help='拉取策略: always(用HEAD检查更新), missing(默认), never(只使用本地缓存)')
+    run_parser.add_argument('--offline', action='store_true',
+                            help='离线模式：按本地manifest缓存解析镜像（tag、digest、平台），不访问网络')
     run_parser.add_argument('-p', '--publish', nargs=1, action=UnsupportedRunOption, help=argparse.SUPPRESS)
     run_parser.add_argument('--network', nargs=1, action=UnsupportedRunOption, help=argparse.SUPPRESS)
     run_parser.add_argument('--restart', nargs=1, action=UnsupportedRunOption, help=argparse.SUPPRESS)
@@ -1346,6 +1430,11 @@ def create_parser():
     load_parser = subparsers.add_parser('load', help='从tar归档文件加载镜像')
     load_parser.add_argument('-i', '--input', required=True, help='输入tar文件路径')
 
+    # serve-cache 命令
+    serve_cache_parser = subparsers.add_parser('serve-cache', help='以只读registry的形式向局域网提供本地缓存的镜像')
+    serve_cache_parser.add_argument('--host', default='0.0.0.0', help='监听地址（默认0.0.0.0）')
+    serve_cache_parser.add_argument('--port', type=int, default=5000, help='监听端口（默认5000）')
+
     # compose 子命令
     compose_parser = subparsers.add_parser('compose', help='Compose 子命令（兼容 docker compose）')
     compose_parser.add_argument('compose_args', nargs=argparse.REMAINDER, help='compose 参数')
@@ -1406,7 +1495,17 @@ def main():
         elif args.subcommand == 'pull':
             if args.platform:
                 logger.warning(f"当前实现忽略 --platform={args.platform}，将按宿主架构拉取。")
-            success = cli.pull(args.image, force=args.force)
+            success = cli.pull(
+                args.image,
+                force=args.force,
+                max_concurrent_downloads=args.max_concurrent_downloads,
+                progress=args.progress,
+                offline=args.offline,
+            )
+            sys.exit(0 if success else 1)
+
+        elif args.subcommand == 'push':
+            success = cli.push(args.image, args.target, max_concurrent_uploads=args.max_concurrent_uploads)
             sys.exit(0 if success else 1)
 
         elif args.subcommand == 'run':
@@ -1440,6 +1539,9 @@ def main():
                 detach=args.detach,
                 interactive=args.interactive_tty,
                 force_download=args.force_download,
+                max_concurrent_downloads=args.max_concurrent_downloads,
+                pull_policy=args.pull,
+                offline=args.offline,
                 username=username,
                 password=password,
                 auto_remove=args.rm,
@@ -1506,6 +1608,10 @@ def main():
             success = cli.load(args.input)
             sys.exit(0 if success else 1)
 
+        elif args.subcommand == 'serve-cache':
+            success = cli.serve_cache(host=args.host, port=args.port)
+            sys.exit(0 if success else 1)
+
         elif args.subcommand == 'compose':
             compose_cmd = [sys.executable, '-m', 'android_docker.docker_compose_cli']
             if args.cache_dir:
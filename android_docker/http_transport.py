@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+原生HTTP传输层
+为registry请求提供按主机复用的keep-alive连接池，跟随CDN重定向，并将响应体流式写入磁盘
+只使用Python标准库（http.client / ssl），curl作为后备后端保留在create_rootfs_tar中
+连接与读取分别设置超时，传输速度持续过低时判定为卡住，由调用方按 RetryPolicy 退避重试
+"""
+
+import base64
+import http.client
+import logging
+import random
+import socket
+import ssl
+import threading
+import time
+import urllib.request
+from urllib.parse import urljoin, urlsplit, unquote
+
+logger = logging.getLogger(__name__)
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+DEFAULT_CONNECT_TIMEOUT = 15
+# 读取超时：连接上持续这么久没有任何数据即视为断开
+DEFAULT_READ_TIMEOUT = 60
+# 连续 LOW_SPEED_TIME 秒平均速度低于 LOW_SPEED_LIMIT 字节/秒视为卡住（与curl的 --speed-limit/--speed-time 相同）
+LOW_SPEED_LIMIT = 1024
+LOW_SPEED_TIME = 30
+
+# 复用的连接在服务端已关闭时，发送请求可能抛出的异常
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+
+class HttpTransportError(Exception):
+    """传输层错误（连接失败、重定向过多、代理不受支持等）"""
+
+
+class TransferStalled(HttpTransportError):
+    """传输速度持续低于下限"""
+
+
+# 可以通过重试恢复的网络错误
+TRANSIENT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    socket.timeout,
+    ssl.SSLEOFError,
+    http.client.HTTPException,
+    TransferStalled,
+)
+
+
+def is_transient_error(error):
+    if isinstance(error, socket.gaierror):
+        # 只有DNS临时失败值得重试，域名不存在等错误直接失败
+        return error.errno == socket.EAI_AGAIN
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class RetryPolicy:
+    """指数退避加随机抖动（full jitter）的重试策略"""
+
+    def __init__(self, attempts=4, base_delay=1.0, max_delay=30.0):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        """第attempt次失败后的等待秒数：在 [0, min(max_delay, base_delay * 2^(attempt-1))] 中随机取值"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class StallDetector:
+    """按时间窗口统计吞吐量，窗口内平均速度低于下限时抛出 TransferStalled"""
+
+    def __init__(self, min_rate=LOW_SPEED_LIMIT, window=LOW_SPEED_TIME):
+        self.min_rate = min_rate
+        self.window = window
+        self._window_start = time.monotonic()
+        self._bytes = 0
+
+    def update(self, amount):
+        self._bytes += amount
+        elapsed = time.monotonic() - self._window_start
+        if elapsed < self.window:
+            return
+        rate = self._bytes / elapsed
+        if rate < self.min_rate:
+            raise TransferStalled(f"传输速度过低: {rate:.0f} B/s（{elapsed:.0f}秒内低于 {self.min_rate} B/s）")
+        self._window_start = time.monotonic()
+        self._bytes = 0
+
+
+class HttpTransport:
+    """按 (scheme, host, port) 复用连接的线程安全HTTP客户端"""
+
+    CHUNK_SIZE = 64 * 1024
+    MAX_REDIRECTS = 10
+    MAX_IDLE_PER_HOST = 8
+
+    def __init__(self, user_agent=None, timeout=DEFAULT_READ_TIMEOUT, proxies=None, connect_timeout=None,
+                 low_speed_limit=LOW_SPEED_LIMIT, low_speed_time=LOW_SPEED_TIME):
+        self.user_agent = user_agent
+        # timeout 为读取超时；连接超时默认不超过它
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout or min(DEFAULT_CONNECT_TIMEOUT, timeout)
+        self.low_speed_limit = low_speed_limit
+        self.low_speed_time = low_speed_time
+        self.proxies = proxies if proxies is not None else urllib.request.getproxies()
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl_contexts = {}
+        self.stats = {
+            'requests': 0,
+            'connections_opened': 0,
+            'connections_reused': 0,
+            'redirects': 0,
+            'bytes_received': 0,
+        }
+
+    @staticmethod
+    def is_proxy_supported(proxies=None):
+        """原生传输仅支持HTTP(S)代理；socks等代理需要回退到curl"""
+        if proxies is None:
+            proxies = urllib.request.getproxies()
+        for scheme in ('http', 'https'):
+            proxy = proxies.get(scheme)
+            if proxy and urlsplit(proxy).scheme not in ('http', 'https'):
+                return False
+        return True
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _ssl_context(self, verify):
+        with self._lock:
+            context = self._ssl_contexts.get(verify)
+            if context is None:
+                context = ssl.create_default_context()
+                if not verify:
+                    context.check_hostname = False
+                    context.verify_mode = ssl.CERT_NONE
+                self._ssl_contexts[verify] = context
+            return context
+
+    def _proxy_for(self, scheme, host):
+        proxy = self.proxies.get(scheme)
+        if not proxy:
+            return None
+        try:
+            if urllib.request.proxy_bypass(host):
+                return None
+        except Exception:
+            pass
+        return urlsplit(proxy)
+
+    @staticmethod
+    def _proxy_headers(proxy):
+        if not proxy or not proxy.username:
+            return {}
+        credentials = f"{unquote(proxy.username)}:{unquote(proxy.password or '')}"
+        return {'Proxy-Authorization': 'Basic ' + base64.b64encode(credentials.encode()).decode()}
+
+    def _new_connection(self, scheme, host, port, verify):
+        """创建新连接（必要时通过HTTP代理建立隧道）"""
+        proxy = self._proxy_for(scheme, host)
+        if proxy and proxy.scheme not in ('http', 'https'):
+            raise HttpTransportError(f"原生传输不支持代理类型: {proxy.scheme}")
+
+        if scheme == 'https':
+            context = self._ssl_context(verify)
+            if proxy:
+                conn = http.client.HTTPSConnection(
+                    proxy.hostname, proxy.port or 8080, timeout=self.connect_timeout, context=context
+                )
+                conn.set_tunnel(host, port, headers=self._proxy_headers(proxy))
+            else:
+                conn = http.client.HTTPSConnection(host, port, timeout=self.connect_timeout, context=context)
+        else:
+            if proxy:
+                conn = http.client.HTTPConnection(proxy.hostname, proxy.port or 8080, timeout=self.connect_timeout)
+            else:
+                conn = http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+
+        # 连接（含代理隧道和TLS握手）使用连接超时，之后的读写使用读取超时
+        conn.connect()
+        conn.sock.settimeout(self.timeout)
+        conn.timeout = self.timeout
+        self._count('connections_opened')
+        return conn
+
+    def _acquire(self, key):
+        """从空闲池取出连接；返回 (conn, reused)"""
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                conn = idle.pop()
+                self.stats['connections_reused'] += 1
+                return conn, True
+        scheme, host, port, verify = key
+        return self._new_connection(scheme, host, port, verify), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.MAX_IDLE_PER_HOST:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            pools = list(self._idle.values())
+            self._idle = {}
+        for idle in pools:
+            for conn in idle:
+                conn.close()
+
+    def _send(self, method, url, headers, body, verify):
+        """发送一次请求（不跟随重定向），返回 (key, conn, response)"""
+        parts = urlsplit(url)
+        scheme = parts.scheme or 'https'
+        host = parts.hostname
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, host, port, verify)
+
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        request_headers = {'Host': parts.netloc}
+        if self.user_agent:
+            request_headers['User-Agent'] = self.user_agent
+        request_headers.update(headers or {})
+
+        # 明文HTTP经代理时直接向代理发送绝对URL；HTTPS已在连接建立时通过CONNECT隧道处理
+        target = path
+        if scheme == 'http':
+            proxy = self._proxy_for(scheme, host)
+            if proxy:
+                target = url
+                request_headers.update(self._proxy_headers(proxy))
+
+        conn, reused = self._acquire(key)
+        while True:
+            try:
+                conn.request(method, target, body=body, headers=request_headers)
+                response = conn.getresponse()
+                return key, conn, response
+            except _STALE_CONNECTION_ERRORS:
+                conn.close()
+                if not reused:
+                    raise
+                # 空闲连接已被服务端关闭，换一个新连接重试一次
+                logger.debug(f"复用的连接已失效，重新连接: {host}")
+                conn, reused = self._new_connection(scheme, host, port, verify), False
+            except Exception:
+                conn.close()
+                raise
+
+    @staticmethod
+    def _collect_headers(response):
+        headers = {}
+        for key, value in response.getheaders():
+            headers.setdefault(key.lower(), value)
+        return headers
+
+    def _finish(self, key, conn, response):
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+
+    def request(self, method, url, headers=None, body=None, sink=None, verify=True, follow_redirects=True,
+                on_response=None):
+        """发送请求并返回 {'status_code', 'headers', 'body', 'url'}
+
+        提供 sink 时，2xx 响应体按块传给 sink，不在内存中缓存；其他响应体读入 body 以便报错。
+        on_response(status, headers) 在最终响应的响应体读取之前调用（例如用于区分200与206）。
+        跨主机重定向（例如跳转到CDN）时会去掉Authorization头。
+        """
+        headers = dict(headers or {})
+        origin = urlsplit(url).netloc
+
+        for _ in range(self.MAX_REDIRECTS + 1):
+            self._count('requests')
+            key, conn, response = self._send(method, url, headers, body, verify)
+            try:
+                status = response.status
+                response_headers = self._collect_headers(response)
+
+                location = response_headers.get('location')
+                if follow_redirects and status in REDIRECT_STATUSES and location:
+                    response.read()
+                    self._finish(key, conn, response)
+                    self._count('redirects')
+                    url = urljoin(url, location)
+                    if urlsplit(url).netloc != origin:
+                        headers = {k: v for k, v in headers.items() if k.lower() != 'authorization'}
+                    if status == 303:
+                        method, body = 'GET', None
+                    continue
+
+                if on_response is not None:
+                    on_response(status, response_headers)
+
+                body_bytes = b''
+                if method == 'HEAD':
+                    response.read()
+                elif sink is not None and 200 <= status < 300:
+                    stall = StallDetector(self.low_speed_limit, self.low_speed_time) if self.low_speed_limit else None
+                    while True:
+                        # read1 有数据即返回，低速连接不会在一个大块上阻塞过久
+                        chunk = response.read1(self.CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        self._count('bytes_received', len(chunk))
+                        if stall is not None:
+                            stall.update(len(chunk))
+                        sink(chunk)
+                    # read1 遇到连接提前关闭时只返回空数据，需按Content-Length检查是否完整
+                    if response.length:
+                        raise http.client.IncompleteRead(b'', response.length)
+                    # read1 读完Content-Length后不会自行结束响应，需标记完成才能复用连接
+                    response.read()
+                else:
+                    body_bytes = response.read()
+                    self._count('bytes_received', len(body_bytes))
+
+                self._finish(key, conn, response)
+            except BaseException:
+                conn.close()
+                raise
+
+            return {
+                'status_code': status,
+                'headers': response_headers,
+                'body': body_bytes.decode('utf-8', errors='replace'),
+                'url': url,
+            }
+
+        raise HttpTransportError(f"重定向次数过多: {url}")
+
+    def describe_stats(self):
+        """返回用于日志的连接统计摘要"""
+        with self._lock:
+            stats = dict(self.stats)
+        return (
+            f"请求 {stats['requests']} 次, 新建连接 {stats['connections_opened']} 个, "
+            f"复用连接 {stats['connections_reused']} 次, 重定向 {stats['redirects']} 次"
+        )
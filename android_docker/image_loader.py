@@ -2,8 +2,11 @@
 """
 本地镜像加载器
 用于从本地tar文件加载Docker镜像到缓存
+镜像的config和各层同时按digest导入共享的blob存储（<cache_dir>/blobs/sha256），并生成OCI manifest，
+与拉取的镜像共用相同的层，供 docker push 等直接读取。
 """
 
+import io
 import os
 import json
 import tarfile
@@ -12,8 +15,17 @@ import logging
 import shutil
 from pathlib import Path
 
+from .blob_refs import BlobRefs
+from .blob_store import BlobStore
+from .image_reference import image_cache_filename, normalize_image_reference
+from .layer_compression import detect_layer_compression
+
 logger = logging.getLogger(__name__)
 
+OCI_MANIFEST = 'application/vnd.oci.image.manifest.v1+json'
+OCI_CONFIG = 'application/vnd.oci.image.config.v1+json'
+OCI_LAYER = 'application/vnd.oci.image.layer.v1.tar'
+
 
 class LocalImageLoader:
     """处理从本地tar归档文件加载Docker镜像"""
@@ -71,9 +83,12 @@ class LocalImageLoader:
                 
                 # 提取到缓存
                 cache_path = self._extract_to_cache(tar_path, image_name, tar)
+
+                # 导入blob存储
+                blob_info = self.import_to_blob_store(tar)
                 
                 # 注册镜像
-                self._register_image(image_name, cache_path, tar_path)
+                self._register_image(image_name, cache_path, tar_path, blob_info)
                 
                 logger.info(f"✓ 成功加载镜像: {image_name}")
                 return True, image_name, None
@@ -157,13 +172,15 @@ class LocalImageLoader:
             str: 缓存文件路径
         """
         # 生成缓存文件名
-        # 使用镜像名称和tar文件内容的hash
-        with open(tar_path, 'rb') as f:
-            file_hash = hashlib.sha256(f.read()).hexdigest()[:16]
-        
-        # 清理镜像名称用于文件名
-        safe_name = image_name.replace(':', '_').replace('/', '_').replace('<', '').replace('>', '')
-        cache_filename = f"{safe_name}_{file_hash}.tar.gz"
+        # 有效的镜像引用按规范化引用命名，与拉取的镜像共用缓存条目（alpine 与 docker.io/library/alpine:latest 相同）
+        try:
+            cache_filename = image_cache_filename(image_name)
+        except ValueError:
+            # 没有RepoTags的镜像使用镜像名称和tar文件内容的hash
+            with open(tar_path, 'rb') as f:
+                file_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+            safe_name = image_name.replace(':', '_').replace('/', '_').replace('<', '').replace('>', '')
+            cache_filename = f"{safe_name}_{file_hash}.tar.gz"
         cache_path = os.path.join(self.cache_dir, cache_filename)
         
         # 如果已存在，先删除旧的
@@ -178,7 +195,65 @@ class LocalImageLoader:
         logger.info(f"镜像已提取到缓存: {cache_path}")
         return cache_path
     
-    def _register_image(self, image_name, cache_path, original_tar):
+    def import_to_blob_store(self, tar):
+        """
+        把镜像tar中的config和各层按digest导入blob存储，并生成、保存OCI manifest
+        
+        Args:
+            tar: 已打开的tarfile对象
+            
+        Returns:
+            dict: 写入缓存信息的 manifest_digest、config_digest 和 layers
+        """
+        store = BlobStore(os.path.join(self.cache_dir, 'blobs', 'sha256'))
+        entry = json.load(tar.extractfile('manifest.json'))[0]
+        config = self._import_blob(store, self._open_member(tar, entry['Config']))
+        config.pop('compression')
+        config['mediaType'] = OCI_CONFIG
+        layers = []
+        for name in entry['Layers']:
+            layer = self._import_blob(store, self._open_member(tar, name))
+            compression = layer.pop('compression')
+            layer['mediaType'] = OCI_LAYER + (f"+{compression}" if compression else '')
+            layers.append(layer)
+
+        manifest = {'schemaVersion': 2, 'mediaType': OCI_MANIFEST, 'config': config, 'layers': layers}
+        body = json.dumps(manifest, separators=(',', ':')).encode('utf-8')
+        manifest_digest = self._import_blob(store, io.BytesIO(body))['digest']
+        logger.info(f"镜像的 {len(layers)} 个层已导入blob存储")
+        return {
+            'manifest_digest': manifest_digest,
+            'config_digest': config['digest'],
+            'layers': [layer['digest'] for layer in layers],
+        }
+
+    @staticmethod
+    def _open_member(tar, name):
+        source = tar.extractfile(name)
+        if source is None:
+            raise ValueError(f"镜像tar中缺少 {name}")
+        return source
+
+    @staticmethod
+    def _import_blob(store, source):
+        """把数据按digest存入blob存储（已存在的不重复保存），返回描述符"""
+        tmp_path = os.path.join(store.root, f".import.{os.getpid()}.tmp")
+        hasher, size, head = hashlib.sha256(), 0, b''
+        with open(tmp_path, 'wb') as f:
+            for chunk in iter(lambda: source.read(1024 * 1024), b''):
+                if not head:
+                    head = chunk[:4]
+                hasher.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        digest = 'sha256:' + hasher.hexdigest()
+        if store.has(digest):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, store.path(digest))
+        return {'digest': digest, 'size': size, 'compression': detect_layer_compression(head)}
+
+    def _register_image(self, image_name, cache_path, original_tar, blob_info=None):
         """
         在本地镜像列表中注册加载的镜像
         
@@ -186,6 +261,7 @@ class LocalImageLoader:
             image_name: 镜像名称
             cache_path: 缓存文件路径
             original_tar: 原始tar文件路径
+            blob_info: import_to_blob_store 返回的digest信息
         """
         # 创建或更新镜像信息文件
         info_path = cache_path + '.info'
@@ -196,14 +272,17 @@ class LocalImageLoader:
         
         info_data = {
             'image_url': image_name,
+            'reference': normalize_image_reference(image_name),
             'cache_path': cache_path,
             'created_time': created_time,
             'created_time_str': created_time_str,
             'source': 'local',
             'original_tar': original_tar
         }
+        info_data.update(blob_info or {})
         
         with open(info_path, 'w') as f:
             json.dump(info_data, f, indent=2)
+        BlobRefs(self.cache_dir).record(cache_path, info_data)
         
         logger.info(f"镜像已注册: {image_name}")
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+推送缓存中的镜像到registry（docker push）
+沿用 DockerRegistryClient 的认证流程（token需要push权限）：
+    1. 对每个blob发HEAD，registry中已存在的跳过
+    2. 同一registry的其他仓库中有该blob时，用跨仓库挂载（POST ?mount=&from=）代替上传
+    3. 小blob一次PUT上传；大blob按块顺序PATCH，多个blob并发上传
+    4. 最后PUT manifest
+上传请求不会被盲目重发：PATCH失败后先GET上传地址查询已接收的范围，从断点继续；
+其余失败先确认registry中是否已有该blob或manifest，没有时重新开始上传会话。
+拉取的镜像使用blob存储中的原始manifest，docker load 加载的镜像使用加载时生成的OCI manifest。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote, urljoin
+
+from .blob_store import BlobIndex, BlobStore
+from .create_rootfs_tar import (DEFAULT_MAX_CONCURRENT_DOWNLOADS, DockerRegistryClient, RegistryHTTPError,
+                                is_retryable_error, resolve_http_backend)
+from .image_reference import ImageReference
+from .image_loader import LocalImageLoader
+from .manifest_cache import ManifestCache
+from .registry_cache import ChallengeCache, TokenCache
+from .registry_mirrors import DOCKER_HUB, normalize_registry_host
+
+logger = logging.getLogger(__name__)
+
+
+class ImagePushError(RuntimeError):
+    """镜像无法推送（缓存中缺少manifest或blob、registry拒绝等）"""
+
+
+class ImagePusher:
+    """把缓存中的镜像推送到registry"""
+
+    # 大于该大小的blob分块上传（PATCH），否则一次PUT
+    CHUNKED_UPLOAD_THRESHOLD = 16 * 1024 * 1024
+    CHUNK_SIZE = 8 * 1024 * 1024
+    # 每个blob最多尝试的跨仓库挂载来源数
+    MAX_MOUNT_SOURCES = 3
+
+    def __init__(self, cache_dir, username=None, password=None, max_concurrent_uploads=None,
+                 http_backend=None, transport=None):
+        self.cache_dir = cache_dir
+        self.username = username
+        self.password = password
+        self.max_concurrent_uploads = max_concurrent_uploads or DEFAULT_MAX_CONCURRENT_DOWNLOADS
+        self.http_backend = http_backend
+        self.transport = transport
+        self.store = BlobStore(os.path.join(cache_dir, 'blobs', 'sha256'))
+        self.index = BlobIndex(os.path.join(cache_dir, 'blobs', 'index.json'))
+
+    @staticmethod
+    def _registry_url(reference):
+        # Docker Hub的API地址是 registry-1.docker.io
+        host = 'registry-1.docker.io' if reference.registry == DOCKER_HUB else reference.registry
+        return f"https://{host}"
+
+    def push(self, cache_info, target):
+        """推送缓存条目（cache_info 为缓存信息）到 target 引用，返回registry中manifest的digest"""
+        reference = ImageReference.parse(target)
+        if reference.tag is None:
+            raise ImagePushError(f"推送目标需要tag: {target}")
+        if resolve_http_backend(self.http_backend) == 'curl' and self.transport is None:
+            raise ImagePushError("推送需要原生HTTP后端（curl后端不支持上传）")
+
+        if cache_info.get('source') == 'local' and not cache_info.get('manifest_digest'):
+            # 旧版本加载的镜像没有导入blob存储，先导入
+            with tarfile.open(cache_info['cache_path'], 'r') as tar:
+                cache_info = dict(cache_info, **LocalImageLoader(self.cache_dir).import_to_blob_store(tar))
+        manifest_body, media_type = self._load_manifest(cache_info)
+        manifest = json.loads(manifest_body)
+        blobs = [manifest['config']] + manifest.get('layers', [])
+        for blob in blobs:
+            if not self.store.has(blob['digest']):
+                raise ImagePushError(f"缓存中缺少blob {blob['digest']}，请重新拉取该镜像后再推送")
+
+        registry_url = self._registry_url(reference)
+        registry = normalize_registry_host(registry_url)
+        client = self._create_client(registry_url, reference)
+        mount_sources = {blob['digest']: self._mount_sources(blob['digest'], registry, reference.repository)
+                         for blob in blobs}
+        client.mount_sources = sorted({source for sources in mount_sources.values() for source in sources})
+
+        started = time.monotonic()
+        try:
+            # 先依次检查已存在的blob（同时完成认证），再并发上传缺少的
+            missing = [blob for blob in blobs if not self._blob_exists(client, blob['digest'])]
+            logger.info(f"共 {len(blobs)} 个blob，registry中已存在 {len(blobs) - len(missing)} 个")
+            results = {'mounted': 0, 'uploaded': 0}
+            uploaded_bytes = 0
+            with ThreadPoolExecutor(max_workers=self.max_concurrent_uploads) as executor:
+                futures = {executor.submit(self._push_blob, client, blob, mount_sources[blob['digest']]): blob
+                           for blob in missing}
+                for future in as_completed(futures):
+                    outcome = future.result()
+                    results[outcome] += 1
+                    if outcome == 'uploaded':
+                        uploaded_bytes += futures[future]['size']
+
+            digest = self._put_manifest(client, reference.tag, manifest_body, media_type)
+        finally:
+            client.close()
+
+        elapsed = time.monotonic() - started
+        rate = uploaded_bytes / elapsed / 1024 / 1024 if elapsed > 0 else 0
+        logger.info(f"推送统计: 上传 {results['uploaded']} 个blob（{uploaded_bytes / 1024 / 1024:.2f} MB，"
+                    f"{rate:.2f} MB/s），跨仓库挂载 {results['mounted']} 个，用时 {elapsed:.1f}s")
+        self.index.record(registry, reference.repository,
+                          [(blob['digest'], blob.get('size'), blob.get('mediaType')) for blob in blobs])
+        return digest
+
+    def _create_client(self, registry_url, reference):
+        client = DockerRegistryClient(registry_url, reference.repository, reference.tag,
+                                      self.username, self.password, backend=self.http_backend,
+                                      transport=self.transport, token_cache=TokenCache(self.cache_dir),
+                                      challenge_cache=ChallengeCache(self.cache_dir))
+        client.push_access = True
+        return client
+
+    def _load_manifest(self, cache_info):
+        """读取blob存储中镜像（拉取的为所选平台）的manifest"""
+        digest = cache_info.get('platform_digest') or cache_info.get('manifest_digest')
+        if not digest:
+            raise ImagePushError("缓存信息中没有manifest digest，请重新拉取该镜像后再推送")
+        try:
+            manifest, media_type, body = ManifestCache(self.cache_dir).load(digest)
+        except RuntimeError as e:
+            raise ImagePushError(f"{e}；请重新拉取该镜像后再推送") from e
+        if 'manifests' in manifest:
+            raise ImagePushError("缓存中只有多平台的manifest list，请重新拉取该镜像后再推送")
+        return body, media_type
+
+    def _mount_sources(self, digest, registry, repository):
+        """同一registry中已知含有该blob的其他仓库"""
+        entry = self.index.get(digest) or {}
+        sources = [source for source in entry.get('sources', {}).get(registry, []) if source != repository]
+        return sources[:self.MAX_MOUNT_SOURCES]
+
+    def _blob_exists(self, client, digest):
+        try:
+            client._make_registry_request(f"{client.image_name}/blobs/{digest}", method='HEAD')
+            return True
+        except RegistryHTTPError as e:
+            if e.status_code == 404:
+                return False
+            raise
+
+    @staticmethod
+    def _with_upload_retries(client, description, action, completed):
+        """执行上传；临时故障时先用 completed() 确认registry是否已处理了请求（返回非None即完成），未完成才重试"""
+        attempt = 1
+        while True:
+            try:
+                return action()
+            except Exception as e:
+                if attempt >= client.retry_policy.attempts or not is_retryable_error(e):
+                    raise
+                result = completed()
+                if result is not None:
+                    logger.info(f"{description}在失败前已被registry接收")
+                    return result
+                delay = client.retry_policy.delay(attempt)
+                logger.warning(f"{description}失败（第{attempt}次）: {e}，{delay:.1f}秒后重试")
+                time.sleep(delay)
+                attempt += 1
+
+    def _push_blob(self, client, blob, mount_sources):
+        """挂载或上传一个blob，返回 'mounted' 或 'uploaded'；上传会话失败时重新开始"""
+        digest = blob['digest']
+        return self._with_upload_retries(
+            client, f"上传 {digest[:19]}", lambda: self._push_blob_once(client, blob, mount_sources),
+            lambda: 'uploaded' if self._blob_exists(client, digest) else None)
+
+    def _push_blob_once(self, client, blob, mount_sources):
+        digest = blob['digest']
+        location = None
+        for source in mount_sources:
+            response = client._make_registry_request(
+                f"{client.image_name}/blobs/uploads/?mount={quote(digest)}&from={quote(source)}", method='POST')
+            if response['status_code'] == 201:
+                logger.info(f"跨仓库挂载 {digest[:19]}（来自 {source}）")
+                return 'mounted'
+            # registry不支持挂载时返回202并开始普通的上传会话
+            location = response['headers'].get('location')
+            break
+        if location is None:
+            response = client._make_registry_request(f"{client.image_name}/blobs/uploads/", method='POST')
+            location = response['headers'].get('location')
+        if not location:
+            raise ImagePushError(f"registry没有返回上传地址: {digest}")
+
+        path = self.store.path(digest)
+        size = os.path.getsize(path)
+        location = urljoin(client.registry_url, location)
+        if size > self.CHUNKED_UPLOAD_THRESHOLD:
+            location = self._upload_chunks(client, location, path, size)
+            body = b''
+        else:
+            with open(path, 'rb') as f:
+                body = f.read()
+        separator = '&' if '?' in location else '?'
+        client._make_registry_request(f"{location}{separator}digest={quote(digest)}", method='PUT', body=body,
+                                      headers={'Content-Type': 'application/octet-stream',
+                                               'Content-Length': str(len(body))})
+        logger.info(f"已上传 {digest[:19]}（{size / 1024 / 1024:.2f} MB）")
+        return 'uploaded'
+
+    def _upload_chunks(self, client, location, path, size):
+        """按块顺序PATCH上传，返回最后的上传地址
+
+        PATCH失败时registry可能已经保存了这一块，先查询上传状态再从registry确认的位置继续。
+        """
+        offset = 0
+        failures = 0
+        with open(path, 'rb') as f:
+            while offset < size:
+                f.seek(offset)
+                chunk = f.read(self.CHUNK_SIZE)
+                try:
+                    response = client._make_registry_request(location, method='PATCH', body=chunk, headers={
+                        'Content-Type': 'application/octet-stream',
+                        'Content-Length': str(len(chunk)),
+                        'Content-Range': f"{offset}-{offset + len(chunk) - 1}",
+                    })
+                except Exception as e:
+                    failures += 1
+                    if failures >= client.retry_policy.attempts or not is_retryable_error(e):
+                        raise
+                    offset, location = self._upload_status(client, location)
+                    logger.warning(f"上传块失败: {e}，registry已接收 {offset} 字节，从该位置继续")
+                    continue
+                offset += len(chunk)
+                location = urljoin(client.registry_url, response['headers'].get('location') or location)
+        return location
+
+    @staticmethod
+    def _upload_status(client, location):
+        """查询上传会话已接收的字节数（GET 上传地址，响应头 Range: 0-<最后字节>），返回 (偏移, 上传地址)"""
+        response = client._make_registry_request(location, method='GET')
+        match = re.search(r'(\d+)-(\d+)', response['headers'].get('range') or '')
+        offset = int(match.group(2)) + 1 if match else 0
+        return offset, urljoin(client.registry_url, response['headers'].get('location') or location)
+
+    def _manifest_digest(self, client, tag):
+        """registry中tag当前指向的manifest digest，不存在时返回None"""
+        try:
+            response = client._make_registry_request(f"{client.image_name}/manifests/{tag}", method='HEAD')
+        except RegistryHTTPError as e:
+            if e.status_code == 404:
+                return None
+            raise
+        return response['headers'].get('docker-content-digest')
+
+    def _put_manifest(self, client, tag, body, media_type):
+        data = body.encode('utf-8')
+        expected = 'sha256:' + hashlib.sha256(data).hexdigest()
+
+        def put():
+            response = client._make_registry_request(f"{client.image_name}/manifests/{tag}", method='PUT',
+                                                     body=data, headers={'Content-Type': media_type,
+                                                                         'Content-Length': str(len(data))})
+            return response['headers'].get('docker-content-digest') or expected
+
+        return self._with_upload_retries(client, f"推送manifest {tag}", put,
+                                         lambda: expected if self._manifest_digest(client, tag) == expected else None)
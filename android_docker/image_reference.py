@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+镜像引用的规范化
+把用户输入的各种等价写法（alpine、alpine:latest、library/alpine、docker.io/library/alpine:latest）
+解析为统一的 registry/仓库:tag[@digest] 形式，缓存按规范化后的引用命名，等价的写法共用一个缓存条目。
+"""
+
+import hashlib
+import re
+
+from .registry_mirrors import DOCKER_HUB, normalize_registry_host
+
+DEFAULT_TAG = 'latest'
+
+_DIGEST = re.compile(r'^[a-z0-9]+(?:[.+_-][a-z0-9]+)*:[a-zA-Z0-9=_-]+$')
+_INVALID_CHARS = re.compile(r'[\s<>@]')
+
+
+class ImageReference:
+    """规范化的镜像引用：registry、仓库、tag 和/或 digest"""
+
+    def __init__(self, registry, repository, tag=None, digest=None):
+        self.registry = registry
+        self.repository = repository
+        self.tag = tag
+        self.digest = digest
+
+    @classmethod
+    def parse(cls, reference):
+        """按Docker的规则解析镜像引用，无法解析时抛出 ValueError"""
+        if not reference or not reference.strip():
+            raise ValueError("镜像引用为空")
+        remainder = reference.strip()
+        if remainder.startswith('docker://'):
+            remainder = remainder[len('docker://'):]
+
+        digest = None
+        if '@' in remainder:
+            remainder, digest = remainder.split('@', 1)
+            if not _DIGEST.match(digest):
+                raise ValueError(f"无效的digest: {digest}")
+
+        tag = None
+        last_colon, last_slash = remainder.rfind(':'), remainder.rfind('/')
+        if last_colon > last_slash:
+            remainder, tag = remainder[:last_colon], remainder[last_colon + 1:]
+            if not tag:
+                raise ValueError(f"无效的镜像引用: {reference}")
+
+        # 第一段包含 . 或 :（端口），或为localhost时视为registry
+        registry, repository = DOCKER_HUB, remainder
+        first, _, rest = remainder.partition('/')
+        if rest and ('.' in first or ':' in first or first == 'localhost'):
+            registry, repository = normalize_registry_host(first), rest
+        if registry == DOCKER_HUB and '/' not in repository:
+            repository = f"library/{repository}"
+
+        if not repository or repository.startswith('/') or repository.endswith('/') \
+                or '//' in repository or _INVALID_CHARS.search(repository + (tag or '')):
+            raise ValueError(f"无效的镜像引用: {reference}")
+        if tag is None and digest is None:
+            tag = DEFAULT_TAG
+        return cls(registry, repository, tag, digest)
+
+    @property
+    def name(self):
+        return f"{self.registry}/{self.repository}"
+
+    @property
+    def familiar_name(self):
+        """Docker风格的简写仓库名（docker.io/library/alpine -> alpine）"""
+        if self.registry != DOCKER_HUB:
+            return self.name
+        if self.repository.startswith('library/') and self.repository.count('/') == 1:
+            return self.repository[len('library/'):]
+        return self.repository
+
+    @property
+    def reference(self):
+        """registry可识别的tag或digest（两者都有时以digest为准）"""
+        return self.digest or self.tag
+
+    def __str__(self):
+        text = self.name
+        if self.tag:
+            text += f":{self.tag}"
+        if self.digest:
+            text += f"@{self.digest}"
+        return text
+
+    def __repr__(self):
+        return f"ImageReference({str(self)!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, ImageReference) and str(self) == str(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+
+def normalize_image_reference(reference):
+    """返回规范化的引用字符串；无法解析时原样返回"""
+    try:
+        return str(ImageReference.parse(reference))
+    except ValueError:
+        return reference
+
+
+def image_cache_filename(reference):
+    """按规范化引用生成缓存文件名 <镜像名>_<hash16>.tar.gz；无法解析时抛出 ValueError"""
+    parsed = ImageReference.parse(reference)
+    key = hashlib.sha256(str(parsed).encode()).hexdigest()[:16]
+    return f"{parsed.repository.split('/')[-1]}_{key}.tar.gz"
+
+
+def legacy_cache_filename(image_url):
+    """旧版本按原始输入字符串生成的缓存文件名，用于迁移"""
+    url_hash = hashlib.sha256(image_url.encode()).hexdigest()[:16]
+    return f"{image_url.split('/')[-1].split(':')[0]}_{url_hash}.tar.gz"
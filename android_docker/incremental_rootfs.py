@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+增量重新拉取
+比较新旧镜像的层列表：共同前缀沿用缓存根文件系统中的提取结果，
+回退旧版本独有的层写入的文件（从前缀层恢复被覆盖的版本），再只应用新增的层。
+各层的文件清单按digest缓存在 <cache_dir>/blobs/listings/ 中，后续增量更新无需再次扫描。
+"""
+
+import json
+import logging
+import os
+import posixpath
+
+from .blob_store import digest_hex
+from .layer_compression import open_layer_tar
+
+logger = logging.getLogger(__name__)
+
+
+def common_prefix_length(old_layers, new_layers):
+    """两个层digest列表相同前缀的长度"""
+    length = 0
+    for old, new in zip(old_layers, new_layers):
+        if old != new:
+            break
+        length += 1
+    return length
+
+
+def normalize_member_name(name):
+    """把 ./etc/passwd、etc/ 等成员名统一为 etc/passwd、etc 的形式"""
+    name = posixpath.normpath(name)
+    return '' if name == '.' else name.lstrip('/')
+
+
+def is_extracted_member(member):
+    """与提取时的过滤规则一致：whiteout、设备文件和不安全的路径不会被提取"""
+    name = member.name
+    if name.startswith('.wh.') or '/.wh.' in name:
+        return False
+    if member.isdev() or member.isfifo():
+        return False
+    return not (name.startswith('/') or '..' in name)
+
+
+def list_layer_members(layer_path, media_type=None):
+    """扫描层文件，返回 {'files': [...], 'dirs': [...]}（目录以外的成员都计入files，dirs含隐式父目录）"""
+    files, dirs = set(), set()
+    with open_layer_tar(layer_path, media_type) as tar:
+        for member in tar:
+            if not is_extracted_member(member):
+                continue
+            name = normalize_member_name(member.name)
+            if not name:
+                continue
+            (dirs if member.isdir() else files).add(name)
+            # 层中可以不包含父目录的条目，提取时会隐式创建
+            parent = posixpath.dirname(name)
+            while parent and parent not in dirs:
+                dirs.add(parent)
+                parent = posixpath.dirname(parent)
+    return {'files': sorted(files), 'dirs': sorted(dirs)}
+
+
+class LayerListingCache:
+    """按digest缓存的层文件清单（<cache_dir>/blobs/listings/<hex>.json）"""
+
+    def __init__(self, cache_dir):
+        self.root = os.path.join(cache_dir, 'blobs', 'listings')
+
+    def get(self, digest, layer_path, media_type=None):
+        path = os.path.join(self.root, digest_hex(digest) + '.json')
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        listing = list_layer_members(layer_path, media_type)
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(listing, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.debug(f"保存层文件清单失败: {e}")
+        return listing
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+按digest缓存的层提取结果
+每个层单独提取到 <cache_dir>/layers/<hex>/，提取记录保存在 <hex>.json。
+构建根文件系统时逐层查找：命中的层直接把提取结果叠加复制到根文件系统，未命中的先提取到缓存再叠加。
+与已有镜像共用前N层的新镜像只需解压新增的层。
+叠加的语义与逐层解压相同（后面的层覆盖同名路径，目录合并）。层中指向前面层文件的硬链接在单独提取时无法解析，
+记录在提取记录中，叠加时从根文件系统中复制。
+缓存由 --layer-cache 或 ANDROID_DOCKER_LAYER_CACHE=1 开启；层blob被回收时其提取结果一并删除。
+"""
+
+import json
+import logging
+import os
+import shutil
+import time
+
+from .blob_store import digest_hex
+from .incremental_rootfs import normalize_member_name
+from .layer_compression import open_layer_tar
+from .rootfs_snapshot import overlay_tree, remove_tree
+
+logger = logging.getLogger(__name__)
+
+LAYER_CACHE_ENV = "ANDROID_DOCKER_LAYER_CACHE"
+
+
+def layer_cache_enabled(enabled=None):
+    """是否缓存层的提取结果：显式参数 > ANDROID_DOCKER_LAYER_CACHE > 关闭"""
+    if enabled is None:
+        enabled = os.environ.get(LAYER_CACHE_ENV, '').strip().lower() in ('1', 'true', 'yes', 'on')
+    return enabled
+
+
+class LayerCache:
+    """按digest保存的层提取结果（<cache_dir>/layers/<hex>/）"""
+
+    def __init__(self, cache_dir):
+        self.root = os.path.join(cache_dir, 'layers')
+
+    def path(self, digest):
+        return os.path.join(self.root, digest_hex(digest))
+
+    def _meta_path(self, digest):
+        return self.path(digest) + '.json'
+
+    def lookup(self, digest):
+        """返回已提取的层目录及其提取记录；未缓存时返回 (None, None)"""
+        path = self.path(digest)
+        if not os.path.isdir(path):
+            return None, None
+        try:
+            with open(self._meta_path(digest), 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        return path, meta
+
+    def build(self, digest, layer_path, extract, media_type=None):
+        """用 extract(目标目录) 把层提取到缓存，返回 (层目录, 提取记录)
+
+        先提取到临时目录，完成后重命名，其他进程不会看到提取了一半的层。
+        """
+        path = self.path(digest)
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        remove_tree(tmp_path)
+        os.makedirs(tmp_path)
+        try:
+            extract(tmp_path)
+            meta = {'digest': digest, 'links': self._unresolved_links(layer_path, tmp_path, media_type),
+                    'created': time.time()}
+            meta_tmp = f"{self._meta_path(digest)}.{os.getpid()}.tmp"
+            with open(meta_tmp, 'w') as f:
+                json.dump(meta, f)
+            os.replace(meta_tmp, self._meta_path(digest))
+            try:
+                os.rename(tmp_path, path)
+            except OSError:
+                # 其他进程已经提取好了同一层
+                logger.debug(f"层已由其他进程提取: {digest}")
+        finally:
+            remove_tree(tmp_path)
+        return self.lookup(digest)
+
+    @staticmethod
+    def _unresolved_links(layer_path, layer_dir, media_type=None):
+        """层中目标不在本层的硬链接，返回 [[路径, 目标], ...]"""
+        links = []
+        with open_layer_tar(layer_path, media_type) as tar:
+            for member in tar:
+                if not member.islnk():
+                    continue
+                name = normalize_member_name(member.name)
+                if name and not os.path.lexists(os.path.join(layer_dir, name)):
+                    links.append([name, normalize_member_name(member.linkname)])
+        return links
+
+    @staticmethod
+    def apply(layer_dir, meta, rootfs_dir):
+        """把已提取的层叠加到根文件系统，返回文件数"""
+        count = overlay_tree(layer_dir, rootfs_dir)
+        for name, target in (meta or {}).get('links', []):
+            source = os.path.join(rootfs_dir, target)
+            if not os.path.isfile(source):
+                logger.debug(f"硬链接目标不存在，跳过: {name} -> {target}")
+                continue
+            destination = os.path.join(rootfs_dir, name)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            if os.path.lexists(destination):
+                os.remove(destination)
+            shutil.copy2(source, destination)
+            count += 1
+        return count
+
+    def remove(self, digest):
+        """删除层的提取结果（层blob被回收时）"""
+        remove_tree(self.path(digest))
+        try:
+            os.remove(self._meta_path(digest))
+        except OSError:
+            pass
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+镜像层压缩格式识别与流式解压
+支持gzip、zstd（application/vnd.oci.image.layer.v1.tar+zstd）和未压缩的tar。
+zstd解码器按顺序选择：Python内置 compression.zstd（3.14+）> 可选的 zstandard 模块 > zstd 命令
+"""
+
+import contextlib
+import io
+import logging
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+MAGIC_SIZE = 4
+
+
+class ZstdNotAvailable(RuntimeError):
+    """没有可用的zstd解码器"""
+
+
+def detect_layer_compression(head, media_type=None):
+    """根据开头字节识别压缩格式，返回 'gzip'、'zstd' 或 None（未压缩）
+
+    以magic为准；数据太短无法判断时参考media type。
+    """
+    if head.startswith(GZIP_MAGIC):
+        compression = 'gzip'
+    elif head.startswith(ZSTD_MAGIC):
+        compression = 'zstd'
+    elif len(head) < MAGIC_SIZE and media_type:
+        compression = ('zstd' if media_type.endswith('+zstd')
+                       else 'gzip' if media_type.endswith(('+gzip', '.gzip')) else None)
+    else:
+        compression = None
+
+    if media_type and compression is None and media_type.endswith(('+zstd', '+gzip', '.gzip')):
+        logger.warning(f"层数据与media type不符（{media_type}），按未压缩tar处理")
+    return compression
+
+
+class _PrefixedReader(io.RawIOBase):
+    """先返回已读出的开头字节，再继续读取原始流"""
+
+    def __init__(self, prefix, stream):
+        super().__init__()
+        self._prefix = prefix
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._prefix:
+            n = min(len(buffer), len(self._prefix))
+            buffer[:n] = self._prefix[:n]
+            self._prefix = self._prefix[n:]
+            return n
+        data = getattr(self._stream, 'read1', self._stream.read)(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def sniff_layer_compression(stream, media_type=None):
+    """识别流的压缩格式，返回 (格式, 从头开始读取的流)；适用于不可seek的流"""
+    head = stream.read(MAGIC_SIZE)
+    return detect_layer_compression(head, media_type), io.BufferedReader(_PrefixedReader(head, stream))
+
+
+class _ZstdProcessReader(io.RawIOBase):
+    """通过 zstd -dc 子进程解压；输入由后台线程写入，避免管道双向阻塞"""
+
+    def __init__(self, binary, fileobj):
+        super().__init__()
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen([binary, '-d', '-c', '-q'], stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE, stderr=self._stderr)
+        self._error = None
+        self._feeder = threading.Thread(target=self._feed, args=(fileobj,), daemon=True)
+        self._feeder.start()
+
+    def _feed(self, fileobj):
+        try:
+            shutil.copyfileobj(fileobj, self._process.stdin, 256 * 1024)
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            self._error = e
+        finally:
+            try:
+                self._process.stdin.close()
+            except OSError:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self._process.stdout.readinto(buffer)
+        if not n:
+            self._finish()
+        return n
+
+    def _finish(self):
+        returncode = self._process.wait()
+        self._feeder.join()
+        if self._error is not None:
+            raise self._error
+        if returncode != 0:
+            self._stderr.seek(0)
+            message = self._stderr.read().decode('utf-8', 'replace').strip()
+            raise RuntimeError(f"zstd解压失败（退出码{returncode}）: {message[:500]}")
+
+    def close(self):
+        if not self.closed:
+            if self._process.poll() is None:
+                self._process.kill()
+            self._process.stdout.close()
+            self._process.wait()
+            self._feeder.join()
+            self._stderr.close()
+        super().close()
+
+
+def open_zstd_stream(fileobj):
+    """返回对fileobj流式解压zstd的只读文件对象"""
+    try:
+        from compression import zstd  # Python 3.14+
+        return zstd.ZstdFile(fileobj, 'rb')
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+    except ImportError:
+        pass
+    binary = shutil.which('zstd')
+    if binary:
+        return io.BufferedReader(_ZstdProcessReader(binary, fileobj))
+    raise ZstdNotAvailable("镜像层使用zstd压缩，但没有可用的解码器；请安装zstd（Termux: pkg install zstd）")
+
+
+@contextlib.contextmanager
+def open_layer_tar(path, media_type=None):
+    """以流模式打开层文件（gzip/zstd/未压缩），返回 tarfile 对象"""
+    with open(path, 'rb') as raw:
+        compression, stream = sniff_layer_compression(raw, media_type)
+        if compression == 'zstd':
+            with open_zstd_stream(stream) as decoded:
+                with tarfile.open(fileobj=decoded, mode='r|') as tar:
+                    yield tar
+        else:
+            with tarfile.open(fileobj=stream, mode='r|*') as tar:
+                yield tar
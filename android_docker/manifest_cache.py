@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+离线manifest缓存
+拉取时获取的manifest和index按digest保存在 <cache_dir>/blobs/sha256/ 中，tag指向的digest及记录时间
+保存在 <cache_dir>/blobs/tags.json。离线模式（--offline）下由此解析tag、digest和平台，不发出任何网络请求；
+本地缺少所需的数据时立即报错，而不是等待网络超时。
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+from .blob_store import BlobIndex, BlobStore, TagIndex
+
+logger = logging.getLogger(__name__)
+
+
+class OfflineImageUnavailable(RuntimeError):
+    """离线模式下本地缓存中缺少解析或构建镜像所需的数据"""
+
+
+class ManifestCache:
+    """本地保存的manifest、index和tag记录"""
+
+    def __init__(self, cache_dir):
+        blobs_dir = os.path.join(cache_dir, 'blobs')
+        self.store = BlobStore(os.path.join(blobs_dir, 'sha256'))
+        self.index = BlobIndex(os.path.join(blobs_dir, 'index.json'))
+        self.tags = TagIndex(os.path.join(blobs_dir, 'tags.json'))
+
+    def resolve(self, reference):
+        """返回引用（ImageReference）指向的manifest digest；digest引用直接使用其digest"""
+        if reference.digest:
+            return reference.digest
+        entry = self.tags.get(reference.registry, reference.repository, reference.tag)
+        if not entry:
+            raise OfflineImageUnavailable(f"离线模式: 本地没有 {reference} 的tag记录，请先在联网时拉取该镜像")
+        logger.info(f"离线解析 {reference} -> {entry['digest']}（记录于 {entry.get('updated_at', 0):.0f}）")
+        return entry['digest']
+
+    def load(self, digest, media_type=None):
+        """读取保存的manifest，返回 (manifest, media_type, 原始内容)"""
+        if not self.store.has(digest):
+            raise OfflineImageUnavailable(f"离线模式: 本地没有manifest {digest}，请先在联网时拉取该镜像")
+        with open(self.store.path(digest), 'rb') as f:
+            data = f.read()
+        if 'sha256:' + hashlib.sha256(data).hexdigest() != digest:
+            raise OfflineImageUnavailable(f"离线模式: 本地保存的manifest已损坏: {digest}")
+        manifest = json.loads(data)
+        media_type = (media_type or manifest.get('mediaType')
+                      or (self.index.get(digest) or {}).get('media_type')
+                      or ('application/vnd.oci.image.index.v1+json' if 'manifests' in manifest
+                          else 'application/vnd.oci.image.manifest.v1+json'))
+        return manifest, media_type, data.decode('utf-8')
+
+
+class OfflineRegistryClient:
+    """从 ManifestCache 读取manifest的registry客户端替身，供离线拉取使用；不能下载blob"""
+
+    def __init__(self, cache, registry_url, reference):
+        self.cache = cache
+        self.reference = reference
+        self.registry_url = registry_url
+        self.image_name = reference.repository
+        self.tag = reference.reference
+        self.manifest_body = None
+        self.manifest_digest = None
+        self.transport = None
+
+    def head_manifest(self):
+        return self.cache.resolve(self.reference)
+
+    def get_manifest(self):
+        digest = self.cache.resolve(self.reference)
+        manifest, media_type, body = self.cache.load(digest)
+        self.manifest_body, self.manifest_digest = body, digest
+        logger.info(f"Manifest类型: {media_type}（离线）")
+        return manifest, media_type
+
+    def get_manifest_by_digest(self, digest, media_type=None):
+        return self.cache.load(digest, media_type)
+
+    def download_blob(self, digest, output_path, cancel_event=None, size=None, progress=None):
+        raise OfflineImageUnavailable(f"离线模式: 本地没有blob {digest}，请先在联网时拉取该镜像")
+
+    def describe_connection_stats(self):
+        return None
+
+    def close(self):
+        pass
@@ -13,12 +13,20 @@ import json
 import tempfile
 import shutil
 import logging
-import hashlib
 import shlex
 import time
 import ipaddress
 from pathlib import Path
 
+from .blob_refs import BlobRefs
+from .create_rootfs_tar import DockerImageToRootFS, PULL_INFO_SUFFIX, resolve_http_backend
+from .image_reference import ImageReference, image_cache_filename, legacy_cache_filename, normalize_image_reference
+from .manifest_cache import ManifestCache, OfflineImageUnavailable
+from .pull_lock import PullLock
+from .rootfs_clone import materialize_snapshot
+from .rootfs_snapshot import (cached_rootfs_size, clone_snapshot, discard_snapshot, has_cached_rootfs,
+                              list_cache_entries, snapshot_path)
+
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -31,6 +39,11 @@ class ProotRunner:
     ENABLE_IMAGE_PATCHES_ENV = "ANDROID_DOCKER_ENABLE_IMAGE_PATCHES"
     DISABLE_SUPERVISOR_SOCKET_PATCH_ENV = "ANDROID_DOCKER_DISABLE_SUPERVISOR_SOCKET_PATCH"
     SUPERVISORD_INET_PORT = "127.0.0.1:9001"
+    # 拉取策略：always 每次用HEAD检查manifest是否变化；missing 仅在未缓存时拉取；never 只用本地缓存
+    PULL_POLICIES = ('always', 'missing', 'never')
+    DEFAULT_PULL_POLICY = 'missing'
+    # 缓存条目已迁移为按规范化镜像引用命名的标记文件
+    REFERENCE_MIGRATION_MARKER = '.reference_naming_v2'
 
     _cached_proot_help_text = None
     _cached_proot_supports_link2symlink = None
@@ -43,6 +56,7 @@ class ProotRunner:
         self._container_env_overrides = {}
         self.cache_dir = cache_dir or self._get_default_cache_dir()
         self._ensure_cache_dir()
+        self._migrate_legacy_cache_entries()
 
     def _get_default_cache_dir(self):
         """获取默认缓存目录"""
@@ -57,20 +71,61 @@ class ProotRunner:
         logger.debug(f"缓存目录: {self.cache_dir}")
 
     def _get_image_cache_path(self, image_url):
-        """根据镜像URL生成缓存路径"""
-        # 使用镜像URL的hash作为缓存文件名
-        url_hash = hashlib.sha256(image_url.encode()).hexdigest()[:16]
+        """根据规范化的镜像引用生成缓存路径，alpine 与 docker.io/library/alpine:latest 共用一个条目"""
+        try:
+            cache_filename = image_cache_filename(image_url)
+        except ValueError:
+            # 无法解析的引用沿用按原始字符串命名的方式
+            cache_filename = legacy_cache_filename(image_url)
+        return os.path.join(self.cache_dir, cache_filename)
 
-        # 提取镜像名称作为可读部分
-        image_name = image_url.split('/')[-1].split(':')[0]
-        cache_filename = f"{image_name}_{url_hash}.tar.gz"
+    def _migrate_legacy_cache_entries(self):
+        """把按原始输入字符串命名的旧缓存条目改名为规范化引用的命名；同一镜像有多个条目时保留最新的"""
+        marker = os.path.join(self.cache_dir, self.REFERENCE_MIGRATION_MARKER)
+        if os.path.exists(marker):
+            return
 
-        return os.path.join(self.cache_dir, cache_filename)
+        for filename in sorted(os.listdir(self.cache_dir)):
+            if not filename.endswith('.tar.gz'):
+                continue
+            cache_path = os.path.join(self.cache_dir, filename)
+            info_path = cache_path + '.info'
+            try:
+                with open(info_path, 'r') as f:
+                    info = json.load(f)
+                target = os.path.join(self.cache_dir, image_cache_filename(info['image_url']))
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+            if target == cache_path:
+                continue
+
+            if os.path.exists(target):
+                try:
+                    with open(target + '.info', 'r') as f:
+                        existing_time = json.load(f).get('created_time', 0)
+                except (OSError, ValueError):
+                    existing_time = 0
+                if existing_time >= info.get('created_time', 0):
+                    logger.info(f"删除重复的旧缓存条目: {filename}")
+                    for path in (cache_path, info_path):
+                        os.remove(path)
+                    continue
+
+            info['cache_path'] = target
+            info['reference'] = normalize_image_reference(info['image_url'])
+            os.replace(cache_path, target)
+            with open(target + '.info', 'w') as f:
+                json.dump(info, f, indent=2)
+            os.remove(info_path)
+            logger.info(f"缓存条目已迁移: {filename} -> {os.path.basename(target)}")
+
+        with open(marker, 'w') as f:
+            f.write(time.strftime('%Y-%m-%d %H:%M:%S') + '\n')
 
     def _is_image_cached(self, image_url):
-        """检查镜像是否已缓存"""
+        """检查镜像是否已缓存（tar.gz归档或根文件系统快照）"""
         cache_path = self._get_image_cache_path(image_url)
-        return os.path.exists(cache_path)
+        return has_cached_rootfs(cache_path)
 
     def _get_cache_info_path(self, image_url):
         """获取缓存信息文件路径"""
@@ -78,17 +133,29 @@ class ProotRunner:
         return cache_path + '.info'
 
     def _save_cache_info(self, image_url, cache_path):
-        """保存缓存信息"""
+        """保存缓存信息（合并create_rootfs_tar写出的拉取元数据，如manifest digest）"""
         info = {
             'image_url': image_url,
+            'reference': normalize_image_reference(image_url),
             'cache_path': cache_path,
             'created_time': time.time(),
             'created_time_str': time.strftime('%Y-%m-%d %H:%M:%S')
         }
 
+        pull_info_path = cache_path + PULL_INFO_SUFFIX
+        if os.path.exists(pull_info_path):
+            try:
+                with open(pull_info_path, 'r') as f:
+                    pull_info = json.load(f)
+                info.update({k: v for k, v in pull_info.items() if k not in info})
+            except Exception as e:
+                logger.warning(f"读取拉取元数据失败: {e}")
+            os.remove(pull_info_path)
+
         info_path = self._get_cache_info_path(image_url)
         with open(info_path, 'w') as f:
             json.dump(info, f, indent=2)
+        BlobRefs(self.cache_dir).record(cache_path, info)
 
     def _load_cache_info(self, image_url):
         """加载缓存信息"""
@@ -101,36 +168,150 @@ class ProotRunner:
                 logger.warning(f"读取缓存信息失败: {e}")
         return None
 
-    def _download_image(self, image_url, force_download=False, username=None, password=None):
-        """下载镜像到缓存"""
+    def _is_cached_image_current(self, image_url, cache_info, username=None, password=None):
+        """用一次HEAD请求比较registry中的manifest digest与拉取时记录的digest
+
+        返回 True（未变化）/ False（已变化或没有记录）；检查失败时抛出异常。
+        """
+        recorded = cache_info.get('manifest_digest')
+        if not recorded:
+            logger.info("缓存中没有记录manifest digest，需要重新拉取")
+            return False
+
+        processor = DockerImageToRootFS(image_url, username=username, password=password,
+                                        cache_dir=self.cache_dir)
+        remote = processor.get_remote_manifest_digest()
+        if remote == recorded:
+            logger.info(f"镜像未变化（{recorded}），跳过拉取")
+            return True
+        logger.info(f"镜像已更新: {recorded} -> {remote}")
+        return False
+
+    def _find_cached_image_by_digest(self, digest):
+        """查找拉取时manifest digest（或所选平台的子manifest digest）为 digest 的缓存条目"""
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.tar.gz.info'):
+                continue
+            try:
+                with open(os.path.join(self.cache_dir, filename), 'r') as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                continue
+            cache_path = os.path.join(self.cache_dir, filename[:-len('.info')])
+            if digest in (info.get('manifest_digest'), info.get('platform_digest')) and has_cached_rootfs(cache_path):
+                return cache_path, info
+        return None, None
+
+    def _resolve_cached_alias(self, image_url):
+        """离线解析：引用的tag/digest在本地manifest缓存中指向已缓存的另一个条目时，把该条目链接为此引用的缓存"""
+        try:
+            digest = ManifestCache(self.cache_dir).resolve(ImageReference.parse(image_url))
+        except (ValueError, OfflineImageUnavailable) as e:
+            logger.debug(f"离线解析失败: {e}")
+            return False
+        source_path, info = self._find_cached_image_by_digest(digest)
+        if not source_path:
+            return False
+
+        cache_path = self._get_image_cache_path(image_url)
+        if not os.path.exists(source_path):
+            clone_snapshot(source_path, cache_path)
+        else:
+            try:
+                os.link(source_path, cache_path)
+            except OSError:
+                shutil.copy2(source_path, cache_path)
+        info.update(image_url=image_url, reference=normalize_image_reference(image_url), cache_path=cache_path)
+        with open(self._get_cache_info_path(image_url), 'w') as f:
+            json.dump(info, f, indent=2)
+        BlobRefs(self.cache_dir).record(cache_path, info)
+        logger.info(f"离线模式: {image_url} 解析为 {digest}，使用已缓存的 {info.get('reference', source_path)}")
+        return True
+
+    def _download_image(self, image_url, force_download=False, username=None, password=None,
+                        max_concurrent_downloads=None, pull_policy=None, progress=None, offline=False):
+        """按拉取策略下载镜像到缓存；progress 为进度输出方式（auto/tty/plain/json）
+
+        offline 为 True 时不访问网络：优先使用已缓存的镜像（tag和digest按本地manifest缓存解析），
+        否则用本地保存的manifest和blob构建，缺少数据时立即失败。
+        """
         cache_path = self._get_image_cache_path(image_url)
+        pull_policy = pull_policy or self.DEFAULT_PULL_POLICY
+
+        if offline and not force_download and (self._is_image_cached(image_url)
+                                               or self._resolve_cached_alias(image_url)):
+            logger.info(f"离线模式，使用缓存的镜像: {cache_path}")
+            return cache_path
 
         # 检查缓存
-        if not force_download and self._is_image_cached(image_url):
+        if not offline and not force_download and self._is_image_cached(image_url):
             cache_info = self._load_cache_info(image_url)
             if cache_info:
+                if pull_policy != 'always':
+                    logger.info(f"使用缓存的镜像: {cache_path}")
+                    logger.info(f"缓存创建时间: {cache_info.get('created_time_str', 'Unknown')}")
+                    return cache_path
+                try:
+                    if self._is_cached_image_current(image_url, cache_info, username, password):
+                        return cache_path
+                except Exception as e:
+                    logger.error(f"检查镜像更新失败: {e}")
+                    return None
+        if not offline and not force_download and pull_policy == 'never':
+            if self._is_image_cached(image_url):
                 logger.info(f"使用缓存的镜像: {cache_path}")
-                logger.info(f"缓存创建时间: {cache_info.get('created_time_str', 'Unknown')}")
                 return cache_path
+            logger.error(f"镜像不在本地缓存中，且拉取策略为 never: {image_url}")
+            return None
 
-        logger.info(f"下载镜像: {image_url}")
+        # 同一镜像同时只有一个进程拉取，等待的进程直接复用其结果；
+        # 不同镜像共用的层由blob存储按digest加锁，只下载一次
+        wait_started = time.time()
+        with PullLock(self.cache_dir, cache_path) as lock:
+            if lock.waited:
+                cache_info = self._load_cache_info(image_url)
+                if (cache_info and has_cached_rootfs(cache_path)
+                        and cache_info.get('created_time', 0) >= wait_started):
+                    logger.info(f"使用其他进程刚拉取的镜像: {cache_path}")
+                    return cache_path
+            return self._build_image_cache(image_url, cache_path, force_download, username, password,
+                                           max_concurrent_downloads, progress, offline)
+
+    def _build_image_cache(self, image_url, cache_path, force_download=False, username=None, password=None,
+                           max_concurrent_downloads=None, progress=None, offline=False):
+        """运行 create_rootfs_tar 拉取镜像并写入缓存（调用方需持有该镜像的拉取锁）"""
+        logger.info(f"{'从本地缓存构建镜像（离线）' if offline else '下载镜像'}: {image_url}")
 
         # 调用create_rootfs_tar.py脚本
         cmd = [
             sys.executable,
             '-m', 'android_docker.create_rootfs_tar',
             '-o', cache_path,
+            '--cache-dir', self.cache_dir,
         ]
         if username:
             cmd.extend(['--username', username])
         if password:
             cmd.extend(['--password', password])
+        if max_concurrent_downloads:
+            cmd.extend(['--max-concurrent-downloads', str(max_concurrent_downloads)])
+        if progress:
+            cmd.extend(['--progress', progress])
+        if offline:
+            cmd.append('--offline')
         
         # 获取并传递代理参数
         proxy = os.environ.get('https_proxy') or os.environ.get('HTTPS_PROXY')
         if proxy:
             cmd.extend(['--proxy', proxy])
 
+        # 缓存中已有旧版本时增量更新：只下载并应用变化的层
+        if not force_download and self._is_image_cached(image_url):
+            base_layers = (self._load_cache_info(image_url) or {}).get('layers')
+            if base_layers:
+                base_rootfs = cache_path if os.path.exists(cache_path) else snapshot_path(cache_path)
+                cmd.extend(['--base-rootfs', base_rootfs, '--base-layers', ','.join(base_layers)])
+
         cmd.append(image_url)
 
         try:
@@ -177,7 +358,10 @@ class ProotRunner:
                 input_path,
                 force_download=getattr(args, 'force_download', False),
                 username=getattr(args, 'username', None),
-                password=getattr(args, 'password', None)
+                password=getattr(args, 'password', None),
+                max_concurrent_downloads=getattr(args, 'max_concurrent_downloads', None),
+                pull_policy=getattr(args, 'pull', None),
+                offline=getattr(args, 'offline', False),
             )
             if not cache_path:
                 return None
@@ -204,15 +388,17 @@ class ProotRunner:
         # The python interpreter will find the module.
         logger.info("✓ create_rootfs_tar.py module is available")
 
-        # 检查curl（create_rootfs_tar.py需要）
+        # 检查curl（仅 curl HTTP后端需要，原生后端下只作为后备）
         try:
             subprocess.run(['curl', '--version'],
                          capture_output=True, check=True)
             logger.info("✓ curl 已安装")
         except (subprocess.CalledProcessError, FileNotFoundError):
-            logger.error("✗ curl 未安装")
-            logger.info("请安装curl: pkg install curl (Termux) 或 apt install curl")
-            return False
+            if resolve_http_backend() == 'curl':
+                logger.error("✗ curl 未安装")
+                logger.info("请安装curl: pkg install curl (Termux) 或 apt install curl")
+                return False
+            logger.warning("curl 未安装，将仅使用原生HTTP传输")
 
         # 检查tar
         try:
@@ -252,7 +438,18 @@ class ProotRunner:
         self.rootfs_dir = target_dir
         os.makedirs(self.rootfs_dir, exist_ok=True)
 
-        # 3. 解压tar文件
+        # 3. snapshot 模式缓存的镜像：按克隆策略（reflink/hardlink/copy）从快照创建，无需解压
+        snapshot_dir = snapshot_path(rootfs_path)
+        if not os.path.exists(rootfs_path) and os.path.isdir(snapshot_dir):
+            try:
+                return materialize_snapshot(snapshot_dir, self.rootfs_dir)
+            except OSError as e:
+                logger.error(f"从快照创建根文件系统失败: {e}")
+                if is_temp:
+                    self._cleanup()
+                return None
+
+        # 4. 解压tar文件
         logger.info(f"检测到tar文件，正在解压: {rootfs_path} -> {self.rootfs_dir}")
         if rootfs_path.endswith('.tar.gz'):
             cmd = ['tar', '-xzf', rootfs_path, '-C', self.rootfs_dir]
@@ -1221,34 +1418,33 @@ class ProotRunner:
             return
 
         cache_files = []
-        for filename in os.listdir(self.cache_dir):
-            if filename.endswith('.tar.gz'):
-                cache_path = os.path.join(self.cache_dir, filename)
-                info_path = cache_path + '.info'
+        for cache_path in list_cache_entries(self.cache_dir):
+            filename = os.path.basename(cache_path)
+            info_path = cache_path + '.info'
 
-                # 获取文件信息
-                stat = os.stat(cache_path)
-                size_mb = stat.st_size / 1024 / 1024
+            # 尝试读取缓存信息
+            image_url = "Unknown"
+            created_time = "Unknown"
+            info = None
 
-                # 尝试读取缓存信息
-                image_url = "Unknown"
-                created_time = "Unknown"
-
-                if os.path.exists(info_path):
-                    try:
-                        with open(info_path, 'r') as f:
-                            info = json.load(f)
-                        image_url = info.get('image_url', 'Unknown')
-                        created_time = info.get('created_time_str', 'Unknown')
-                    except Exception:
-                        pass
-
-                cache_files.append({
-                    'filename': filename,
-                    'image_url': image_url,
-                    'size_mb': size_mb,
-                    'created_time': created_time
-                })
+            if os.path.exists(info_path):
+                try:
+                    with open(info_path, 'r') as f:
+                        info = json.load(f)
+                    image_url = info.get('image_url', 'Unknown')
+                    created_time = info.get('created_time_str', 'Unknown')
+                except Exception:
+                    pass
+
+            # 获取文件信息（快照为根文件系统大小）
+            size_mb = cached_rootfs_size(cache_path, info) / 1024 / 1024
+
+            cache_files.append({
+                'filename': filename,
+                'image_url': image_url,
+                'size_mb': size_mb,
+                'created_time': created_time
+            })
 
         if not cache_files:
             logger.info("没有缓存的镜像")
@@ -1277,8 +1473,11 @@ class ProotRunner:
                 if os.path.exists(path):
                     os.remove(path)
                     removed = True
+            if discard_snapshot(cache_path):
+                removed = True
 
             if removed:
+                BlobRefs(self.cache_dir).release(cache_path)
                 logger.info(f"已清理镜像缓存: {image_url}")
             else:
                 logger.info(f"镜像未缓存: {image_url}")
@@ -1398,6 +1597,24 @@ def main():
         help='强制重新下载镜像，忽略缓存'
     )
 
+    parser.add_argument(
+        '--max-concurrent-downloads',
+        type=int,
+        help='拉取镜像时并发下载的层数'
+    )
+
+    parser.add_argument(
+        '--pull',
+        choices=ProotRunner.PULL_POLICIES,
+        help='拉取策略: always(用HEAD检查更新), missing(默认，仅未缓存时拉取), never(只使用本地缓存)'
+    )
+
+    parser.add_argument(
+        '--offline',
+        action='store_true',
+        help='离线模式：按本地manifest缓存解析镜像，不访问网络，缺少数据时立即失败'
+    )
+
     parser.add_argument(
         '--cache-dir',
         help='指定缓存目录路径'
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+同一镜像并发拉取的跨进程互斥
+每个镜像缓存条目对应一个锁文件 <cache_dir>/locks/<缓存文件名>.lock，以 O_CREAT|O_EXCL 创建，内容为持有者的PID。
+其他进程等待锁释放后复用持有者的拉取结果；持有者进程已不存在时锁视为陈旧并被清除。
+该锁只串行化同一镜像的拉取。不同镜像共用的层由blob存储的 BlobLock（每个digest一个flock）保证只下载一次：
+后到的进程等待该blob提交后直接使用。
+"""
+
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def is_process_alive(pid):
+    """PID对应的进程是否仍在运行（无权发送信号的进程也视为在运行）"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+class PullLockTimeout(TimeoutError):
+    """等待其他进程完成拉取超时"""
+
+
+class PullLock:
+    """按镜像缓存路径的跨进程拉取锁"""
+
+    POLL_INTERVAL = 0.5
+    # 没有写入PID的锁文件、清除陈旧锁用的辅助锁超过该秒数仍存在时，视为创建者中途退出
+    BREAK_GUARD_TIMEOUT = 30
+
+    def __init__(self, cache_dir, cache_path, timeout=None):
+        self.path = os.path.join(cache_dir, 'locks', os.path.basename(cache_path) + '.lock')
+        self.timeout = timeout
+        self.waited = False
+        self._held = False
+
+    def _try_create(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'pid': os.getpid(), 'created': time.time()}, f)
+        return True
+
+    def holder(self):
+        """返回当前持有者的PID；锁不存在或内容无法读取时返回None"""
+        try:
+            with open(self.path, 'r') as f:
+                return int(json.load(f)['pid'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _is_abandoned(self):
+        """锁文件长时间没有写入PID（创建者在写入前退出）"""
+        try:
+            return time.time() - os.path.getmtime(self.path) > self.BREAK_GUARD_TIMEOUT
+        except OSError:
+            return False
+
+    def _break_if_stale(self, pid):
+        """持有者进程已不存在时删除锁；用辅助锁避免多个等待者同时清除，误删刚被他人重新创建的锁"""
+        guard = self.path + '.break'
+        try:
+            fd = os.open(guard, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(guard) > self.BREAK_GUARD_TIMEOUT:
+                    os.remove(guard)
+            except OSError:
+                pass
+            time.sleep(self.POLL_INTERVAL)
+            return
+        os.close(fd)
+        try:
+            if self.holder() == pid:
+                os.remove(self.path)
+                logger.warning(f"清除陈旧的拉取锁（进程 {pid} 已退出）: {self.path}")
+        except OSError:
+            pass
+        finally:
+            os.remove(guard)
+
+    def acquire(self):
+        """获取锁；需要等待其他进程时 self.waited 为 True"""
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        announced = None
+        while not self._try_create():
+            pid = self.holder()
+            if (pid is not None and not is_process_alive(pid)) or (pid is None and self._is_abandoned()):
+                self._break_if_stale(pid)
+                continue
+            self.waited = True
+            if pid is not None and pid != announced:
+                logger.info(f"进程 {pid} 正在拉取同一镜像，等待其完成...")
+                announced = pid
+            if deadline is not None and time.monotonic() >= deadline:
+                raise PullLockTimeout(f"等待拉取锁超时: {self.path}")
+            time.sleep(self.POLL_INTERVAL)
+        self._held = True
+        return self
+
+    def release(self):
+        if not self._held:
+            return
+        self._held = False
+        try:
+            if self.holder() == os.getpid():
+                os.remove(self.path)
+        except OSError as e:
+            logger.debug(f"释放拉取锁失败: {e}")
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+拉取进度与吞吐量统计
+按blob记录：接收字节数、速率、各阶段（download/verify/extract）耗时，以及是否命中本地缓存。
+输出方式：
+    tty   终端中原地刷新的紧凑视图（写到stderr）
+    json  每行一个JSON事件（写到stdout），便于汇总到监控面板
+    plain 拉取结束后记录每层的统计日志
+    auto  stderr是终端时为tty，否则为plain
+"""
+
+import contextlib
+import json
+import logging
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_MODES = ('auto', 'tty', 'plain', 'json')
+PHASES = ('download', 'verify', 'extract')
+
+
+def _format_bytes(value):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if value < 1024 or unit == 'GB':
+            return f"{value:.1f} {unit}" if unit != 'B' else f"{value:.0f} B"
+        value /= 1024
+
+
+def _format_seconds(value):
+    if value is None:
+        return '--'
+    value = int(value)
+    return f"{value // 60}m{value % 60:02d}s" if value >= 60 else f"{value}s"
+
+
+class _NullBlobProgress:
+    """不记录进度时使用的空实现"""
+
+    def advance(self, nbytes):
+        pass
+
+    def resume(self, nbytes):
+        pass
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        yield
+
+
+NULL_BLOB_PROGRESS = _NullBlobProgress()
+
+
+class BlobProgress:
+    """单个blob的进度，由下载线程和提取线程更新"""
+
+    def __init__(self, owner, digest, size, kind, cached):
+        self._owner = owner
+        self.digest = digest
+        self.size = size or 0
+        self.kind = kind
+        self.cached = cached
+        self.received = 0
+        self.resumed = 0
+        self.phase_name = 'cached' if cached else 'waiting'
+        self.phase_started = None
+        self.phases = {}
+
+    def advance(self, nbytes):
+        with self._owner.lock:
+            self.received += nbytes
+        self._owner.changed(self)
+
+    def resume(self, nbytes):
+        """断点续传时已在磁盘上的字节数（不计入网络接收量）"""
+        with self._owner.lock:
+            self.resumed = nbytes
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.monotonic()
+        with self._owner.lock:
+            previous = (self.phase_name, self.phase_started)
+            self.phase_name, self.phase_started = name, started
+        self._owner.emit({'event': 'phase', 'digest': self.digest, 'phase': name, 'status': 'start'})
+        status = 'error'
+        try:
+            yield self
+            status = 'done'
+        finally:
+            elapsed = time.monotonic() - started
+            with self._owner.lock:
+                self.phases[name] = self.phases.get(name, 0) + elapsed
+                if status != 'done':
+                    self.phase_name, self.phase_started = 'failed', None
+                elif name == 'verify':
+                    # verify 嵌套在 download 中，结束后回到原来的阶段
+                    self.phase_name, self.phase_started = previous
+                else:
+                    self.phase_name = 'downloaded' if name == 'download' else 'extracted'
+                    self.phase_started = None
+            event = {'event': 'phase', 'digest': self.digest, 'phase': name, 'status': status,
+                     'seconds': round(elapsed, 3)}
+            if name == 'download':
+                event.update(received=self.received, rate_bps=self.rate())
+            self._owner.emit(event)
+            self._owner.changed(self, force=True)
+
+    def rate(self):
+        """下载阶段的平均速率（字节/秒）"""
+        elapsed = self.phases.get('download', 0)
+        if self.phase_name == 'download' and self.phase_started is not None:
+            elapsed += time.monotonic() - self.phase_started
+        return int(self.received / elapsed) if elapsed > 0 else 0
+
+    def eta(self):
+        rate = self.rate()
+        left = self.size - self.resumed - self.received
+        if self.phase_name != 'download' or not rate or left <= 0:
+            return None
+        return left / rate
+
+    def to_dict(self):
+        return {
+            'digest': self.digest,
+            'kind': self.kind,
+            'size': self.size,
+            'cache': 'hit' if self.cached else 'miss',
+            'received': self.received,
+            'resumed': self.resumed,
+            'rate_bps': self.rate(),
+            'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+        }
+
+
+class PullProgress:
+    """一次拉取的进度汇总与输出"""
+
+    # 进度事件和终端刷新的最小间隔（秒）
+    UPDATE_INTERVAL = 0.5
+
+    def __init__(self, mode='auto', image=None, stdout=None, stderr=None):
+        self.stdout = stdout or sys.stdout
+        self.stderr = stderr or sys.stderr
+        if mode in (None, 'auto'):
+            mode = 'tty' if self.stderr.isatty() else 'plain'
+        self.mode = mode
+        self.image = image
+        self.lock = threading.RLock()
+        self.blobs = {}
+        self.started = time.monotonic()
+        self._last_update = {}
+        self._drawn_lines = 0
+
+    def blob(self, digest, size=None, kind='layer', cached=False):
+        """登记一个blob并返回其进度对象；重复登记返回同一对象"""
+        with self.lock:
+            if digest in self.blobs:
+                return self.blobs[digest]
+            progress = self.blobs[digest] = BlobProgress(self, digest, size, kind, cached)
+        self.emit({'event': 'blob', 'digest': digest, 'kind': kind, 'size': size or 0,
+                   'cache': 'hit' if cached else 'miss'})
+        return progress
+
+    def get(self, digest):
+        """返回已登记blob的进度对象，未登记时返回空实现"""
+        return self.blobs.get(digest) or NULL_BLOB_PROGRESS
+
+    def emit(self, event):
+        if self.mode != 'json':
+            return
+        event = dict(event, time=round(time.time(), 3))
+        if self.image:
+            event.setdefault('image', self.image)
+        with self.lock:
+            self.stdout.write(json.dumps(event, ensure_ascii=False) + '\n')
+            self.stdout.flush()
+
+    def changed(self, blob, force=False):
+        """blob进度更新；按 UPDATE_INTERVAL 节流输出"""
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self._last_update.get(blob.digest, 0) < self.UPDATE_INTERVAL:
+                return
+            self._last_update[blob.digest] = now
+        if self.mode == 'json' and blob.phase_name == 'download':
+            self.emit({'event': 'progress', 'digest': blob.digest, 'received': blob.received,
+                       'resumed': blob.resumed, 'size': blob.size, 'rate_bps': blob.rate(),
+                       'eta_s': None if blob.eta() is None else round(blob.eta(), 1)})
+        elif self.mode == 'tty':
+            self.render()
+
+    def render(self):
+        """在终端中原地重绘所有blob的状态"""
+        with self.lock:
+            lines = [self._describe(blob) for blob in self.blobs.values()]
+            output = ''
+            if self._drawn_lines:
+                output += f"\x1b[{self._drawn_lines}F"
+            output += ''.join(f"\x1b[2K{line}\n" for line in lines)
+            self.stderr.write(output)
+            self.stderr.flush()
+            self._drawn_lines = len(lines)
+
+    @staticmethod
+    def _describe(blob):
+        name = blob.digest.split(':')[-1][:12]
+        if blob.cached and not blob.phases:
+            return f"{name}  已缓存     {_format_bytes(blob.size)}"
+        done = blob.resumed + blob.received
+        text = f"{name}  {blob.phase_name:<10} {_format_bytes(done)}/{_format_bytes(blob.size)}"
+        if blob.phase_name == 'download':
+            text += f"  {_format_bytes(blob.rate())}/s  ETA {_format_seconds(blob.eta())}"
+        elif blob.phases:
+            text += '  ' + ' '.join(f"{phase} {blob.phases[phase]:.1f}s" for phase in PHASES if phase in blob.phases)
+        return text
+
+    def summary(self):
+        with self.lock:
+            blobs = [blob.to_dict() for blob in self.blobs.values()]
+        elapsed = time.monotonic() - self.started
+        received = sum(blob['received'] for blob in blobs)
+        return {
+            'elapsed': round(elapsed, 3),
+            'bytes_received': received,
+            'rate_bps': int(received / elapsed) if elapsed > 0 else 0,
+            'cache_hits': sum(1 for blob in blobs if blob['cache'] == 'hit'),
+            'cache_misses': sum(1 for blob in blobs if blob['cache'] == 'miss'),
+            'blobs': blobs,
+        }
+
+    def finish(self, success=True):
+        """输出最终统计"""
+        summary = self.summary()
+        if self.mode == 'json':
+            self.emit(dict(summary, event='summary', success=success))
+            return summary
+        totals = (f"拉取统计: 接收 {_format_bytes(summary['bytes_received'])}，"
+                  f"平均 {_format_bytes(summary['rate_bps'])}/s，用时 {summary['elapsed']:.1f}s，"
+                  f"缓存命中 {summary['cache_hits']}/{summary['cache_hits'] + summary['cache_misses']}")
+        if self.mode == 'tty':
+            # 终端视图中已有每层的最终状态，只追加汇总行
+            if self.blobs:
+                self.render()
+            self.stderr.write(totals + '\n')
+            self.stderr.flush()
+            return summary
+        for blob in summary['blobs']:
+            if blob['cache'] == 'hit' and not blob['phases']:
+                continue
+            phases = ', '.join(f"{name} {seconds:.1f}s" for name, seconds in blob['phases'].items())
+            logger.info(f"{blob['kind']} {blob['digest'][:19]}: {_format_bytes(blob['received'])}，"
+                        f"{_format_bytes(blob['rate_bps'])}/s（{phases}）")
+        logger.info(totals)
+        return summary
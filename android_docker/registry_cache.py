@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+registry状态缓存
+跨进程保存registry交互中可复用的状态，存放在 <cache_dir>/registry/ 下的JSON文件中
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台只有进程内互斥
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_CHALLENGE_PARAM = re.compile(r'(\w+)\s*=\s*(?:"([^"]*)"|([^,]*))')
+
+
+def _parse_issued_at(value):
+    """解析token服务返回的RFC3339时间（如 2024-01-01T00:00:00.123Z），失败返回None"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        return None
+    return parsed.replace(tzinfo=timezone.utc).timestamp()
+
+
+class JsonStateFile:
+    """线程和进程安全、原子写入的JSON状态文件
+
+    读取-修改-写回期间对 <path>.lock 加 flock，多个进程同时更新时不会互相覆盖。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def update(self, mutate):
+        """读取-修改-写回；mutate(data) 原地修改字典"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock, self._file_lock():
+            data = self.load()
+            mutate(data)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            return data
+
+    @contextmanager
+    def _file_lock(self):
+        """跨进程互斥：持有 <path>.lock 上的排他flock，关闭文件时释放"""
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+
+class TokenCache:
+    """bearer token缓存（<cache_dir>/registry/tokens.json）
+
+    以 realm + service + scope + 账号 为键，记录 expires_in / issued_at，
+    过期前（留出安全余量）可被其他进程直接复用。
+    """
+
+    # token服务未返回expires_in时，规范规定默认60秒
+    DEFAULT_EXPIRES_IN = 60
+    # 距离过期不足该秒数的token不再使用
+    EXPIRY_MARGIN = 30
+
+    def __init__(self, cache_dir):
+        self.state = JsonStateFile(os.path.join(cache_dir, 'registry', 'tokens.json'))
+
+    @staticmethod
+    def make_key(realm, service, scope, account=None):
+        return '|'.join([realm or '', service or '', scope or '', account or ''])
+
+    def _is_valid(self, entry, now):
+        return entry.get('token') and entry.get('expires_at', 0) - self.EXPIRY_MARGIN > now
+
+    def get(self, realm, service, scope, account=None):
+        """按 realm/service/scope 查找未过期的token"""
+        entry = self.state.load().get(self.make_key(realm, service, scope, account))
+        if entry and self._is_valid(entry, time.time()):
+            return entry['token']
+        return None
+
+    def find(self, registry, scope, account=None):
+        """在未探测认证服务器前，按registry和scope查找可用token"""
+        now = time.time()
+        for entry in self.state.load().values():
+            if (entry.get('registry') == registry and entry.get('scope') == scope
+                    and (entry.get('account') or None) == (account or None) and self._is_valid(entry, now)):
+                return entry['token']
+        return None
+
+    def put(self, realm, service, scope, token_data, registry=None, account=None):
+        """保存token服务的响应（token/access_token、expires_in、issued_at）"""
+        token = token_data.get('token') or token_data.get('access_token')
+        if not token:
+            return
+        try:
+            expires_in = int(token_data.get('expires_in') or self.DEFAULT_EXPIRES_IN)
+        except (TypeError, ValueError):
+            expires_in = self.DEFAULT_EXPIRES_IN
+        # 服务端时钟可能超前，issued_at 不晚于本地当前时间
+        issued_at = min(_parse_issued_at(token_data.get('issued_at')) or time.time(), time.time())
+        entry = {
+            'token': token,
+            'realm': realm,
+            'service': service,
+            'scope': scope,
+            'registry': registry,
+            'account': account,
+            'issued_at': issued_at,
+            'expires_in': expires_in,
+            'expires_at': issued_at + expires_in,
+        }
+        now = time.time()
+
+        def mutate(data):
+            # 顺便清理已过期的条目
+            for key in [k for k, v in data.items() if v.get('expires_at', 0) <= now]:
+                del data[key]
+            data[self.make_key(realm, service, scope, account)] = entry
+
+        try:
+            self.state.update(mutate)
+        except OSError as e:
+            logger.debug(f"保存认证token缓存失败: {e}")
+
+    def invalidate(self, token):
+        """删除被registry拒绝的token"""
+        def mutate(data):
+            for key in [k for k, v in data.items() if v.get('token') == token]:
+                del data[key]
+
+        try:
+            self.state.update(mutate)
+        except OSError as e:
+            logger.debug(f"更新认证token缓存失败: {e}")
+
+
+def parse_auth_challenge(header):
+    """解析 WWW-Authenticate 头，返回 {'scheme': 'bearer'|'basic'|..., 参数...}；无头时返回None"""
+    if not header:
+        return None
+    scheme, _, rest = header.strip().partition(' ')
+    challenge = {'scheme': scheme.lower()}
+    # 引号内的值可能含逗号（例如 scope="repository:a:pull,push"）
+    for key, quoted, plain in _CHALLENGE_PARAM.findall(rest):
+        challenge[key.lower()] = quoted or plain.strip()
+    return challenge
+
+
+def same_auth_challenge(a, b):
+    """比较两个质询是否指向同一认证服务（scope随仓库变化，不参与比较）"""
+    def identity(challenge):
+        challenge = challenge or {'scheme': 'none'}
+        return challenge.get('scheme'), challenge.get('realm'), challenge.get('service')
+    return identity(a) == identity(b)
+
+
+class ChallengeCache:
+    """每个registry的认证质询缓存（<cache_dir>/registry/challenges.json）
+
+    记录registry要求的认证方式（bearer的realm/service，或无需认证），
+    使后续拉取可以跳过匿名探测请求。
+    """
+
+    def __init__(self, cache_dir):
+        self.state = JsonStateFile(os.path.join(cache_dir, 'registry', 'challenges.json'))
+
+    def get(self, registry):
+        """返回缓存的质询；{'scheme': 'none'} 表示无需认证，None 表示没有记录"""
+        entry = self.state.load().get(registry)
+        return entry.get('challenge') if isinstance(entry, dict) else None
+
+    def put(self, registry, challenge):
+        challenge = {k: v for k, v in (challenge or {'scheme': 'none'}).items() if k != 'scope'}
+        entry = {'challenge': challenge, 'recorded_at': time.time()}
+
+        def mutate(data):
+            data[registry] = entry
+
+        try:
+            self.state.update(mutate)
+        except OSError as e:
+            logger.debug(f"保存认证质询缓存失败: {e}")
+
+
+def parse_rate_limit(value):
+    """解析 RateLimit-Limit / RateLimit-Remaining 头（如 "100;w=21600"），返回 (次数, 窗口秒数或None)"""
+    if not value:
+        return None
+    count, _, params = value.split(',')[0].partition(';')
+    try:
+        count = int(count.strip())
+    except ValueError:
+        return None
+    window = None
+    for param in params.split(';'):
+        key, _, raw = param.strip().partition('=')
+        if key == 'w' and raw.isdigit():
+            window = int(raw)
+    return count, window
+
+
+def parse_retry_after(value):
+    """解析 Retry-After 头（秒数或HTTP日期），返回等待秒数；无法解析返回None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitBudget:
+    """每个registry的拉取配额（<cache_dir>/registry/ratelimits.json）
+
+    记录 RateLimit-Limit / RateLimit-Remaining 与429的 Retry-After，
+    同一设备上的多个进程共享剩余配额，在配额用尽前推迟manifest请求。
+    """
+
+    # 未给出Retry-After时，按滑动窗口平均释放一次配额的时间估计等待，且不少于该秒数
+    MIN_WAIT = 60
+
+    def __init__(self, cache_dir):
+        self.state = JsonStateFile(os.path.join(cache_dir, 'registry', 'ratelimits.json'))
+
+    def get(self, registry):
+        entry = self.state.load().get(registry)
+        return entry if isinstance(entry, dict) else None
+
+    def record(self, registry, headers):
+        """从响应头更新配额；没有配额头时不做任何事，返回记录的条目"""
+        limit = parse_rate_limit(headers.get('ratelimit-limit'))
+        remaining = parse_rate_limit(headers.get('ratelimit-remaining'))
+        if not remaining:
+            return None
+        now = time.time()
+        window = remaining[1] or (limit[1] if limit else None)
+        entry = {
+            'limit': limit[0] if limit else None,
+            'remaining': remaining[0],
+            'window': window,
+            'source': headers.get('docker-ratelimit-source'),
+            'updated_at': now,
+        }
+        if remaining[0] <= 0:
+            entry['reset_at'] = now + self._estimate_wait(entry)
+        self._put(registry, entry)
+        return entry
+
+    def record_exhausted(self, registry, retry_after=None):
+        """收到429时记录配额已用尽，返回需要等待的秒数"""
+        now = time.time()
+        entry = dict(self.get(registry) or {}, remaining=0, updated_at=now)
+        wait = retry_after if retry_after is not None else self._estimate_wait(entry)
+        entry['reset_at'] = now + wait
+        self._put(registry, entry)
+        return wait
+
+    def wait_time(self, registry, needed=1):
+        """发送 needed 个计数的manifest请求前需要等待的秒数；配额充足或未知时返回0"""
+        entry = self.get(registry)
+        if not entry:
+            return 0
+        now = time.time()
+        window = entry.get('window')
+        if window and now - entry.get('updated_at', 0) >= window:
+            return 0
+        if entry.get('remaining', 0) >= needed:
+            return 0
+        reset_at = entry.get('reset_at') or entry.get('updated_at', now) + self._estimate_wait(entry)
+        return max(0, reset_at - now)
+
+    def _estimate_wait(self, entry):
+        if entry.get('window') and entry.get('limit'):
+            return max(self.MIN_WAIT, entry['window'] / entry['limit'])
+        return self.MIN_WAIT
+
+    def _put(self, registry, entry):
+        def mutate(data):
+            data[registry] = entry
+
+        try:
+            self.state.update(mutate)
+        except OSError as e:
+            logger.debug(f"保存拉取配额记录失败: {e}")
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+registry镜像加速（mirror）
+按上游registry配置mirror列表，探测延迟后从最快的可用mirror拉取，失败时依次回退到下一个，
+最后回退到上游registry。选中的mirror和观测到的吞吐量记录在 <cache_dir>/registry/mirrors.json
+
+配置写在 <cache_dir>/config.json 的 "registry-mirrors" 中：
+    {"registry-mirrors": {
+        "docker.io": ["https://docker.m.daocloud.io",
+                      "swr.cn-north-4.myhuaweicloud.com/ddn-k8s/docker.io"],
+        "ghcr.io": ["swr.cn-north-4.myhuaweicloud.com/ddn-k8s/ghcr.io"]}}
+带路径的mirror会把路径作为仓库名前缀；与Docker daemon.json相同的列表写法视为docker.io的mirror。
+"""
+
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from .http_transport import HttpTransport
+from .registry_cache import JsonStateFile
+
+logger = logging.getLogger(__name__)
+
+MIRRORS_CONFIG_KEY = 'registry-mirrors'
+DOCKER_HUB = 'docker.io'
+DOCKER_HUB_ALIASES = ('docker.io', 'registry-1.docker.io', 'index.docker.io')
+
+
+def normalize_registry_host(registry):
+    """去掉协议前缀并统一Docker Hub的多个域名"""
+    host = registry.split('://', 1)[-1].rstrip('/').lower()
+    return DOCKER_HUB if host in DOCKER_HUB_ALIASES else host
+
+
+class RegistryEndpoint:
+    """一个可拉取镜像的registry地址（上游或mirror），mirror可带仓库名前缀"""
+
+    def __init__(self, registry_url, repository_prefix='', is_mirror=False):
+        self.registry_url = registry_url
+        self.repository_prefix = repository_prefix.strip('/')
+        self.is_mirror = is_mirror
+
+    @classmethod
+    def from_mirror(cls, mirror):
+        """解析 'https://host[:port][/prefix]' 或 'host[/prefix]' 形式的mirror"""
+        if '://' not in mirror:
+            mirror = f"https://{mirror}"
+        parts = urlsplit(mirror)
+        return cls(f"{parts.scheme}://{parts.netloc}", parts.path, is_mirror=True)
+
+    @property
+    def label(self):
+        if self.repository_prefix:
+            return f"{self.registry_url}/{self.repository_prefix}"
+        return self.registry_url
+
+    def repository(self, image_name):
+        if self.repository_prefix:
+            return f"{self.repository_prefix}/{image_name}"
+        return image_name
+
+    def __repr__(self):
+        return self.label
+
+
+def load_mirror_config(cache_dir):
+    """读取 <cache_dir>/config.json 中的mirror配置，返回 {上游host: [mirror, ...]}"""
+    config_path = os.path.join(cache_dir, 'config.json')
+    try:
+        with open(config_path, 'r') as f:
+            mirrors = json.load(f).get(MIRRORS_CONFIG_KEY) or {}
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+    if isinstance(mirrors, list):
+        mirrors = {DOCKER_HUB: mirrors}
+    if not isinstance(mirrors, dict):
+        logger.warning(f"忽略无效的 {MIRRORS_CONFIG_KEY} 配置")
+        return {}
+    return {
+        normalize_registry_host(upstream): [m for m in (entries or []) if isinstance(m, str) and m]
+        for upstream, entries in mirrors.items()
+    }
+
+
+class MirrorSelector:
+    """为上游registry挑选mirror：优先复用近期记录的选择，否则并发探测延迟"""
+
+    PROBE_TIMEOUT = 3
+    # 记录的选择在该时间内有效，期间不再探测
+    SELECTION_TTL = 6 * 3600
+
+    def __init__(self, cache_dir, mirrors=None, probe=True):
+        self.mirrors = load_mirror_config(cache_dir) if mirrors is None else mirrors
+        self.state = JsonStateFile(os.path.join(cache_dir, 'registry', 'mirrors.json'))
+        self.probe_enabled = probe
+
+    def candidates(self, registry_url):
+        """返回按优先级排序的拉取地址，上游registry总是最后一个"""
+        upstream = normalize_registry_host(registry_url)
+        mirrors = [RegistryEndpoint.from_mirror(m) for m in self.mirrors.get(upstream, [])]
+        origin = RegistryEndpoint(registry_url)
+        if not mirrors:
+            return [origin]
+        return self._rank(upstream, mirrors) + [origin]
+
+    def _rank(self, upstream, mirrors):
+        record = self.state.load().get(upstream) or {}
+        stats = record.get('endpoints') or {}
+        by_label = {m.label: m for m in mirrors}
+
+        chosen = by_label.get(record.get('chosen'))
+        if chosen and time.time() - record.get('updated_at', 0) < self.SELECTION_TTL:
+            others = sorted((m for m in mirrors if m is not chosen),
+                            key=lambda m: -(stats.get(m.label, {}).get('throughput_bps') or 0))
+            logger.info(f"使用上次选择的mirror: {chosen.label}")
+            return [chosen] + others
+
+        if not self.probe_enabled:
+            return mirrors
+
+        with ThreadPoolExecutor(max_workers=len(mirrors), thread_name_prefix='mirror-probe') as executor:
+            latencies = dict(zip([m.label for m in mirrors], executor.map(self.probe, mirrors)))
+
+        healthy = sorted((m for m in mirrors if latencies[m.label] is not None),
+                         key=lambda m: latencies[m.label])
+        for mirror in mirrors:
+            latency = latencies[mirror.label]
+            if latency is None:
+                logger.info(f"mirror不可用: {mirror.label}")
+            else:
+                logger.info(f"mirror延迟: {mirror.label} {latency * 1000:.0f} ms")
+
+        self._update(upstream, lambda entry: entry['endpoints'].update({
+            label: dict(entry['endpoints'].get(label, {}),
+                        latency_ms=None if latency is None else round(latency * 1000))
+            for label, latency in latencies.items()
+        }))
+        return healthy
+
+    def probe(self, endpoint):
+        """请求 /v2/ 测量延迟；返回秒数，不可用时返回None"""
+        transport = HttpTransport(timeout=self.PROBE_TIMEOUT)
+        start = time.monotonic()
+        try:
+            response = transport.request('GET', f"{endpoint.registry_url}/v2/", verify=False)
+        except Exception as e:
+            logger.debug(f"探测mirror失败 {endpoint.label}: {e}")
+            return None
+        finally:
+            transport.close()
+        # 401表示需要认证，但服务本身可用
+        if response['status_code'] >= 500 or response['status_code'] == 404:
+            return None
+        return time.monotonic() - start
+
+    def _update(self, upstream, mutate_entry):
+        def mutate(data):
+            entry = data.setdefault(upstream, {})
+            entry.setdefault('endpoints', {})
+            mutate_entry(entry)
+
+        try:
+            self.state.update(mutate)
+        except OSError as e:
+            logger.debug(f"保存mirror记录失败: {e}")
+
+    def record_result(self, registry_url, endpoint, success, bytes_received=None, elapsed=None):
+        """记录一次拉取的结果；成功时把该地址记为上游的首选，并保存吞吐量"""
+        upstream = normalize_registry_host(registry_url)
+        if upstream not in self.mirrors:
+            return
+
+        def mutate_entry(entry):
+            stats = entry['endpoints'].setdefault(endpoint.label, {})
+            if success:
+                stats['failures'] = 0
+                stats['last_success'] = time.time()
+                if bytes_received and elapsed:
+                    stats['throughput_bps'] = round(bytes_received / elapsed)
+                entry['chosen'] = endpoint.label
+                entry['updated_at'] = time.time()
+            else:
+                stats['failures'] = stats.get('failures', 0) + 1
+                stats['last_failure'] = time.time()
+                if entry.get('chosen') == endpoint.label:
+                    # 首选地址失败后，下次拉取重新探测
+                    entry.pop('chosen', None)
+
+        self._update(upstream, mutate_entry)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+从快照创建容器根文件系统的克隆策略
+- reflink：FICLONE 共享数据块（btrfs、xfs、f2fs等），写入时由文件系统复制，容器之间完全隔离
+- hardlink：镜像中不可变的文件（可写目录和镜像声明的卷之外的文件）硬链接到快照，
+  可写目录中的文件总是复制出私有副本（写时复制在创建时完成）
+- copy：完整复制
+默认 auto 按文件系统自动选择：支持 reflink 时用 reflink，否则复制。
+检测结果按（快照所在设备，容器所在设备）缓存，每个文件系统只探测一次。
+hardlink 只在显式选择时使用：容器与快照共用 /usr、/bin、/lib 等处的文件，包管理器以重命名方式替换文件，不影响快照，
+但就地写入或chmod这些文件会反映到快照和其他容器上。
+策略由 ANDROID_DOCKER_CLONE_STRATEGY 选择（auto|reflink|hardlink|copy）。
+"""
+
+import errno
+import json
+import logging
+import os
+import shutil
+import time
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台
+    fcntl = None
+
+from .rootfs_snapshot import _copy_file, copy_tree
+
+logger = logging.getLogger(__name__)
+
+CLONE_STRATEGY_ENV = "ANDROID_DOCKER_CLONE_STRATEGY"
+CLONE_STRATEGIES = ('auto', 'reflink', 'hardlink', 'copy')
+# 容器运行时会就地修改的目录，hardlink 策略下其中的文件总是复制
+WRITABLE_PATHS = ('etc', 'home', 'root', 'run', 'tmp', 'var')
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+# 表示文件系统不支持该方式的错误，遇到后同一文件系统不再尝试
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS, errno.EPERM}
+
+# (快照设备, 容器设备, 方式) -> 是否支持
+_support = {}
+
+
+def resolve_clone_strategy(strategy=None):
+    """确定克隆策略：显式参数 > ANDROID_DOCKER_CLONE_STRATEGY > auto"""
+    strategy = (strategy or os.environ.get(CLONE_STRATEGY_ENV) or 'auto').strip().lower()
+    if strategy not in CLONE_STRATEGIES:
+        logger.warning(f"未知的克隆策略 '{strategy}'，使用 auto")
+        strategy = 'auto'
+    return strategy
+
+
+def image_volumes(snapshot_dir):
+    """镜像配置中声明的卷（容器会写入的目录），返回相对路径"""
+    try:
+        with open(os.path.join(snapshot_dir, '.image_config.json'), 'r') as f:
+            volumes = (json.load(f).get('config') or {}).get('Volumes') or {}
+    except (OSError, ValueError, AttributeError):
+        return []
+    return [os.path.normpath(volume.strip('/')) for volume in volumes if volume.strip('/')]
+
+
+def _reflink(source, destination):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "当前平台不支持FICLONE")
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source, destination, follow_symlinks=False)
+
+
+class RootfsCloner:
+    """按策略克隆快照中的普通文件，作为 copy_tree 的 copy_file 使用，并统计各方式的文件数和共享的字节数"""
+
+    def __init__(self, strategy='auto', writable_paths=WRITABLE_PATHS):
+        self.strategy = strategy
+        self.writable_paths = tuple(writable_paths)
+        self.target_dev = None
+        self.counts = {'reflink': 0, 'hardlink': 0, 'copy': 0}
+        self.shared_bytes = 0
+        self.copied_bytes = 0
+
+    def _is_writable(self, relative):
+        return any(relative == path or relative.startswith(path + os.sep) for path in self.writable_paths)
+
+    def _methods(self, relative):
+        methods = []
+        if self.strategy in ('auto', 'reflink'):
+            methods.append('reflink')
+        if self.strategy == 'hardlink' and not self._is_writable(relative):
+            methods.append('hardlink')
+        return methods
+
+    def __call__(self, path, destination, relative, st):
+        for method in self._methods(relative):
+            key = (st.st_dev, self.target_dev, method)
+            if _support.get(key) is False:
+                continue
+            try:
+                if method == 'reflink':
+                    _reflink(path, destination)
+                else:
+                    os.link(path, destination)
+            except OSError as e:
+                if os.path.lexists(destination):
+                    os.remove(destination)
+                if e.errno in _UNSUPPORTED_ERRNOS and key not in _support:
+                    _support[key] = False
+                    logger.debug(f"文件系统不支持 {method}: {e}")
+                continue
+            _support[key] = True
+            self.counts[method] += 1
+            self.shared_bytes += st.st_size
+            return
+        _copy_file(path, destination, False)
+        self.counts['copy'] += 1
+        self.copied_bytes += st.st_size
+
+    @property
+    def method(self):
+        """实际使用的主要方式（文件数最多的）"""
+        return max(('copy', 'hardlink', 'reflink'), key=lambda name: self.counts[name])
+
+
+def materialize_snapshot(snapshot_dir, target_dir, strategy=None):
+    """从快照创建容器的根文件系统，容器的修改不会影响快照中的可写目录；返回根文件系统目录"""
+    strategy = resolve_clone_strategy(strategy)
+    cloner = RootfsCloner(strategy, WRITABLE_PATHS + tuple(image_volumes(snapshot_dir)))
+    os.makedirs(target_dir, exist_ok=True)
+    cloner.target_dev = os.stat(target_dir).st_dev
+    started = time.monotonic()
+    count = copy_tree(snapshot_dir, target_dir, copy_file=cloner)
+    elapsed = time.monotonic() - started
+    details = '，'.join(f"{name} {cloner.counts[name]}" for name in ('reflink', 'hardlink', 'copy')
+                       if cloner.counts[name])
+    logger.info(f"根文件系统已从快照创建: {target_dir}（策略 {strategy} → {cloner.method}，{count} 个文件，"
+                f"用时 {elapsed:.1f}s，与快照共享 {cloner.shared_bytes / 1024 / 1024:.2f} MB，"
+                f"写入 {cloner.copied_bytes / 1024 / 1024:.2f} MB；{details or '无普通文件'}）")
+    return target_dir
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+根文件系统快照
+镜像存储模式为 snapshot 时，拉取后合并好的根文件系统不再压缩成 <缓存文件>.tar.gz，
+而是作为只读快照目录保存在 <cache_dir>/snapshots/<缓存文件名去掉.tar.gz>/ 中，
+创建容器时直接从快照复制出根文件系统，省去每个镜像一次完整的gzip压缩和每个容器一次完整的解压。
+快照只在拉取时整体替换（先写入临时目录再重命名），不会被就地修改，容器总是在自己的副本中运行。
+存储模式由 --image-store 或 ANDROID_DOCKER_IMAGE_STORE 选择，默认仍为 archive（tar.gz）。
+"""
+
+import logging
+import os
+import shutil
+import stat
+
+logger = logging.getLogger(__name__)
+
+IMAGE_STORE_ENV = "ANDROID_DOCKER_IMAGE_STORE"
+IMAGE_STORES = ('archive', 'snapshot')
+CACHE_SUFFIX = '.tar.gz'
+# 替换快照时使用的临时目录后缀
+_TRANSIENT_SUFFIXES = ('.tmp', '.old')
+
+
+def resolve_image_store(store=None):
+    """确定镜像存储模式：显式参数 > ANDROID_DOCKER_IMAGE_STORE > archive"""
+    store = (store or os.environ.get(IMAGE_STORE_ENV) or 'archive').strip().lower()
+    if store not in IMAGE_STORES:
+        logger.warning(f"未知的镜像存储模式 '{store}'，使用 archive")
+        store = 'archive'
+    return store
+
+
+def snapshot_path(cache_path):
+    """缓存条目（<cache_dir>/<名称>.tar.gz）对应的快照目录"""
+    name = os.path.basename(cache_path)
+    if name.endswith(CACHE_SUFFIX):
+        name = name[:-len(CACHE_SUFFIX)]
+    return os.path.join(os.path.dirname(os.path.abspath(cache_path)), 'snapshots', name)
+
+
+def has_cached_rootfs(cache_path):
+    """缓存条目是否有可用的根文件系统（tar.gz归档或快照）"""
+    return os.path.exists(cache_path) or os.path.isdir(snapshot_path(cache_path))
+
+
+def list_cache_entries(cache_dir):
+    """缓存目录中所有镜像条目的缓存路径，包括只有快照的条目"""
+    names = {name for name in os.listdir(cache_dir) if name.endswith(CACHE_SUFFIX)}
+    snapshots_dir = os.path.join(cache_dir, 'snapshots')
+    if os.path.isdir(snapshots_dir):
+        names.update(name + CACHE_SUFFIX for name in os.listdir(snapshots_dir)
+                     if not name.endswith(_TRANSIENT_SUFFIXES))
+    return [os.path.join(cache_dir, name) for name in sorted(names)]
+
+
+def tree_size(root):
+    """目录树中普通文件的总大小（硬链接只计一次）"""
+    total, seen = 0, set()
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            st = os.lstat(os.path.join(dirpath, name))
+            if stat.S_ISREG(st.st_mode) and (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_size
+    return total
+
+
+def cached_rootfs_size(cache_path, info=None):
+    """缓存条目占用的大小：归档为文件大小，快照为拉取时记录的根文件系统大小"""
+    if os.path.exists(cache_path):
+        return os.path.getsize(cache_path)
+    size = (info or {}).get('rootfs_size')
+    if size is None and os.path.isdir(snapshot_path(cache_path)):
+        size = tree_size(snapshot_path(cache_path))
+    return size or 0
+
+
+def remove_tree(path):
+    """删除目录树；先补上目录的写权限，镜像中只读的目录也能删除"""
+    if not os.path.lexists(path):
+        return
+    if os.path.isdir(path) and not os.path.islink(path):
+        os.chmod(path, stat.S_IMODE(os.lstat(path).st_mode) | stat.S_IRWXU)
+        for dirpath, dirnames, _ in os.walk(path):
+            for name in dirnames:
+                child = os.path.join(dirpath, name)
+                if not os.path.islink(child):
+                    os.chmod(child, stat.S_IMODE(os.lstat(child).st_mode) | stat.S_IRWXU)
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def _copy_file(source, target, link):
+    if link:
+        os.link(source, target)
+        return
+    try:
+        shutil.copy2(source, target)
+    except PermissionError:
+        # 镜像中不可读的文件（如权限为000的 /etc/gshadow）临时补上读权限再复制
+        mode = stat.S_IMODE(os.lstat(source).st_mode)
+        os.chmod(source, mode | stat.S_IRUSR)
+        try:
+            shutil.copy2(source, target)
+        finally:
+            os.chmod(source, mode)
+
+
+def copy_tree(source, target, link=False, copy_file=None):
+    """复制目录树，保留符号链接、权限、时间戳和树内的硬链接，返回文件数
+
+    link 为 True 时普通文件硬链接到源文件（只用于快照之间共享内容，快照不会被就地修改）。
+    copy_file(源文件, 目标文件, 相对路径, lstat结果) 可替换普通文件的复制方式（见 rootfs_clone）。
+    设备文件、FIFO等特殊文件跳过（proot下的根文件系统中不会用到）。
+    """
+    inodes = {}
+    directories = []
+    count = 0
+    for dirpath, dirnames, filenames in os.walk(source):
+        relative = os.path.relpath(dirpath, source)
+        target_dir = target if relative == '.' else os.path.join(target, relative)
+        os.makedirs(target_dir, exist_ok=True)
+        directories.append((dirpath, target_dir))
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            destination = os.path.join(target_dir, name)
+            st = os.lstat(path)
+            if stat.S_ISLNK(st.st_mode):
+                os.symlink(os.readlink(path), destination)
+            elif stat.S_ISREG(st.st_mode):
+                key = (st.st_dev, st.st_ino)
+                if st.st_nlink > 1 and key in inodes:
+                    os.link(inodes[key], destination)
+                else:
+                    if copy_file:
+                        copy_file(path, destination, os.path.normpath(os.path.join(relative, name)), st)
+                    else:
+                        _copy_file(path, destination, link)
+                    inodes[key] = destination
+            elif not stat.S_ISDIR(st.st_mode):
+                logger.debug(f"跳过特殊文件: {path}")
+                continue
+            count += 1
+    # 目录的权限和时间戳最后设置（子项写入会改变目录的修改时间；只读目录要在写完后再设置）
+    for source_dir, target_dir in reversed(directories):
+        shutil.copystat(source_dir, target_dir, follow_symlinks=False)
+    return count
+
+
+def _clear_path(path):
+    """删除路径上已有的条目（符号链接不跟随）"""
+    if os.path.islink(path) or (os.path.lexists(path) and not os.path.isdir(path)):
+        os.remove(path)
+    elif os.path.isdir(path):
+        remove_tree(path)
+
+
+def overlay_tree(source, target):
+    """把目录树叠加到 target 上，返回文件数
+
+    与逐层解压的语义相同：同名的文件和符号链接被替换，目录合并并使用上层的权限和时间戳。
+    target 中指向其内部目录的符号链接（如 lib -> usr/lib）沿用，上层的内容写入链接指向的目录。
+    """
+    target_root = os.path.realpath(target)
+    inodes = {}
+    directories = []
+    count = 0
+    for dirpath, dirnames, filenames in os.walk(source):
+        relative = os.path.relpath(dirpath, source)
+        target_dir = target if relative == '.' else os.path.join(target, relative)
+        directories.append((dirpath, target_dir))
+        descend = []
+        for name in dirnames:
+            path, destination = os.path.join(dirpath, name), os.path.join(target_dir, name)
+            if os.path.islink(path):
+                _clear_path(destination)
+                os.symlink(os.readlink(path), destination)
+                count += 1
+                continue
+            if os.path.islink(destination):
+                resolved = os.path.realpath(destination)
+                if not (os.path.isdir(resolved) and resolved.startswith(target_root + os.sep)):
+                    _clear_path(destination)
+                    os.mkdir(destination)
+            elif not os.path.isdir(destination):
+                _clear_path(destination)
+                os.mkdir(destination)
+            descend.append(name)
+        dirnames[:] = descend
+        for name in filenames:
+            path, destination = os.path.join(dirpath, name), os.path.join(target_dir, name)
+            st = os.lstat(path)
+            if stat.S_ISLNK(st.st_mode):
+                _clear_path(destination)
+                os.symlink(os.readlink(path), destination)
+            elif stat.S_ISREG(st.st_mode):
+                _clear_path(destination)
+                key = (st.st_dev, st.st_ino)
+                if st.st_nlink > 1 and key in inodes:
+                    os.link(inodes[key], destination)
+                else:
+                    _copy_file(path, destination, False)
+                    inodes[key] = destination
+            else:
+                logger.debug(f"跳过特殊文件: {path}")
+                continue
+            count += 1
+    for source_dir, target_dir in reversed(directories):
+        if not os.path.islink(target_dir):
+            shutil.copystat(source_dir, target_dir, follow_symlinks=False)
+    return count
+
+
+def commit_snapshot(rootfs_dir, cache_path):
+    """把合并好的根文件系统保存为缓存条目的快照（原子替换旧快照），并删除同一条目的tar.gz归档；返回快照目录"""
+    target = snapshot_path(cache_path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    remove_tree(tmp_path)
+    # 同一文件系统时为重命名，否则复制
+    shutil.move(rootfs_dir, tmp_path)
+    old_path = None
+    if os.path.exists(target):
+        old_path = f"{target}.{os.getpid()}.old"
+        os.rename(target, old_path)
+    os.rename(tmp_path, target)
+    if old_path:
+        remove_tree(old_path)
+    if os.path.exists(cache_path):
+        os.remove(cache_path)
+    return target
+
+
+def discard_snapshot(cache_path):
+    """删除缓存条目的快照（切换回 archive 模式或删除镜像时）"""
+    path = snapshot_path(cache_path)
+    if os.path.isdir(path):
+        remove_tree(path)
+        return True
+    return False
+
+
+def clone_snapshot(source_cache_path, cache_path):
+    """让另一个缓存条目共用已有的快照（文件硬链接，不占用额外空间）"""
+    target = snapshot_path(cache_path)
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    remove_tree(tmp_path)
+    copy_tree(snapshot_path(source_cache_path), tmp_path, link=True)
+    discard_snapshot(cache_path)
+    os.rename(tmp_path, target)
+    return target
+
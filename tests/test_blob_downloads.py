@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+镜像层下载流程测试
+覆盖并发调度、失败取消、断点续传等行为
+"""
+
+import os
+import sys
+import hashlib
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker.blob_store import BlobDigestMismatch, BlobIndex, BlobLock, BlobStore, PartialBlob, RangedBlob
+from android_docker.create_rootfs_tar import DockerImageToRootFS, DockerRegistryClient
+from android_docker.http_transport import HttpTransport
+
+
+def _digest(char):
+    return 'sha256:' + char * 64
+
+
+def _manifest(sizes):
+    layers = [
+        {'mediaType': 'application/vnd.oci.image.layer.v1.tar+gzip', 'digest': _digest(c), 'size': size}
+        for c, size in sizes
+    ]
+    return {
+        'schemaVersion': 2,
+        'config': {'mediaType': 'application/vnd.oci.image.config.v1+json', 'digest': _digest('f'), 'size': 10},
+        'layers': layers,
+    }
+
+
+class _FakeClient:
+    registry_url = 'https://registry.example.com'
+
+    def __init__(self, fail_digest=None, barrier=None, image_name='library/alpine'):
+        self.image_name = image_name
+        self.fail_digest = fail_digest
+        self.barrier = barrier
+        self.started = []
+        self.lock = threading.Lock()
+
+    def download_blob(self, digest, output_path, cancel_event=None, size=None, progress=None):
+        with self.lock:
+            self.started.append(digest)
+        if self.barrier is not None:
+            self.barrier.wait(timeout=5)
+        if digest == self.fail_digest:
+            raise RuntimeError("boom")
+        with open(output_path, 'wb') as f:
+            f.write(b'x' * size if size else digest.encode())
+        return output_path
+
+
+class TestConcurrentLayerDownloads(unittest.TestCase):
+    """_download_layers 的并发与调度"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_blob_downloads_')
+        self.blobs_dir = os.path.join(self.test_dir, 'blobs')
+        os.makedirs(self.blobs_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _processor(self, workers):
+        return DockerImageToRootFS('alpine:latest', output_path=os.path.join(self.test_dir, 'out.tar.gz'),
+                                   architecture='amd64', max_concurrent_downloads=workers)
+
+    def test_largest_layers_are_scheduled_first(self):
+        client = _FakeClient()
+        manifest = _manifest([('a', 5), ('b', 3000), ('c', 200)])
+
+        self._processor(1)._download_layers(client, manifest, self.blobs_dir)
+
+        # config大小为10，排在最小的层之前
+        self.assertEqual(client.started, [_digest('b'), _digest('c'), _digest('f'), _digest('a')])
+
+    def test_layers_download_in_parallel(self):
+        # 三个下载必须同时在途，barrier才能放行
+        client = _FakeClient(barrier=threading.Barrier(3))
+        manifest = _manifest([('a', 10), ('b', 20)])
+
+        self._processor(3)._download_layers(client, manifest, self.blobs_dir)
+
+        for char in 'abf':
+            self.assertTrue(os.path.exists(os.path.join(self.blobs_dir, char * 64)))
+
+    def test_failure_cancels_pending_downloads(self):
+        client = _FakeClient(fail_digest=_digest('b'))
+        manifest = _manifest([('a', 10), ('b', 3000), ('c', 200)])
+
+        with self.assertRaises(RuntimeError):
+            self._processor(1)._download_layers(client, manifest, self.blobs_dir)
+
+        self.assertEqual(client.started, [_digest('b')])
+
+    def test_duplicate_and_existing_blobs_are_skipped(self):
+        cached = b'cached....'
+        cached_hex = hashlib.sha256(cached).hexdigest()
+        with open(os.path.join(self.blobs_dir, cached_hex), 'wb') as f:
+            f.write(cached)
+        client = _FakeClient()
+        manifest = _manifest([('a', 10), ('b', 20), ('b', 20)])
+        manifest['layers'][0]['digest'] = 'sha256:' + cached_hex
+
+        self._processor(2)._download_layers(client, manifest, self.blobs_dir)
+
+        self.assertEqual(sorted(client.started), [_digest('b'), _digest('f')])
+
+    def test_completed_blobs_survive_failed_pull(self):
+        cache_dir = os.path.join(self.test_dir, 'cache')
+        manifest = _manifest([('a', 5), ('b', 3000), ('c', 200)])
+        processor = self._processor(1)
+        processor.cache_dir = cache_dir
+
+        with self.assertRaises(RuntimeError):
+            processor._download_layers(_FakeClient(fail_digest=_digest('a')), manifest, self.blobs_dir)
+
+        client = _FakeClient()
+        os.makedirs(os.path.join(self.test_dir, 'blobs2'))
+        processor._download_layers(client, manifest, os.path.join(self.test_dir, 'blobs2'))
+        self.assertEqual(client.started, [_digest('a')])
+        self.assertTrue(os.path.exists(os.path.join(self.test_dir, 'blobs2', 'b' * 64)))
+
+
+class TestCrossRepositoryReuse(unittest.TestCase):
+    """同一缓存目录下不同仓库共享blob"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_blob_reuse_')
+        self.cache_dir = os.path.join(self.test_dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _pull(self, client, manifest):
+        processor = DockerImageToRootFS('alpine:latest', architecture='amd64', cache_dir=self.cache_dir)
+        blobs_dir = tempfile.mkdtemp(dir=self.test_dir)
+        processor._download_layers(client, manifest, blobs_dir)
+        return blobs_dir
+
+    def test_base_layer_from_other_repository_is_linked_not_downloaded(self):
+        self._pull(_FakeClient(image_name='library/alpine'), _manifest([('a', 100), ('b', 20)]))
+
+        client = _FakeClient(image_name='team/app')
+        blobs_dir = self._pull(client, _manifest([('a', 100), ('c', 30)]))
+
+        self.assertEqual(client.started, [_digest('c')])
+        self.assertTrue(os.path.exists(os.path.join(blobs_dir, 'a' * 64)))
+        entry = BlobIndex(os.path.join(self.cache_dir, 'blobs', 'index.json')).get(_digest('a'))
+        self.assertEqual(entry['size'], 100)
+        self.assertEqual(entry['sources'], {'registry.example.com': ['library/alpine', 'team/app']})
+
+    def test_stored_blob_with_wrong_size_is_downloaded_again(self):
+        self._pull(_FakeClient(), _manifest([('a', 100)]))
+        with open(os.path.join(self.cache_dir, 'blobs', 'sha256', 'a' * 64), 'wb') as f:
+            f.write(b'truncated')
+
+        client = _FakeClient()
+        self._pull(client, _manifest([('a', 100)]))
+
+        self.assertEqual(client.started, [_digest('a')])
+
+    def test_corrupt_stored_blob_is_moved_aside_and_downloaded_again(self):
+        self._pull(_FakeClient(), _manifest([('a', 100)]))
+        blob_path = os.path.join(self.cache_dir, 'blobs', 'sha256', 'a' * 64)
+        # 大小不变的损坏，mtime与校验时不同
+        with open(blob_path, 'wb') as f:
+            f.write(b'y' * 100)
+        os.utime(blob_path, ns=(1, 1))
+
+        client = _FakeClient()
+        self._pull(client, _manifest([('a', 100)]))
+
+        self.assertEqual(client.started, [_digest('a')])
+        with open(blob_path + '.corrupt', 'rb') as f:
+            self.assertEqual(f.read(), b'y' * 100)
+
+    def test_stored_blob_digest_is_checked_once(self):
+        content = b'base layer'
+        digest = 'sha256:' + hashlib.sha256(content).hexdigest()
+        store = BlobStore(os.path.join(self.cache_dir, 'blobs', 'sha256'))
+        with open(store.path(digest), 'wb') as f:
+            f.write(content)
+        manifest = _manifest([])
+        manifest['layers'] = [{'mediaType': 'application/vnd.oci.image.layer.v1.tar+gzip',
+                               'digest': digest, 'size': len(content)}]
+
+        clients = [_FakeClient(), _FakeClient()]
+        with mock.patch.object(BlobStore, 'verify', wraps=store.verify) as verify:
+            for client in clients:
+                self._pull(client, manifest)
+
+        # 第一次复用时校验并记录，之后直接复用；下载的config提交时已校验
+        verify.assert_called_once_with(digest)
+        self.assertEqual([client.started for client in clients], [[_digest('f')], []])
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    data = b''
+    honor_range = True
+    ranges = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        range_header = self.headers.get('Range')
+        type(self).ranges.append(range_header)
+        body = type(self).data
+        if range_header and type(self).honor_range:
+            start, _, end = range_header[6:].partition('-')
+            start, end = int(start), int(end) if end else len(body) - 1
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(body)}')
+            body = body[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestResumableBlobDownloads(unittest.TestCase):
+    """断点文件与Range续传"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _RangeHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.registry_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_blob_resume_')
+        self.output_path = os.path.join(self.test_dir, 'blob')
+        _RangeHandler.data = bytes(range(256)) * 400
+        self.digest = 'sha256:' + hashlib.sha256(_RangeHandler.data).hexdigest()
+        _RangeHandler.honor_range = True
+        _RangeHandler.ranges = []
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _write_partial(self, content, recorded_length):
+        partial = PartialBlob(self.output_path, digest=self.digest)
+        partial.open(0)
+        partial.write(content)
+        partial.close()
+        partial.length = recorded_length
+        partial._save_meta()
+
+    def _download(self, digest=None, size=None):
+        client = DockerRegistryClient(self.registry_url, 'test/image', transport=HttpTransport(proxies={}))
+        client.download_blob(digest or self.digest, self.output_path, size=size)
+        with open(self.output_path, 'rb') as f:
+            return f.read()
+
+    def test_download_resumes_from_recorded_length(self):
+        # 记录之后的尾部（含错误数据）会被截掉
+        self._write_partial(_RangeHandler.data[:1000] + b'garbage', 1000)
+
+        self.assertEqual(self._download(), _RangeHandler.data)
+        self.assertEqual(_RangeHandler.ranges, ['bytes=1000-'])
+        self.assertFalse(os.path.exists(self.output_path + '.partial'))
+        self.assertFalse(os.path.exists(self.output_path + '.partial.json'))
+
+    def test_server_ignoring_range_restarts_from_zero(self):
+        _RangeHandler.honor_range = False
+        self._write_partial(_RangeHandler.data[:1000], 1000)
+
+        self.assertEqual(self._download(), _RangeHandler.data)
+
+    def test_digest_mismatch_is_rejected(self):
+        with self.assertRaises(BlobDigestMismatch):
+            self._download(digest='sha256:' + '0' * 64)
+
+        self.assertFalse(os.path.exists(self.output_path))
+        self.assertFalse(os.path.exists(self.output_path + '.partial'))
+
+    def test_oversized_blob_is_rejected_while_streaming(self):
+        with self.assertRaises(BlobDigestMismatch):
+            self._download(size=100)
+
+        self.assertFalse(os.path.exists(self.output_path + '.partial'))
+
+    def test_corrupt_resumed_prefix_triggers_full_download(self):
+        self._write_partial(b'x' * 1000, 1000)
+
+        self.assertEqual(self._download(), _RangeHandler.data)
+        self.assertEqual(_RangeHandler.ranges, ['bytes=1000-', None])
+
+    def _download_ranged(self):
+        with mock.patch.object(DockerRegistryClient, 'RANGED_DOWNLOAD_THRESHOLD', 1000):
+            return self._download(size=len(_RangeHandler.data))
+
+    def test_large_blob_is_fetched_in_parallel_ranges(self):
+        self.assertEqual(self._download_ranged(), _RangeHandler.data)
+
+        self.assertEqual(sorted(_RangeHandler.ranges),
+                         ['bytes=0-25599', 'bytes=25600-51199', 'bytes=51200-76799', 'bytes=76800-102399'])
+        self.assertFalse(os.path.exists(self.output_path + '.ranges'))
+        self.assertFalse(os.path.exists(self.output_path + '.ranges.json'))
+
+    def test_ranged_download_resumes_each_part(self):
+        ranged = RangedBlob(self.output_path, self.digest, len(_RangeHandler.data), 4)
+        ranged.prepare()
+        ranged.write(0, _RangeHandler.data[:25600])
+        ranged.write(2, _RangeHandler.data[51200:52000])
+        ranged.close()
+
+        self.assertEqual(self._download_ranged(), _RangeHandler.data)
+        self.assertEqual(sorted(_RangeHandler.ranges),
+                         ['bytes=25600-51199', 'bytes=52000-76799', 'bytes=76800-102399'])
+
+    def test_server_ignoring_ranges_falls_back_to_single_stream(self):
+        _RangeHandler.honor_range = False
+
+        self.assertEqual(self._download_ranged(), _RangeHandler.data)
+        self.assertIn(None, _RangeHandler.ranges)
+        self.assertFalse(os.path.exists(self.output_path + '.ranges'))
+
+    def test_second_writer_waits_and_uses_committed_blob(self):
+        # 模拟另一个进程：持有blob锁，写到一半
+        lock = BlobLock(self.output_path)
+        lock.acquire()
+        partial = PartialBlob(self.output_path, digest=self.digest)
+        partial.open(partial.resume_offset())
+        partial.write(_RangeHandler.data[:5000])
+
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(self._download()))
+        waiter.start()
+        waiter.join(0.5)
+
+        # 等待者既没有截断断点文件，也没有发出请求
+        self.assertTrue(waiter.is_alive())
+        self.assertEqual(_RangeHandler.ranges, [])
+        self.assertEqual(os.path.getsize(self.output_path + '.partial'), 5000)
+
+        partial.write(_RangeHandler.data[5000:])
+        partial.commit()
+        lock.release()
+        waiter.join(5)
+
+        self.assertEqual(results, [_RangeHandler.data])
+        self.assertEqual(_RangeHandler.ranges, [])
+
+    def test_concurrent_downloads_of_same_blob_fetch_once(self):
+        results = []
+        writers = [threading.Thread(target=lambda: results.append(self._download())) for _ in range(2)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join(10)
+
+        self.assertEqual(results, [_RangeHandler.data] * 2)
+        self.assertEqual(_RangeHandler.ranges, [None])
+        self.assertFalse(os.path.exists(self.output_path + '.partial'))
+
+    def test_partial_for_other_digest_is_discarded(self):
+        self._write_partial(_RangeHandler.data[:1000], 1000)
+        partial = PartialBlob(self.output_path, digest='sha256:bbb')
+
+        self.assertEqual(partial.resume_offset(), 0)
+        self.assertFalse(os.path.exists(self.output_path + '.partial'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+blob存储引用计数测试
+多个镜像共用的层只保存一份；删除镜像或重新拉取后，只回收不再被任何镜像引用的blob
+"""
+
+import io
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker.blob_refs import BlobRefs
+from android_docker.blob_store import BlobStore, TagIndex
+from android_docker.create_rootfs_tar import PULL_INFO_SUFFIX
+from android_docker.image_loader import LocalImageLoader
+from android_docker.proot_runner import ProotRunner
+
+
+def _digest(data):
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+
+class TestBlobRefs(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='test_blob_refs_')
+        self.runner = ProotRunner(cache_dir=self.cache_dir)
+        self.store = BlobStore(os.path.join(self.cache_dir, 'blobs', 'sha256'))
+        self.refs = BlobRefs(self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _put(self, data):
+        with open(self.store.path(_digest(data)), 'wb') as f:
+            f.write(data)
+        return _digest(data)
+
+    def _pull(self, image_url, layers):
+        """模拟一次拉取：blob写入存储，拉取元数据由runner合并进缓存信息"""
+        cache_path = self.runner._get_image_cache_path(image_url)
+        with open(cache_path, 'wb') as f:
+            f.write(b'rootfs')
+        pull_info = {'manifest_digest': self._put(image_url.encode()), 'config_digest': self._put(b'{}'),
+                     'layers': [self._put(layer) for layer in layers]}
+        with open(cache_path + PULL_INFO_SUFFIX, 'w') as f:
+            json.dump(pull_info, f)
+        self.runner._save_cache_info(image_url, cache_path)
+        return pull_info
+
+    def test_shared_layers_survive_until_last_image_is_removed(self):
+        base = self._pull('team/one:1', [b'base', b'one'])['layers'][0]
+        two = self._pull('team/two:1', [b'base', b'two'])
+        TagIndex(os.path.join(self.cache_dir, 'blobs', 'tags.json')).record(
+            'docker.io', 'team/two', '1', two['manifest_digest'], None)
+        self.assertEqual(self.refs.count(base), 2)
+        self.assertEqual(self.refs.count(_digest(b'{}')), 2)
+
+        self.runner.clear_cache('team/one:1')
+        self.assertTrue(self.store.has(base))
+        self.assertFalse(self.store.has(_digest(b'one')))
+        self.assertFalse(self.store.has(_digest(b'team/one:1')))
+
+        self.runner.clear_cache('team/two:1')
+        for digest in [base, two['config_digest'], two['manifest_digest']] + two['layers']:
+            self.assertFalse(self.store.has(digest))
+        self.assertIsNone(TagIndex(os.path.join(self.cache_dir, 'blobs', 'tags.json')).get('docker.io', 'team/two', '1'))
+
+    def test_repull_collects_replaced_layers(self):
+        self._pull('team/app:1', [b'base', b'old'])
+        self._pull('team/app:1', [b'base', b'new'])
+
+        self.assertFalse(self.store.has(_digest(b'old')))
+        self.assertTrue(self.store.has(_digest(b'base')))
+        self.assertEqual(self.refs.count(_digest(b'new')), 1)
+
+    def test_unreferenced_blobs_are_kept(self):
+        legacy = self._put(b'pulled before refcounting')
+        self._pull('team/app:1', [b'base'])
+        self.runner.clear_cache('team/app:1')
+        self.assertTrue(self.store.has(legacy))
+
+    def test_load_imports_layers_into_store(self):
+        tar_path = os.path.join(self.cache_dir, 'saved.tar')
+        with tarfile.open(tar_path, 'w') as tar:
+            for name, data in [('manifest.json', json.dumps([{'Config': 'config.json', 'RepoTags': ['tweak:1'],
+                                                              'Layers': ['base.tar']}]).encode()),
+                               ('config.json', b'{}'), ('base.tar', b'base')]:
+                member = tarfile.TarInfo(name)
+                member.size = len(data)
+                tar.addfile(member, io.BytesIO(data))
+        self._pull('team/app:1', [b'base'])
+
+        success, image_name, error = LocalImageLoader(self.cache_dir).load_image(tar_path)
+
+        self.assertTrue(success, error)
+        info = self.runner._load_cache_info(image_name)
+        self.assertEqual(info['layers'], [_digest(b'base')])
+        self.assertEqual(self.refs.count(_digest(b'base')), 2)
+        with open(self.store.path(info['manifest_digest']), 'rb') as f:
+            self.assertEqual(json.load(f)['config']['digest'], _digest(b'{}'))
+
+
+if __name__ == '__main__':
+    unittest.main()
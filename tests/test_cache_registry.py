@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+serve-cache 只读registry测试
+用registry客户端从本地缓存拉取manifest和blob
+"""
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker.cache_registry import CacheRegistryServer
+from android_docker.create_rootfs_tar import DockerImageToRootFS, DockerRegistryClient, RegistryHTTPError
+from android_docker.http_transport import HttpTransport
+
+OCI_MANIFEST = 'application/vnd.oci.image.manifest.v1+json'
+
+
+def _digest(data):
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+
+class _PulledClient:
+    registry_url = 'https://registry-1.docker.io'
+    image_name = 'library/alpine'
+    tag = 'latest'
+
+
+class TestCacheRegistry(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='test_cache_registry_')
+        self.download_dir = tempfile.mkdtemp(prefix='test_cache_registry_out_')
+        self.layer = os.urandom(300000)
+        self.config = b'{"architecture": "amd64"}'
+        manifest = {
+            'schemaVersion': 2,
+            'mediaType': OCI_MANIFEST,
+            'config': {'digest': _digest(self.config), 'size': len(self.config)},
+            'layers': [{'digest': _digest(self.layer), 'size': len(self.layer)}],
+        }
+        self.manifest_body = json.dumps(manifest)
+        self.manifest_digest = _digest(self.manifest_body.encode())
+
+        store = os.path.join(self.cache_dir, 'blobs', 'sha256')
+        os.makedirs(store)
+        for data in (self.layer, self.config):
+            with open(os.path.join(store, _digest(data)[7:]), 'wb') as f:
+                f.write(data)
+        # 与拉取时相同：原始manifest按digest存入blob存储并记录tag
+        processor = DockerImageToRootFS('alpine:latest', architecture='amd64', cache_dir=self.cache_dir)
+        processor._store_manifest(_PulledClient(), self.manifest_body, self.manifest_digest,
+                                  OCI_MANIFEST, tag='latest')
+
+        self.server = CacheRegistryServer(self.cache_dir, '127.0.0.1', 0)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.registry_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        shutil.rmtree(self.download_dir, ignore_errors=True)
+
+    def _client(self, image_name='library/alpine', tag='latest'):
+        return DockerRegistryClient(self.registry_url, image_name, tag, transport=HttpTransport(proxies={}))
+
+    def test_pull_manifest_by_tag(self):
+        client = self._client()
+
+        manifest, content_type = client.get_manifest()
+
+        self.assertEqual(content_type, OCI_MANIFEST)
+        self.assertEqual(client.manifest_digest, self.manifest_digest)
+        self.assertEqual(manifest['layers'][0]['digest'], _digest(self.layer))
+        self.assertEqual(self._client().head_manifest(), self.manifest_digest)
+
+    def test_manifest_by_digest(self):
+        manifest, _ = self._client(tag=self.manifest_digest).get_manifest()
+
+        self.assertEqual(manifest['config']['digest'], _digest(self.config))
+
+    def test_download_blob(self):
+        output = os.path.join(self.download_dir, 'layer')
+
+        self._client().download_blob(_digest(self.layer), output)
+
+        with open(output, 'rb') as f:
+            self.assertEqual(f.read(), self.layer)
+
+    def test_ranged_blob_download(self):
+        output = os.path.join(self.download_dir, 'layer')
+
+        with mock.patch.object(DockerRegistryClient, 'RANGED_DOWNLOAD_THRESHOLD', 1000):
+            self._client().download_blob(_digest(self.layer), output, size=len(self.layer))
+
+        with open(output, 'rb') as f:
+            self.assertEqual(f.read(), self.layer)
+
+    def test_unknown_image_is_not_found(self):
+        with self.assertRaises(RegistryHTTPError) as context:
+            self._client('library/debian').get_manifest()
+        self.assertEqual(context.exception.status_code, 404)
+
+    def test_writes_are_rejected(self):
+        transport = HttpTransport(proxies={})
+
+        response = transport.request('PUT', f"{self.registry_url}/v2/library/alpine/manifests/latest", body=b'{}')
+
+        self.assertGreaterEqual(response['status_code'], 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
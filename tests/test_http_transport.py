@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+原生HTTP传输层测试
+使用本地HTTP服务器验证连接复用、重定向和流式写入
+"""
+
+import os
+import sys
+import hashlib
+import tempfile
+import shutil
+import threading
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker.http_transport import HttpTransport
+from android_docker.create_rootfs_tar import HTTP_BACKEND_ENV, DockerRegistryClient
+from android_docker.proot_runner import ProotRunner
+
+
+class _RegistryHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    blobs = {}
+    seen_headers = []
+    seen_methods = []
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_GET(self):
+        type(self).seen_methods.append((self.command, self.path))
+        type(self).seen_headers.append((self.path, dict(self.headers)))
+        if self.path.startswith('/v2/test/image/blobs/'):
+            digest = self.path.rsplit('/', 1)[-1]
+            location = f"http://127.0.0.1:{self.server.cdn_port}/cdn/{digest}"
+            return self._reply(307, headers={'Location': location})
+        if self.path.startswith('/cdn/'):
+            digest = self.path.rsplit('/', 1)[-1]
+            return self._reply(200, type(self).blobs[digest])
+        if self.path.startswith('/v2/test/image/manifests/'):
+            return self._reply(200, b'{"schemaVersion": 2, "layers": []}',
+                               {'Content-Type': 'application/vnd.oci.image.manifest.v1+json',
+                                'Docker-Content-Digest': 'sha256:' + 'c' * 64})
+        return self._reply(200, b'{}', {'Content-Type': 'application/json'})
+
+    do_HEAD = do_GET
+
+
+class TestHttpTransport(unittest.TestCase):
+    """验证原生传输的连接复用与CDN重定向"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.registry = ThreadingHTTPServer(('127.0.0.1', 0), _RegistryHandler)
+        cls.cdn = ThreadingHTTPServer(('127.0.0.1', 0), _RegistryHandler)
+        cls.registry.cdn_port = cls.cdn.server_address[1]
+        cls.cdn.cdn_port = cls.cdn.server_address[1]
+        for server in (cls.registry, cls.cdn):
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        cls.registry_url = f"http://127.0.0.1:{cls.registry.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in (cls.registry, cls.cdn):
+            server.shutdown()
+            server.server_close()
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_http_transport_')
+        _RegistryHandler.seen_headers = []
+        _RegistryHandler.seen_methods = []
+        self.blob = b'layer-data' * 1000
+        self.digest = 'sha256:' + hashlib.sha256(self.blob).hexdigest()
+        _RegistryHandler.blobs = {self.digest: self.blob}
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_keep_alive_connections_are_reused(self):
+        transport = HttpTransport(user_agent='test', proxies={})
+        for _ in range(3):
+            response = transport.request('GET', f"{self.registry_url}/v2/")
+            self.assertEqual(response['status_code'], 200)
+        transport.close()
+
+        self.assertEqual(transport.stats['connections_opened'], 1)
+        self.assertEqual(transport.stats['connections_reused'], 2)
+
+    def test_redirect_to_cdn_streams_body_and_drops_authorization(self):
+        client = DockerRegistryClient(self.registry_url, 'test/image', transport=HttpTransport(proxies={}))
+        client.auth_token = 'secret-token'
+        output_path = os.path.join(self.test_dir, 'blob')
+
+        client.download_blob(self.digest, output_path)
+
+        with open(output_path, 'rb') as f:
+            self.assertEqual(f.read(), self.blob)
+        registry_headers = dict(_RegistryHandler.seen_headers)[f'/v2/test/image/blobs/{self.digest}']
+        cdn_headers = dict(_RegistryHandler.seen_headers)[f'/cdn/{self.digest}']
+        self.assertEqual(registry_headers.get('Authorization'), 'Bearer secret-token')
+        self.assertNotIn('Authorization', cdn_headers)
+        self.assertEqual(client.transport.stats['redirects'], 1)
+
+    def test_manifest_request_sends_accept_headers(self):
+        client = DockerRegistryClient(self.registry_url, 'test/image', transport=HttpTransport(proxies={}))
+        client.auth_token = 'token'
+
+        manifest, content_type = client.get_manifest()
+
+        self.assertEqual(manifest['schemaVersion'], 2)
+        self.assertIn('oci.image.manifest', content_type)
+        accept = dict(_RegistryHandler.seen_headers)['/v2/test/image/manifests/latest']['Accept']
+        self.assertIn('application/vnd.oci.image.index.v1+json', accept)
+        self.assertIn('application/vnd.docker.distribution.manifest.list.v2+json', accept)
+
+    def test_head_manifest_returns_digest_without_body(self):
+        client = DockerRegistryClient(self.registry_url, 'test/image', transport=HttpTransport(proxies={}))
+        client.auth_token = 'token'
+
+        digest = client.head_manifest()
+
+        self.assertEqual(digest, 'sha256:' + 'c' * 64)
+        self.assertEqual(_RegistryHandler.seen_methods, [('HEAD', '/v2/test/image/manifests/latest')])
+
+    def test_socks_proxy_is_not_supported_natively(self):
+        self.assertFalse(HttpTransport.is_proxy_supported({'https': 'socks5://127.0.0.1:1080'}))
+        self.assertTrue(HttpTransport.is_proxy_supported({'https': 'http://127.0.0.1:8080'}))
+
+    def test_runner_needs_curl_only_for_curl_backend(self):
+        def run(cmd, **kwargs):
+            if cmd[0] == 'curl':
+                raise FileNotFoundError(cmd[0])
+
+        cache_dir = tempfile.mkdtemp(prefix='test_http_backend_')
+        self.addCleanup(shutil.rmtree, cache_dir, True)
+        runner = ProotRunner(cache_dir=cache_dir)
+        with mock.patch('android_docker.proot_runner.subprocess.run', side_effect=run):
+            with mock.patch.dict(os.environ, {HTTP_BACKEND_ENV: 'native'}):
+                self.assertTrue(runner._check_dependencies())
+            with mock.patch.dict(os.environ, {HTTP_BACKEND_ENV: 'curl'}):
+                self.assertFalse(runner._check_dependencies())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -326,7 +326,8 @@ class TestImageLoadIdempotence(unittest.TestCase):
             
             # Get cache state after first load
             cache_files_1 = set(os.listdir(cache_dir))
-            tar_files_1 = [f for f in cache_files_1 if not f.endswith('.info')]
+            tar_files_1 = [f for f in cache_files_1 if f.endswith('.tar.gz')]
+            blob_files_1 = set(os.listdir(os.path.join(cache_dir, 'blobs', 'sha256')))
             
             # Load image second time
             success2, image_name2, error_msg2 = loader.load_image(tar_path)
@@ -334,12 +335,17 @@ class TestImageLoadIdempotence(unittest.TestCase):
             
             # Get cache state after second load
             cache_files_2 = set(os.listdir(cache_dir))
-            tar_files_2 = [f for f in cache_files_2 if not f.endswith('.info')]
+            tar_files_2 = [f for f in cache_files_2 if f.endswith('.tar.gz')]
+            blob_files_2 = set(os.listdir(os.path.join(cache_dir, 'blobs', 'sha256')))
             
             # Should have same number of tar files (no duplicates)
             self.assertEqual(len(tar_files_1), len(tar_files_2),
                            "Should not create duplicate tar files")
             
+            # Layers are stored once in the shared blob store
+            self.assertEqual(blob_files_1, blob_files_2,
+                           "Should not store duplicate blobs")
+            
             # Image names should match
             self.assertEqual(image_name1, image_name2,
                            "Image names should match on repeated loads")
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+docker push 测试
+用内存中的registry验证：已存在的blob跳过、跨仓库挂载、大blob分块PATCH上传、失败后按上传状态继续，以及 docker load 镜像的推送
+"""
+
+import io
+import os
+import sys
+import json
+import uuid
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker.blob_store import BlobIndex
+from android_docker.http_transport import HttpTransport
+from android_docker.image_push import ImagePusher
+
+OCI_MANIFEST = 'application/vnd.oci.image.manifest.v1+json'
+
+
+def _digest(data):
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+
+class _PushRegistryHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    blobs = {}        # digest -> 内容
+    repositories = {}  # 仓库 -> 含有的digest集合
+    uploads = {}      # 上传会话 -> 已接收内容
+    manifests = {}
+    requests = []
+    # 保存请求内容后仍然返回500的请求（模拟响应丢失）：PATCH的起始偏移，或 'manifest'
+    fail_after_store = set()
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, headers=None, body=b''):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _parse(self):
+        parts = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        with self.lock:
+            self.requests.append((self.command, parts.path))
+        return parts.path[len('/v2/'):], parse_qs(parts.query), body
+
+    def do_GET(self):
+        session = urlsplit(self.path).path.rsplit('/blobs/uploads/', 1)[-1]
+        if '/blobs/uploads/' in self.path and session in self.uploads:
+            self._parse()
+            self._reply(204, {'Location': self.path, 'Range': f'0-{len(self.uploads[session]) - 1}'})
+            return
+        self.do_HEAD()
+
+    def do_HEAD(self):
+        path, _, _ = self._parse()
+        if path in self.manifests:
+            self._reply(200, {'Docker-Content-Digest': _digest(self.manifests[path][1])})
+            return
+        repository, _, digest = path.rpartition('/blobs/')
+        if digest in self.repositories.get(repository, set()):
+            self._reply(200, {'Docker-Content-Digest': digest}, self.blobs[digest])
+        else:
+            self._reply(404)
+
+    def do_POST(self):
+        path, query, _ = self._parse()
+        repository = path[:-len('/blobs/uploads/')]
+        if 'mount' in query:
+            digest, source = query['mount'][0], query['from'][0]
+            if digest in self.repositories.get(source, set()):
+                self.repositories.setdefault(repository, set()).add(digest)
+                self._reply(201, {'Location': f'/v2/{repository}/blobs/{digest}'})
+                return
+        session = uuid.uuid4().hex
+        self.uploads[session] = b''
+        self._reply(202, {'Location': f'/v2/{repository}/blobs/uploads/{session}?_state=abc'})
+
+    def do_PATCH(self):
+        path, _, body = self._parse()
+        session = path.rsplit('/', 1)[-1]
+        start = int(self.headers['Content-Range'].split('-')[0])
+        if start != len(self.uploads[session]):
+            self._reply(416)
+            return
+        self.uploads[session] += body
+        if start in self.fail_after_store:
+            self.fail_after_store.discard(start)
+            self._reply(500)
+            return
+        self._reply(202, {'Location': self.path, 'Range': f'0-{len(self.uploads[session]) - 1}'})
+
+    def do_PUT(self):
+        path, query, body = self._parse()
+        if '/manifests/' in path:
+            self.manifests[path] = (self.headers['Content-Type'], body)
+            if 'manifest' in self.fail_after_store:
+                self.fail_after_store.discard('manifest')
+                self._reply(500)
+                return
+            self._reply(201, {'Docker-Content-Digest': _digest(body)})
+            return
+        repository, _, session = path.rpartition('/blobs/uploads/')
+        data = self.uploads.pop(session) + body
+        digest = query['digest'][0]
+        if _digest(data) != digest:
+            self._reply(400)
+            return
+        self.blobs[digest] = data
+        self.repositories.setdefault(repository, set()).add(digest)
+        self._reply(201, {'Location': f'/v2/{repository}/blobs/{digest}'})
+
+
+class TestImagePush(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='test_image_push_')
+        self.store_dir = os.path.join(self.cache_dir, 'blobs', 'sha256')
+        os.makedirs(self.store_dir)
+        for name in ('blobs', 'repositories', 'uploads', 'manifests'):
+            setattr(_PushRegistryHandler, name, {})
+        _PushRegistryHandler.requests = []
+        _PushRegistryHandler.fail_after_store = set()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _PushRegistryHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.registry = f"127.0.0.1:{self.server.server_address[1]}"
+        patcher = mock.patch.object(ImagePusher, '_registry_url', return_value=f"http://{self.registry}")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.config, self.base, self.app = b'{"architecture": "arm64"}', os.urandom(2000), os.urandom(50000)
+        for data in (self.config, self.base, self.app):
+            with open(os.path.join(self.store_dir, _digest(data)[7:]), 'wb') as f:
+                f.write(data)
+        manifest = json.dumps({
+            'schemaVersion': 2, 'mediaType': OCI_MANIFEST,
+            'config': {'mediaType': 'application/vnd.oci.image.config.v1+json',
+                       'digest': _digest(self.config), 'size': len(self.config)},
+            'layers': [{'mediaType': 'application/vnd.oci.image.layer.v1.tar+gzip',
+                        'digest': _digest(data), 'size': len(data)} for data in (self.base, self.app)],
+        }).encode()
+        self.manifest_digest = _digest(manifest)
+        with open(os.path.join(self.store_dir, self.manifest_digest[7:]), 'wb') as f:
+            f.write(manifest)
+        self.cache_info = {'manifest_digest': 'sha256:' + 'f' * 64, 'platform_digest': self.manifest_digest}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _pusher(self):
+        return ImagePusher(self.cache_dir, transport=HttpTransport(proxies={}))
+
+    def _requests(self, method):
+        return [path for command, path in _PushRegistryHandler.requests if command == method]
+
+    def test_push_skips_existing_and_chunks_large_blobs(self):
+        _PushRegistryHandler.blobs[_digest(self.base)] = self.base
+        _PushRegistryHandler.repositories['team/app'] = {_digest(self.base)}
+
+        with mock.patch.object(ImagePusher, 'CHUNKED_UPLOAD_THRESHOLD', 10000), \
+                mock.patch.object(ImagePusher, 'CHUNK_SIZE', 16000):
+            digest = self._pusher().push(self.cache_info, f"{self.registry}/team/app:v1")
+
+        self.assertEqual(digest, self.manifest_digest)
+        self.assertEqual(_PushRegistryHandler.blobs[_digest(self.app)], self.app)
+        self.assertEqual(_PushRegistryHandler.blobs[_digest(self.config)], self.config)
+        self.assertEqual(len(self._requests('PATCH')), 4)
+        self.assertEqual(len(self._requests('POST')), 2)
+        media_type, body = _PushRegistryHandler.manifests['team/app/manifests/v1']
+        self.assertEqual((media_type, _digest(body)), (OCI_MANIFEST, self.manifest_digest))
+
+    def test_failed_uploads_resume_instead_of_resending(self):
+        _PushRegistryHandler.fail_after_store = {16000, 'manifest'}
+
+        with mock.patch.object(ImagePusher, 'CHUNKED_UPLOAD_THRESHOLD', 10000), \
+                mock.patch.object(ImagePusher, 'CHUNK_SIZE', 16000), \
+                mock.patch('android_docker.image_push.time.sleep'), \
+                self.assertLogs('android_docker.image_push', level='INFO') as logs:
+            digest = self._pusher().push(self.cache_info, f"{self.registry}/team/app:v1")
+
+        self.assertEqual(digest, self.manifest_digest)
+        self.assertEqual(_PushRegistryHandler.blobs[_digest(self.app)], self.app)
+        # 已被保存的块不重发，而是查询上传状态后从下一块继续
+        self.assertEqual(len(self._requests('PATCH')), 4)
+        self.assertTrue(any('registry已接收 32000 字节' in line for line in logs.output))
+        # manifest已被保存，HEAD确认后不再重新PUT
+        self.assertEqual(len([p for p in self._requests('PUT') if '/manifests/' in p]), 1)
+
+    def test_cross_repository_mount(self):
+        for data in (self.config, self.base, self.app):
+            _PushRegistryHandler.blobs[_digest(data)] = data
+        _PushRegistryHandler.repositories['team/base'] = {_digest(data) for data in (self.config, self.base, self.app)}
+        BlobIndex(os.path.join(self.cache_dir, 'blobs', 'index.json')).record(
+            self.registry, 'team/base', [(_digest(data), len(data), None) for data in (self.config, self.base, self.app)])
+
+        self._pusher().push(self.cache_info, f"{self.registry}/team/app:v1")
+
+        self.assertEqual(self._requests('PATCH'), [])
+        self.assertEqual(len([p for p in self._requests('PUT') if '/blobs/' in p]), 0)
+        self.assertEqual(_PushRegistryHandler.repositories['team/app'], _PushRegistryHandler.repositories['team/base'])
+
+    def test_push_loaded_image(self):
+        tar_path = os.path.join(self.cache_dir, 'saved.tar.gz')
+        layer = io.BytesIO()
+        with tarfile.open(fileobj=layer, mode='w') as layer_tar:
+            member = tarfile.TarInfo('etc/hostname')
+            member.size = 5
+            layer_tar.addfile(member, io.BytesIO(b'phone'))
+        entries = [('manifest.json', json.dumps([{'Config': 'config.json', 'RepoTags': ['tweak:1'],
+                                                  'Layers': ['layer.tar']}]).encode()),
+                   ('config.json', self.config), ('layer.tar', layer.getvalue())]
+        with tarfile.open(tar_path, 'w') as tar:
+            for name, data in entries:
+                member = tarfile.TarInfo(name)
+                member.size = len(data)
+                tar.addfile(member, io.BytesIO(data))
+
+        self._pusher().push({'source': 'local', 'cache_path': tar_path}, f"{self.registry}/team/tweak:1")
+
+        _, body = _PushRegistryHandler.manifests['team/tweak/manifests/1']
+        manifest = json.loads(body)
+        self.assertEqual(manifest['layers'][0]['digest'], _digest(layer.getvalue()))
+        self.assertEqual(manifest['layers'][0]['mediaType'], 'application/vnd.oci.image.layer.v1.tar')
+        self.assertEqual(_PushRegistryHandler.blobs[_digest(layer.getvalue())], layer.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
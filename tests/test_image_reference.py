@@ -0,0 +1,115 @@
+import io
+import os
+import json
+import tarfile
+import tempfile
+import shutil
+import unittest
+
+from android_docker.docker_cli import parse_image_reference
+from android_docker.image_loader import LocalImageLoader
+from android_docker.image_reference import ImageReference, image_cache_filename, legacy_cache_filename
+from android_docker.proot_runner import ProotRunner
+
+
+DIGEST = "sha256:" + "a" * 64
+
+
+class TestImageReference(unittest.TestCase):
+    def test_equivalent_docker_hub_references(self):
+        spellings = [
+            "alpine",
+            "alpine:latest",
+            "library/alpine",
+            "docker.io/library/alpine:latest",
+            "index.docker.io/library/alpine",
+            "docker://alpine",
+        ]
+        for spelling in spellings:
+            self.assertEqual(str(ImageReference.parse(spelling)), "docker.io/library/alpine:latest", spelling)
+        self.assertEqual(len({image_cache_filename(spelling) for spelling in spellings}), 1)
+
+    def test_registry_with_port_and_nested_repository(self):
+        reference = ImageReference.parse("LocalHost:5000/team/app/api:v2")
+
+        self.assertEqual(reference.registry, "localhost:5000")
+        self.assertEqual(reference.repository, "team/app/api")
+        self.assertEqual(reference.tag, "v2")
+        self.assertEqual(reference.familiar_name, "localhost:5000/team/app/api")
+
+    def test_digest_reference(self):
+        reference = ImageReference.parse(f"nginx@{DIGEST}")
+
+        self.assertEqual(str(reference), f"docker.io/library/nginx@{DIGEST}")
+        self.assertIsNone(reference.tag)
+        self.assertEqual(reference.reference, DIGEST)
+        self.assertNotEqual(image_cache_filename(f"nginx@{DIGEST}"), image_cache_filename("nginx"))
+        self.assertEqual(parse_image_reference(f"nginx@{DIGEST}"), ("nginx", "<none>"))
+
+    def test_invalid_references(self):
+        for value in ["", "alpine:", "<none>:<none>_abc", "bad name", "alpine@sha256"]:
+            with self.assertRaises(ValueError, msg=value):
+                ImageReference.parse(value)
+
+
+class TestCanonicalCacheEntries(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix="test_image_reference_")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _write_legacy_entry(self, image_url, created_time, content=b"rootfs"):
+        cache_path = os.path.join(self.test_dir, legacy_cache_filename(image_url))
+        with open(cache_path, "wb") as handle:
+            handle.write(content)
+        with open(cache_path + ".info", "w") as handle:
+            json.dump({"image_url": image_url, "cache_path": cache_path, "created_time": created_time}, handle)
+        return cache_path
+
+    def test_runner_lookup_is_spelling_independent(self):
+        runner = ProotRunner(cache_dir=self.test_dir)
+        cache_path = runner._get_image_cache_path("alpine")
+        with open(cache_path, "wb") as handle:
+            handle.write(b"rootfs")
+        runner._save_cache_info("alpine", cache_path)
+
+        self.assertTrue(runner._is_image_cached("docker.io/library/alpine:latest"))
+        self.assertEqual(runner._load_cache_info("library/alpine")["reference"], "docker.io/library/alpine:latest")
+
+    def test_legacy_entries_are_migrated_and_deduplicated(self):
+        old = self._write_legacy_entry("alpine", 100, b"old")
+        newer = self._write_legacy_entry("library/alpine", 200, b"new")
+
+        runner = ProotRunner(cache_dir=self.test_dir)
+
+        cache_path = runner._get_image_cache_path("alpine:latest")
+        with open(cache_path, "rb") as handle:
+            self.assertEqual(handle.read(), b"new")
+        info = runner._load_cache_info("alpine")
+        self.assertEqual(info["cache_path"], cache_path)
+        self.assertEqual(info["reference"], "docker.io/library/alpine:latest")
+        for path in (old, newer):
+            self.assertFalse(os.path.exists(path))
+            self.assertFalse(os.path.exists(path + ".info"))
+
+    def test_loaded_image_is_found_by_runner(self):
+        tar_path = os.path.join(self.test_dir, "image.tar")
+        manifest = [{"Config": "config.json", "RepoTags": ["myapp:1.0"], "Layers": ["layer.tar"]}]
+        with tarfile.open(tar_path, "w") as tar:
+            for name, data in [("manifest.json", json.dumps(manifest).encode()), ("config.json", b"{}"),
+                               ("layer.tar", b"")]:
+                member = tarfile.TarInfo(name)
+                member.size = len(data)
+                tar.addfile(member, io.BytesIO(data))
+
+        success, image_name, error = LocalImageLoader(self.test_dir).load_image(tar_path)
+
+        self.assertTrue(success, error)
+        runner = ProotRunner(cache_dir=self.test_dir)
+        self.assertTrue(runner._is_image_cached("docker.io/library/myapp:1.0"))
+        self.assertEqual(runner._load_cache_info("myapp:1.0")["image_url"], "myapp:1.0")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+增量重新拉取测试
+验证只下载变化的层，并在缓存的根文件系统上回退旧层、应用新层
+"""
+
+import io
+import os
+import sys
+import shutil
+import tarfile
+import hashlib
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker.create_rootfs_tar import DockerImageToRootFS
+from android_docker.incremental_rootfs import LayerListingCache, common_prefix_length
+
+BASE_FILES = {'bin/sh': b'#!', 'lib/libc.so': b'elf', 'usr/bin/env': b'#!', 'etc/motd': b'base'}
+OLD_FILES = {'etc/motd': b'old', 'opt/old/data': b'stale'}
+NEW_FILES = {'etc/issue': b'new'}
+
+
+def _gzip_tar(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def _layer(files):
+    data = _gzip_tar(files)
+    return 'sha256:' + hashlib.sha256(data).hexdigest(), data
+
+
+class _FakeClient:
+    registry_url = 'https://registry.example.com'
+    image_name = 'library/alpine'
+
+    def __init__(self, blobs):
+        self.blobs = blobs
+        self.downloaded = []
+
+    def download_blob(self, digest, output_path, cancel_event=None, size=None, progress=None):
+        self.downloaded.append(digest)
+        with open(output_path, 'wb') as f:
+            f.write(self.blobs[digest])
+        return output_path
+
+
+class TestIncrementalPull(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_incremental_pull_')
+        self.cache_dir = os.path.join(self.test_dir, 'cache')
+        self.store_dir = os.path.join(self.cache_dir, 'blobs', 'sha256')
+        self.oci_blobs = os.path.join(self.test_dir, 'oci', 'blobs', 'sha256')
+        os.makedirs(self.store_dir)
+        os.makedirs(self.oci_blobs)
+        self.base, self.old, self.new = _layer(BASE_FILES), _layer(OLD_FILES), _layer(NEW_FILES)
+        self.config = _layer({})
+        self.base_rootfs = os.path.join(self.test_dir, 'cached.tar.gz')
+        with open(self.base_rootfs, 'wb') as f:
+            f.write(_gzip_tar(dict(BASE_FILES, **OLD_FILES)))
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _store(self, *layers):
+        for digest, data in layers:
+            with open(os.path.join(self.store_dir, digest[7:]), 'wb') as f:
+                f.write(data)
+
+    def _pull(self, base_layers, new_layers):
+        processor = DockerImageToRootFS('alpine:latest', architecture='amd64', cache_dir=self.cache_dir,
+                                        base_rootfs=self.base_rootfs, base_layers=base_layers)
+        processor.temp_dir = self.test_dir
+        manifest = {
+            'schemaVersion': 2,
+            'config': {'digest': self.config[0], 'size': len(self.config[1])},
+            'layers': [{'digest': d, 'size': len(data)} for d, data in new_layers],
+        }
+        client = _FakeClient(dict(new_layers + [self.config]))
+        with mock.patch.object(processor, '_is_android_environment', return_value=False):
+            processor._download_layers(client, manifest, self.oci_blobs)
+            rootfs = processor._patch_base_rootfs(os.path.dirname(os.path.dirname(self.oci_blobs))) \
+                if processor.incremental_plan else None
+        return processor, client, rootfs
+
+    def _read(self, rootfs, name):
+        with open(os.path.join(rootfs, name), 'rb') as f:
+            return f.read()
+
+    def test_changed_top_layer_is_reverted_and_replaced(self):
+        self._store(self.base, self.old)
+
+        _, client, rootfs = self._pull([self.base[0], self.old[0]], [self.base, self.new])
+
+        self.assertEqual(sorted(client.downloaded), sorted([self.new[0], self.config[0]]))
+        self.assertEqual(self._read(rootfs, 'etc/motd'), b'base')
+        self.assertEqual(self._read(rootfs, 'etc/issue'), b'new')
+        self.assertFalse(os.path.exists(os.path.join(rootfs, 'opt', 'old')))
+
+    def test_appended_layer_skips_missing_prefix_blobs(self):
+        # 旧版本只有前缀层，且该层已不在存储中：不需要下载
+        _, client, rootfs = self._pull([self.base[0]], [self.base, self.new])
+
+        self.assertEqual(sorted(client.downloaded), sorted([self.new[0], self.config[0]]))
+        self.assertEqual(self._read(rootfs, 'etc/issue'), b'new')
+        self.assertEqual(self._read(rootfs, 'opt/old/data'), b'stale')
+
+    def test_no_common_prefix_falls_back_to_full_extract(self):
+        processor, client, _ = self._pull([self.old[0]], [self.base, self.new])
+
+        self.assertIsNone(processor.incremental_plan)
+        self.assertIn(self.base[0], client.downloaded)
+
+    def test_missing_old_layer_falls_back_to_full_extract(self):
+        self._store(self.base)
+
+        processor, _, _ = self._pull([self.base[0], self.old[0]], [self.base, self.new])
+
+        self.assertIsNone(processor.incremental_plan)
+
+    def test_layer_listing_is_cached(self):
+        self._store(self.old)
+        listings = LayerListingCache(self.cache_dir)
+        listing = listings.get(self.old[0], os.path.join(self.store_dir, self.old[0][7:]))
+
+        self.assertEqual(listing['files'], ['etc/motd', 'opt/old/data'])
+        os.remove(os.path.join(self.store_dir, self.old[0][7:]))
+        self.assertEqual(listings.get(self.old[0], None), listing)
+
+    def test_common_prefix_length(self):
+        self.assertEqual(common_prefix_length(['a', 'b', 'c'], ['a', 'b', 'd']), 2)
+        self.assertEqual(common_prefix_length(['a'], ['b']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+层提取结果缓存测试
+共用前几层的镜像只解压新增的层；由缓存叠加出的根文件系统与逐层解压的结果相同
+"""
+
+import io
+import os
+import sys
+import json
+import gzip
+import hashlib
+import tarfile
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker.blob_refs import BlobRefs
+from android_docker.create_rootfs_tar import DockerImageToRootFS
+from android_docker.layer_cache import LayerCache
+from android_docker.rootfs_snapshot import remove_tree
+
+
+def _digest(data):
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+
+def _layer(entries):
+    """entries: (名称, 内容) 普通文件，(名称, '->目标') 符号链接，(名称, '=>目标') 硬链接"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for name, data in entries:
+            member = tarfile.TarInfo(name)
+            if isinstance(data, str) and data.startswith('->'):
+                member.type, member.linkname = tarfile.SYMTYPE, data[2:]
+                tar.addfile(member)
+            elif isinstance(data, str) and data.startswith('=>'):
+                member.type, member.linkname = tarfile.LNKTYPE, data[2:]
+                tar.addfile(member)
+            else:
+                member.size, member.mode = len(data), 0o755
+                tar.addfile(member, io.BytesIO(data))
+    return gzip.compress(buffer.getvalue())
+
+
+BASE = _layer([('bin/busybox', b'busybox'), ('bin/sh', '->busybox'), ('lib/libc.so', b'libc'),
+               ('usr/bin/env', b'env'), ('etc/motd', b'base\n'), ('opt/app', b'old')])
+APP = _layer([('etc/motd', b'app\n'), ('opt/app', '->/srv'), ('usr/bin/env2', '=>usr/bin/env')])
+TOOLS = _layer([('usr/bin/tool', b'tool')])
+
+
+def _snapshot(root):
+    """目录树的可比较描述：路径 -> 内容或链接目标"""
+    result = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            key = os.path.relpath(path, root)
+            if os.path.islink(path):
+                result[key] = '->' + os.readlink(path)
+            elif os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    result[key] = f.read()
+            else:
+                result[key] = 'dir'
+    return result
+
+
+class TestLayerCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='test_layer_cache_')
+
+    def tearDown(self):
+        remove_tree(self.cache_dir)
+
+    def _build(self, layers, layer_cache=True):
+        """按给定的层构建根文件系统，返回 (根文件系统目录, 实际解压的层digest)"""
+        processor = DockerImageToRootFS('alpine', architecture='amd64', cache_dir=self.cache_dir,
+                                        layer_cache=layer_cache)
+        processor.temp_dir = tempfile.mkdtemp(dir=self.cache_dir)
+        oci_dir = os.path.join(processor.temp_dir, 'oci')
+        blobs_dir = os.path.join(oci_dir, 'blobs', 'sha256')
+        os.makedirs(blobs_dir)
+        manifest = json.dumps({'layers': [{'digest': _digest(layer), 'size': len(layer),
+                                           'mediaType': 'application/vnd.oci.image.layer.v1.tar+gzip'}
+                                          for layer in layers]}).encode()
+        for data in layers + [manifest]:
+            with open(os.path.join(blobs_dir, _digest(data)[7:]), 'wb') as f:
+                f.write(data)
+        with open(os.path.join(oci_dir, 'index.json'), 'w') as f:
+            json.dump({'manifests': [{'digest': _digest(manifest)}]}, f)
+
+        extracted = []
+        original = DockerImageToRootFS._extract_layer
+
+        def extract(self_, layer_path, *args, **kwargs):
+            extracted.append('sha256:' + os.path.basename(layer_path))
+            return original(self_, layer_path, *args, **kwargs)
+
+        with mock.patch.object(DockerImageToRootFS, '_extract_layer', extract):
+            rootfs_dir = processor._extract_rootfs_with_python(oci_dir)
+        return rootfs_dir, extracted
+
+    def test_shared_prefix_layers_are_not_unpacked_again(self):
+        self._build([BASE, APP])
+        _, extracted = self._build([BASE, APP, TOOLS])
+
+        self.assertEqual(extracted, [_digest(TOOLS)])
+        self.assertTrue(os.path.isdir(LayerCache(self.cache_dir).path(_digest(BASE))))
+
+    def test_composed_rootfs_matches_sequential_extraction(self):
+        self._build([BASE])
+        composed, _ = self._build([BASE, APP])
+        sequential, _ = self._build([BASE, APP], layer_cache=False)
+
+        self.assertEqual(_snapshot(composed), _snapshot(sequential))
+        self.assertEqual(_snapshot(composed)['usr/bin/env2'], b'env')
+        self.assertEqual(_snapshot(composed)['opt/app'], '->/srv')
+        self.assertEqual(_snapshot(composed)['etc/motd'], b'app\n')
+
+    def test_collected_layer_blob_drops_extracted_layer(self):
+        self._build([BASE, TOOLS])
+        cache_path = os.path.join(self.cache_dir, 'alpine_0.tar.gz')
+        BlobRefs(self.cache_dir).record(cache_path, {'layers': [_digest(BASE), _digest(TOOLS)]})
+
+        BlobRefs(self.cache_dir).release(cache_path)
+
+        self.assertEqual(LayerCache(self.cache_dir).lookup(_digest(TOOLS)), (None, None))
+        self.assertFalse(os.path.exists(LayerCache(self.cache_dir).path(_digest(BASE)) + '.json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
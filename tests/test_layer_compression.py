@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+镜像层压缩格式测试
+覆盖gzip/zstd识别，以及zstd层在Python和tar命令两条路径上的提取
+"""
+
+import io
+import os
+import sys
+import shutil
+import tarfile
+import tempfile
+import subprocess
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker import layer_compression
+from android_docker.create_rootfs_tar import DockerImageToRootFS
+from android_docker.layer_compression import ZstdNotAvailable, detect_layer_compression, open_zstd_stream
+
+ZSTD_MEDIA_TYPE = 'application/vnd.oci.image.layer.v1.tar+zstd'
+
+
+def _tar_bytes(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+class TestDetectLayerCompression(unittest.TestCase):
+    def test_magic_bytes(self):
+        self.assertEqual(detect_layer_compression(b'\x1f\x8b\x08\x00'), 'gzip')
+        self.assertEqual(detect_layer_compression(b'\x28\xb5\x2f\xfd'), 'zstd')
+        self.assertIsNone(detect_layer_compression(b'etc/'))
+
+    def test_magic_wins_over_media_type(self):
+        self.assertEqual(detect_layer_compression(b'\x1f\x8b\x08\x00', ZSTD_MEDIA_TYPE), 'gzip')
+
+    def test_media_type_used_when_data_too_short(self):
+        self.assertEqual(detect_layer_compression(b'', ZSTD_MEDIA_TYPE), 'zstd')
+
+    def test_missing_decoder_is_reported(self):
+        with mock.patch.dict(sys.modules, {'compression': None, 'zstandard': None}), \
+                mock.patch.object(layer_compression.shutil, 'which', return_value=None):
+            with self.assertRaises(ZstdNotAvailable):
+                open_zstd_stream(io.BytesIO(b''))
+
+
+@unittest.skipUnless(shutil.which('zstd'), "需要zstd命令生成测试数据")
+class TestZstdLayerExtraction(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_layer_compression_')
+        self.rootfs = os.path.join(self.test_dir, 'rootfs')
+        os.makedirs(self.rootfs)
+        self.layer_path = os.path.join(self.test_dir, 'layer')
+        data = _tar_bytes({'etc/os-release': b'ID=test\n', 'usr/bin/app': b'\0' * 100000})
+        with open(self.layer_path, 'wb') as f:
+            f.write(subprocess.run(['zstd', '-c', '-q'], input=data, stdout=subprocess.PIPE, check=True).stdout)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _extract(self, android):
+        processor = DockerImageToRootFS('alpine:latest', architecture='amd64')
+        with mock.patch.object(processor, '_is_android_environment', return_value=android):
+            processor._extract_layer(self.layer_path, self.rootfs, True, ZSTD_MEDIA_TYPE)
+        with open(os.path.join(self.rootfs, 'etc', 'os-release'), 'rb') as f:
+            self.assertEqual(f.read(), b'ID=test\n')
+        self.assertEqual(os.path.getsize(os.path.join(self.rootfs, 'usr', 'bin', 'app')), 100000)
+
+    def test_python_path(self):
+        self._extract(android=True)
+
+    def test_tar_command_path(self):
+        self._extract(android=False)
+
+    def test_corrupt_stream_is_an_error(self):
+        with open(self.layer_path, 'r+b') as f:
+            f.seek(20)
+            f.write(b'\xff' * 64)
+
+        with open(self.layer_path, 'rb') as raw, self.assertRaises(Exception):
+            with open_zstd_stream(raw) as decoded:
+                decoded.read()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -52,11 +52,12 @@ class TestOCIAcceptHeaders(unittest.TestCase):
         For any manifest request (whether by tag or digest), the HTTP Accept header 
         SHALL include all required OCI and Docker media types.
         """
-        # Create a mock client
+        # Create a mock client (curl backend, so the request is a curl command)
         client = DockerRegistryClient(
             registry_url="https://ghcr.io",
             image_name="test/image",
-            tag="latest"
+            tag="latest",
+            backend="curl"
         )
         
         # Mock the _run_curl_command to capture the command
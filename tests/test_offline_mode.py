@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+离线模式测试
+只用本地保存的manifest、index和tag记录解析镜像（tag、digest、平台），不发出网络请求；缺少数据时立即失败
+"""
+
+import io
+import os
+import sys
+import json
+import gzip
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import subprocess
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker.blob_store import TagIndex
+from android_docker.create_rootfs_tar import DockerImageToRootFS, DockerRegistryClient
+from android_docker.manifest_cache import OfflineImageUnavailable
+from android_docker.proot_runner import ProotRunner
+
+OCI_MANIFEST = 'application/vnd.oci.image.manifest.v1+json'
+OCI_INDEX = 'application/vnd.oci.image.index.v1+json'
+
+
+def _digest(data):
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+
+def _layer():
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        data = b'offline\n'
+        member = tarfile.TarInfo('etc/motd')
+        member.size = len(data)
+        tar.addfile(member, io.BytesIO(data))
+    return gzip.compress(buffer.getvalue())
+
+
+class _PulledClient:
+    registry_url = 'https://registry-1.docker.io'
+    image_name = 'library/alpine'
+
+
+def _no_network(*args, **kwargs):
+    raise AssertionError("离线模式不应发出网络请求")
+
+
+class TestOfflineMode(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='test_offline_mode_')
+        self.store_dir = os.path.join(self.cache_dir, 'blobs', 'sha256')
+        os.makedirs(self.store_dir)
+        self.layer, self.config = _layer(), b'{"architecture": "amd64", "os": "linux"}'
+        for data in (self.layer, self.config):
+            with open(os.path.join(self.store_dir, _digest(data)[7:]), 'wb') as f:
+                f.write(data)
+
+        manifest = json.dumps({
+            'schemaVersion': 2, 'mediaType': OCI_MANIFEST,
+            'config': {'digest': _digest(self.config), 'size': len(self.config)},
+            'layers': [{'mediaType': 'application/vnd.oci.image.layer.v1.tar+gzip',
+                        'digest': _digest(self.layer), 'size': len(self.layer)}],
+        })
+        self.platform_digest = _digest(manifest.encode())
+        index = json.dumps({
+            'schemaVersion': 2, 'mediaType': OCI_INDEX,
+            'manifests': [
+                {'digest': 'sha256:' + 'b' * 64, 'size': 1, 'platform': {'architecture': 's390x', 'os': 'linux'}},
+                {'digest': self.platform_digest, 'size': len(manifest), 'mediaType': OCI_MANIFEST,
+                 'platform': {'architecture': 'amd64', 'os': 'linux'}},
+            ],
+        })
+        self.index_digest = _digest(index.encode())
+
+        # 与联网拉取时相同：index和子manifest按digest保存，tag指向index
+        processor = DockerImageToRootFS('alpine:latest', architecture='amd64', cache_dir=self.cache_dir)
+        processor._store_manifest(_PulledClient(), index, self.index_digest, OCI_INDEX, tag='latest')
+        processor._store_manifest(_PulledClient(), manifest, self.platform_digest, OCI_MANIFEST)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _offline_download(self, image_url):
+        processor = DockerImageToRootFS(image_url, architecture='amd64', cache_dir=self.cache_dir, offline=True)
+        processor._create_temp_directory()
+        self.addCleanup(shutil.rmtree, processor.temp_dir, True)
+        with mock.patch.object(DockerRegistryClient, '_make_registry_request', side_effect=_no_network):
+            oci_dir = processor._download_image_with_python()
+        return processor, oci_dir
+
+    def test_tag_and_platform_resolve_from_cache(self):
+        processor, oci_dir = self._offline_download('docker.io/library/alpine:latest')
+
+        self.assertEqual(processor.pull_info['manifest_digest'], self.index_digest)
+        self.assertEqual(processor.pull_info['platform_digest'], self.platform_digest)
+        self.assertTrue(os.path.exists(os.path.join(oci_dir, 'blobs', 'sha256', _digest(self.layer)[7:])))
+
+    def test_digest_reference_resolves_from_cache(self):
+        processor, _ = self._offline_download(f'alpine@{self.index_digest}')
+
+        self.assertEqual(processor.pull_info['layers'], [_digest(self.layer)])
+
+    def test_missing_tag_fails_fast(self):
+        with self.assertRaises(OfflineImageUnavailable):
+            self._offline_download('alpine:3.20')
+
+    def test_missing_blob_fails_fast(self):
+        os.remove(os.path.join(self.store_dir, _digest(self.layer)[7:]))
+
+        with self.assertRaises(OfflineImageUnavailable) as context:
+            self._offline_download('alpine')
+        self.assertIn(_digest(self.layer)[:19], str(context.exception))
+
+    def test_runner_resolves_other_references_to_cached_image(self):
+        runner = ProotRunner(cache_dir=self.cache_dir)
+        cache_path = runner._get_image_cache_path('alpine')
+        with open(cache_path, 'wb') as f:
+            f.write(b'rootfs')
+        with open(cache_path + '.pull.json', 'w') as f:
+            json.dump({'manifest_digest': self.index_digest, 'platform_digest': self.platform_digest}, f)
+        runner._save_cache_info('alpine', cache_path)
+        TagIndex(os.path.join(self.cache_dir, 'blobs', 'tags.json')).record(
+            'docker.io', 'library/alpine', 'stable', self.index_digest, OCI_INDEX)
+
+        with mock.patch('subprocess.run', side_effect=_no_network):
+            for reference in (f'alpine@{self.index_digest}', f'alpine@{self.platform_digest}', 'alpine:stable'):
+                path = runner._download_image(reference, pull_policy='always', offline=True)
+                self.assertEqual(path, runner._get_image_cache_path(reference))
+                with open(path, 'rb') as f:
+                    self.assertEqual(f.read(), b'rootfs')
+                self.assertEqual(runner._load_cache_info(reference)['image_url'], reference)
+
+    def test_runner_builds_offline_when_rootfs_is_not_cached(self):
+        runner = ProotRunner(cache_dir=self.cache_dir)
+
+        with mock.patch('subprocess.run', side_effect=subprocess.CalledProcessError(1, 'create_rootfs_tar')) as run:
+            self.assertIsNone(runner._download_image('alpine:3.20', offline=True))
+        self.assertIn('--offline', run.call_args[0][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
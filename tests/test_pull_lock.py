@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+同一镜像并发拉取的跨进程锁测试
+等待者复用持有者的拉取结果；持有者进程已退出时锁按PID判定为陈旧并被清除；
+不同镜像的拉取互不等待，共用的blob由其digest锁串行化
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import subprocess
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker.blob_store import BlobLock, BlobStore
+from android_docker.proot_runner import ProotRunner
+from android_docker.pull_lock import PullLock, PullLockTimeout
+
+
+def _write_lock(lock, pid):
+    os.makedirs(os.path.dirname(lock.path), exist_ok=True)
+    with open(lock.path, 'w') as f:
+        json.dump({'pid': pid, 'created': time.time()}, f)
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+class TestPullLock(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='test_pull_lock_')
+        self.runner = ProotRunner(cache_dir=self.cache_dir)
+        self.cache_path = self.runner._get_image_cache_path('alpine')
+        self.lock = PullLock(self.cache_dir, self.cache_path)
+        patcher = mock.patch.object(PullLock, 'POLL_INTERVAL', 0.05)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _live_holder(self):
+        holder = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+        self.addCleanup(holder.wait)
+        self.addCleanup(holder.kill)
+        _write_lock(self.lock, holder.pid)
+        return holder
+
+    def test_waiter_reuses_result_of_running_pull(self):
+        holder = self._live_holder()
+
+        def finish_pull():
+            time.sleep(0.3)
+            with open(self.cache_path, 'wb') as f:
+                f.write(b'rootfs')
+            self.runner._save_cache_info('alpine', self.cache_path)
+            os.remove(self.lock.path)
+            holder.kill()
+
+        threading.Thread(target=finish_pull).start()
+        with mock.patch('subprocess.run') as run:
+            result = self.runner._download_image('docker.io/library/alpine:latest')
+
+        self.assertEqual(result, self.cache_path)
+        run.assert_not_called()
+
+    def test_stale_lock_of_exited_process_is_broken(self):
+        _write_lock(self.lock, _dead_pid())
+
+        with mock.patch('subprocess.run') as run:
+            result = self.runner._download_image('alpine')
+
+        self.assertEqual(result, self.cache_path)
+        run.assert_called_once()
+        self.assertFalse(os.path.exists(self.lock.path))
+
+    def test_lock_is_released_after_failed_pull(self):
+        with mock.patch('subprocess.run', side_effect=subprocess.CalledProcessError(1, 'create_rootfs_tar')):
+            self.assertIsNone(self.runner._download_image('alpine'))
+
+        self.assertFalse(os.path.exists(self.lock.path))
+
+    def test_shared_blob_is_locked_across_images(self):
+        # 另一个进程正在为其他镜像下载同一个基础层
+        blob_path = BlobStore(self.cache_dir).path('sha256:' + 'a' * 64)
+        holder = subprocess.Popen(
+            [sys.executable, '-c', 'import sys, time; from android_docker.blob_store import BlobLock; '
+             'BlobLock(sys.argv[1]).acquire(); print("locked", flush=True); time.sleep(30)', blob_path],
+            stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.addCleanup(holder.wait)
+        self.addCleanup(holder.kill)
+        self.assertEqual(holder.stdout.readline().strip(), b'locked')
+        self.addCleanup(holder.stdout.close)
+
+        # 镜像锁互不影响，blob锁要等持有者退出
+        with PullLock(self.cache_dir, self.runner._get_image_cache_path('nginx'), timeout=0.2) as other:
+            self.assertFalse(other.waited)
+            self.assertFalse(BlobLock(blob_path).acquire(blocking=False))
+        holder.kill()
+        holder.wait()
+        lock = BlobLock(blob_path)
+        self.assertTrue(lock.acquire(blocking=False))
+        lock.release()
+
+    def test_wait_timeout(self):
+        self._live_holder()
+
+        with self.assertRaises(PullLockTimeout):
+            PullLock(self.cache_dir, self.cache_path, timeout=0.2).acquire()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+流水线拉取测试
+验证层在下载过程中即被按顺序解压提取
+"""
+
+import io
+import os
+import sys
+import time
+import shutil
+import tarfile
+import hashlib
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker.blob_store import BlobStream, DownloadTracker, RangedBlob
+from android_docker.create_rootfs_tar import DockerImageToRootFS
+
+
+def _layer(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    data = buffer.getvalue()
+    return 'sha256:' + hashlib.sha256(data).hexdigest(), data
+
+
+class _SlowClient:
+    """分块写入 .partial 后重命名，模拟下载中的blob"""
+    registry_url = 'https://registry.example.com'
+    image_name = 'library/alpine'
+
+    def __init__(self, blobs, wait_for=None, fail_digest=None):
+        self.blobs = blobs
+        self.wait_for = wait_for or {}
+        self.fail_digest = fail_digest
+
+    def download_blob(self, digest, output_path, cancel_event=None, size=None, progress=None):
+        path, deadline = self.wait_for.get(digest), time.time() + 5
+        while path and not os.path.exists(path) and time.time() < deadline:
+            time.sleep(0.01)
+        data = self.blobs[digest]
+        with open(output_path + '.partial', 'wb') as f:
+            for start in range(0, len(data), 64):
+                f.write(data[start:start + 64])
+                f.flush()
+                if digest == self.fail_digest and start > 0:
+                    raise RuntimeError("connection reset")
+        os.replace(output_path + '.partial', output_path)
+        return output_path
+
+
+class TestBlobStream(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_pull_pipeline_')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_stream_follows_growing_file_until_commit(self):
+        path = os.path.join(self.test_dir, 'blob')
+        data = os.urandom(100000)
+        tracker = DownloadTracker(['d'], threading.Event())
+
+        def writer():
+            with open(path + '.partial', 'wb') as f:
+                for start in range(0, len(data), 7000):
+                    f.write(data[start:start + 7000])
+                    f.flush()
+                    time.sleep(0.005)
+            os.replace(path + '.partial', path)
+            tracker.finish('d')
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        with BlobStream(path, 'd', tracker) as stream:
+            self.assertEqual(stream.read(), data)
+        thread.join()
+
+    def test_stream_reads_contiguous_prefix_of_ranged_download(self):
+        path = os.path.join(self.test_dir, 'blob')
+        data = os.urandom(100000)
+        digest = 'sha256:' + hashlib.sha256(data).hexdigest()
+        tracker = DownloadTracker([digest], threading.Event())
+        ranged = RangedBlob(path, digest, len(data), 2)
+        ranged.prepare()
+
+        def writer():
+            # 后一段先完成：在前一段写完之前，读取方不能越过已连续写入的位置
+            ranged.write(1, data[50000:])
+            for start in range(0, 50000, 7000):
+                ranged.write(0, data[start:min(start + 7000, 50000)])
+                time.sleep(0.005)
+            ranged.commit()
+            tracker.finish(digest)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        with BlobStream(path, digest, tracker) as stream:
+            self.assertEqual(stream.read(), data)
+        thread.join()
+        self.assertIsNone(RangedBlob.available(path + '.ranges'))
+
+    def test_download_error_is_raised_to_reader(self):
+        tracker = DownloadTracker(['d'], threading.Event())
+        tracker.finish('d', RuntimeError('HTTP 500'))
+
+        with self.assertRaises(RuntimeError):
+            BlobStream(os.path.join(self.test_dir, 'blob'), 'd', tracker).read()
+
+
+class TestPipelinedPull(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_pull_pipeline_')
+        self.blobs_dir = os.path.join(self.test_dir, 'oci', 'blobs', 'sha256')
+        os.makedirs(self.blobs_dir)
+        self.first = _layer({'etc/hostname': b'base', 'bin/sh': b'#!'})
+        self.second = _layer({'etc/hostname': b'override', 'app': b'x' * 5000})
+        self.config = _layer({})
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _pull(self, client, android=False):
+        processor = DockerImageToRootFS('alpine:latest', architecture='amd64', pipeline=True,
+                                        max_concurrent_downloads=3)
+        processor.temp_dir = self.test_dir
+        manifest = {
+            'schemaVersion': 2,
+            'config': {'digest': self.config[0], 'size': len(self.config[1])},
+            'layers': [{'digest': d, 'size': len(data)} for d, data in (self.first, self.second)],
+        }
+        with mock.patch.object(processor, '_is_android_environment', return_value=android):
+            processor._download_layers(client, manifest, self.blobs_dir)
+        return processor
+
+    def _client(self, **kwargs):
+        return _SlowClient(dict([self.first, self.second, self.config]), **kwargs)
+
+    def _check_rootfs(self, processor):
+        rootfs = processor.pipelined_rootfs_dir
+        with open(os.path.join(rootfs, 'etc', 'hostname'), 'rb') as f:
+            self.assertEqual(f.read(), b'override')
+        self.assertTrue(os.path.exists(os.path.join(rootfs, 'bin', 'sh')))
+        self.assertTrue(os.path.exists(os.path.join(self.blobs_dir, self.second[0][7:])))
+
+    def test_first_layer_is_extracted_while_later_layers_download(self):
+        # 第二层的下载要等到第一层已提取出文件才开始写入
+        marker = os.path.join(self.test_dir, 'rootfs', 'bin', 'sh')
+        processor = self._pull(self._client(wait_for={self.second[0]: marker}))
+
+        self._check_rootfs(processor)
+        self.assertIn(self.second[0], processor.verified_digests)
+
+    def test_python_extraction_on_android(self):
+        self._check_rootfs(self._pull(self._client(), android=True))
+
+    def test_download_failure_aborts_pipeline(self):
+        with self.assertRaises(RuntimeError):
+            self._pull(self._client(fail_digest=self.first[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
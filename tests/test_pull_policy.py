@@ -0,0 +1,101 @@
+import os
+import json
+import tempfile
+import shutil
+import unittest
+from unittest import mock
+
+from android_docker.proot_runner import ProotRunner
+from android_docker.create_rootfs_tar import PULL_INFO_SUFFIX
+
+
+IMAGE = "alpine:latest"
+DIGEST = "sha256:" + "a" * 64
+
+
+class TestPullPolicy(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix="test_pull_policy_")
+        self.runner = ProotRunner(cache_dir=self.test_dir)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def _seed_cache(self, manifest_digest=DIGEST, layers=None):
+        cache_path = self.runner._get_image_cache_path(IMAGE)
+        with open(cache_path, "wb") as handle:
+            handle.write(b"rootfs")
+        if manifest_digest:
+            with open(cache_path + PULL_INFO_SUFFIX, "w") as handle:
+                json.dump({"manifest_digest": manifest_digest, "layers": layers or []}, handle)
+        self.runner._save_cache_info(IMAGE, cache_path)
+        return cache_path
+
+    def _download(self, policy, remote_digest=DIGEST):
+        with mock.patch("subprocess.run") as run_mock, mock.patch(
+            "android_docker.proot_runner.DockerImageToRootFS.get_remote_manifest_digest",
+            return_value=remote_digest,
+        ) as head_mock:
+            result = self.runner._download_image(IMAGE, pull_policy=policy)
+        return result, run_mock, head_mock
+
+    def test_pull_info_is_merged_into_cache_info(self):
+        cache_path = self._seed_cache()
+
+        self.assertEqual(self.runner._load_cache_info(IMAGE)["manifest_digest"], DIGEST)
+        self.assertFalse(os.path.exists(cache_path + PULL_INFO_SUFFIX))
+
+    def test_always_skips_pull_when_digest_unchanged(self):
+        cache_path = self._seed_cache()
+
+        result, run_mock, head_mock = self._download("always")
+
+        self.assertEqual(result, cache_path)
+        head_mock.assert_called_once()
+        run_mock.assert_not_called()
+
+    def test_always_pulls_when_digest_changed(self):
+        self._seed_cache()
+
+        _, run_mock, _ = self._download("always", remote_digest="sha256:" + "b" * 64)
+
+        run_mock.assert_called_once()
+
+    def test_changed_image_is_pulled_incrementally(self):
+        layers = ["sha256:" + "c" * 64, "sha256:" + "d" * 64]
+        cache_path = self._seed_cache(layers=layers)
+
+        _, run_mock, _ = self._download("always", remote_digest="sha256:" + "b" * 64)
+
+        cmd = run_mock.call_args[0][0]
+        self.assertEqual(cmd[cmd.index("--base-rootfs") + 1], cache_path)
+        self.assertEqual(cmd[cmd.index("--base-layers") + 1], ",".join(layers))
+
+    def test_always_pulls_when_no_digest_recorded(self):
+        self._seed_cache(manifest_digest=None)
+
+        _, run_mock, head_mock = self._download("always")
+
+        head_mock.assert_not_called()
+        run_mock.assert_called_once()
+
+    def test_missing_uses_cache_without_network(self):
+        cache_path = self._seed_cache()
+
+        result, run_mock, head_mock = self._download("missing")
+
+        self.assertEqual(result, cache_path)
+        head_mock.assert_not_called()
+        run_mock.assert_not_called()
+
+    def test_never_fails_without_cache(self):
+        result, run_mock, head_mock = self._download("never")
+
+        self.assertIsNone(result)
+        head_mock.assert_not_called()
+        run_mock.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+拉取进度测试
+验证每个blob的接收字节数、阶段耗时、缓存命中统计，以及JSON和终端两种输出
+"""
+
+import io
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker.create_rootfs_tar import DockerImageToRootFS, DockerRegistryClient
+from android_docker.http_transport import HttpTransport
+from android_docker.pull_progress import PullProgress
+
+
+def _digest(data):
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+
+class _BlobHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    data = b''
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.data)))
+        self.end_headers()
+        self.wfile.write(self.data)
+
+
+class _FakeClient:
+    registry_url = 'https://registry.example.com'
+    image_name = 'library/alpine'
+
+    def __init__(self, blobs):
+        self.blobs = blobs
+
+    def download_blob(self, digest, output_path, cancel_event=None, size=None, progress=None):
+        data = self.blobs[digest]
+        with open(output_path, 'wb') as f:
+            for start in range(0, len(data), 1000):
+                f.write(data[start:start + 1000])
+                progress.advance(len(data[start:start + 1000]))
+        return output_path
+
+
+class TestPullProgress(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_pull_progress_')
+        self.cache_dir = os.path.join(self.test_dir, 'cache')
+        self.store_dir = os.path.join(self.cache_dir, 'blobs', 'sha256')
+        self.blobs_dir = os.path.join(self.test_dir, 'oci', 'blobs', 'sha256')
+        os.makedirs(self.store_dir)
+        os.makedirs(self.blobs_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_json_events_report_cache_hits_and_throughput(self):
+        cached, fresh, config = b'c' * 3000, b'f' * 5000, b'{}'
+        with open(os.path.join(self.store_dir, _digest(cached)[7:]), 'wb') as f:
+            f.write(cached)
+        stdout = io.StringIO()
+        processor = DockerImageToRootFS('alpine:latest', architecture='amd64', cache_dir=self.cache_dir)
+        processor.progress = PullProgress('json', image='alpine:latest', stdout=stdout)
+        manifest = {
+            'schemaVersion': 2,
+            'config': {'digest': _digest(config), 'size': len(config)},
+            'layers': [{'digest': _digest(data), 'size': len(data)} for data in (cached, fresh)],
+        }
+
+        processor._download_layers(_FakeClient({_digest(fresh): fresh, _digest(config): config}),
+                                   manifest, self.blobs_dir)
+        processor.progress.finish()
+
+        events = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        blobs = {e['digest']: e['cache'] for e in events if e['event'] == 'blob'}
+        self.assertEqual(blobs[_digest(cached)], 'hit')
+        self.assertEqual(blobs[_digest(fresh)], 'miss')
+        done = [e for e in events if e['event'] == 'phase' and e['phase'] == 'download' and e['status'] == 'done']
+        self.assertEqual({e['digest']: e['received'] for e in done},
+                         {_digest(fresh): len(fresh), _digest(config): len(config)})
+        summary = events[-1]
+        self.assertEqual(summary['event'], 'summary')
+        self.assertEqual((summary['cache_hits'], summary['cache_misses']), (1, 2))
+        self.assertEqual(summary['bytes_received'], len(fresh) + len(config))
+        self.assertTrue(all(e['image'] == 'alpine:latest' for e in events))
+
+    def test_client_reports_received_bytes_and_verify_phase(self):
+        _BlobHandler.data = os.urandom(100000)
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _BlobHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            client = DockerRegistryClient(f"http://127.0.0.1:{server.server_address[1]}", 'test/image',
+                                          transport=HttpTransport(proxies={}))
+            progress = PullProgress('plain')
+            digest = _digest(_BlobHandler.data)
+            blob = progress.blob(digest, len(_BlobHandler.data))
+            with blob.phase('download'):
+                client.download_blob(digest, os.path.join(self.test_dir, 'blob'), progress=blob)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        result = progress.summary()['blobs'][0]
+        self.assertEqual(result['received'], len(_BlobHandler.data))
+        self.assertIn('verify', result['phases'])
+        self.assertGreater(result['rate_bps'], 0)
+
+    def test_tty_view_redraws_in_place(self):
+        stderr = io.StringIO()
+        progress = PullProgress('tty', stderr=stderr)
+        progress.UPDATE_INTERVAL = 0
+        progress.blob('sha256:' + 'a' * 64, 1000, cached=True)
+        blob = progress.blob('sha256:' + 'b' * 64, 4 * 1024 * 1024)
+        with blob.phase('download'):
+            blob.advance(1024 * 1024)
+            self.assertIn('ETA', stderr.getvalue().splitlines()[-1])
+
+        self.assertIn('\x1b[2F', stderr.getvalue())
+        self.assertIn('已缓存', stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+registry拉取配额测试
+验证配额头的解析与持久化、配额不足时推迟manifest请求，以及等待配额恢复后继续拉取
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker.create_rootfs_tar import DockerImageToRootFS, DockerRegistryClient, RateLimitExhausted
+from android_docker.http_transport import HttpTransport
+from android_docker.registry_cache import RateLimitBudget, parse_rate_limit, parse_retry_after
+
+
+class _QuotaRegistryHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    remaining = 100
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        cls = type(self)
+        if '/manifests/' not in self.path:
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        cls.requests.append(self.path)
+        if cls.remaining <= 0:
+            status, body = 429, b'{"errors": [{"code": "TOOMANYREQUESTS"}]}'
+        else:
+            cls.remaining -= 1
+            status, body = 200, b'{"schemaVersion": 2, "layers": []}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/vnd.oci.image.manifest.v1+json')
+        self.send_header('RateLimit-Limit', '100;w=21600')
+        self.send_header('RateLimit-Remaining', f'{max(cls.remaining, 0)};w=21600')
+        if status == 429:
+            self.send_header('Retry-After', '120')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestRateLimitHeaders(unittest.TestCase):
+    def test_parse_rate_limit(self):
+        self.assertEqual(parse_rate_limit('100;w=21600'), (100, 21600))
+        self.assertEqual(parse_rate_limit('42'), (42, None))
+        self.assertIsNone(parse_rate_limit('unlimited'))
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('30'), 30)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertEqual(parse_retry_after('Thu, 01 Jan 1970 00:00:00 GMT'), 0)
+
+
+class TestRateLimitedPull(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _QuotaRegistryHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.registry_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        cls.registry = cls.registry_url[len('http://'):]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='test_rate_limits_')
+        self.budget = RateLimitBudget(self.cache_dir)
+        _QuotaRegistryHandler.requests = []
+        _QuotaRegistryHandler.remaining = 100
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _client(self):
+        return DockerRegistryClient(self.registry_url, 'library/alpine', transport=HttpTransport(proxies={}),
+                                    rate_limits=RateLimitBudget(self.cache_dir))
+
+    def test_remaining_budget_is_persisted(self):
+        self._client().get_manifest()
+
+        entry = self.budget.get(self.registry)
+        self.assertEqual((entry['limit'], entry['remaining'], entry['window']),
+                         (100, _QuotaRegistryHandler.remaining, 21600))
+
+    def test_manifest_request_is_deferred_before_quota_runs_out(self):
+        _QuotaRegistryHandler.remaining = 3
+        self._client().get_manifest()
+        sent = len(_QuotaRegistryHandler.requests)
+
+        # 剩余1次，不够manifest list + 子manifest两次请求
+        with self.assertRaises(RateLimitExhausted) as context:
+            self._client().get_manifest()
+        self.assertGreater(context.exception.retry_after, 0)
+        self.assertEqual(len(_QuotaRegistryHandler.requests), sent)
+
+    def test_too_many_requests_records_retry_after(self):
+        _QuotaRegistryHandler.remaining = 0
+
+        with self.assertRaises(RateLimitExhausted) as context:
+            self._client().get_manifest()
+        self.assertEqual(context.exception.retry_after, 120)
+        self.assertGreater(self.budget.wait_time(self.registry), 100)
+
+
+class TestQuotaWait(unittest.TestCase):
+    def _processor(self):
+        return DockerImageToRootFS('alpine:latest', architecture='amd64')
+
+    def test_pull_waits_for_quota_then_continues(self):
+        processor = self._processor()
+        outcomes = [RateLimitExhausted('docker.io', 30), 'manifest']
+
+        def run(action, record=False):
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        with mock.patch.object(processor, '_run_on_registry_endpoints', side_effect=run), \
+                mock.patch('android_docker.create_rootfs_tar.time.sleep') as sleep_mock:
+            self.assertEqual(processor._run_with_registry_fallback(lambda client: None), 'manifest')
+        sleep_mock.assert_called_once_with(30)
+
+    def test_wait_is_bounded(self):
+        processor = self._processor()
+        error = RateLimitExhausted('docker.io', processor.RATE_LIMIT_MAX_WAIT + 1)
+
+        with mock.patch.object(processor, '_run_on_registry_endpoints', side_effect=error), \
+                mock.patch('android_docker.create_rootfs_tar.time.sleep') as sleep_mock:
+            with self.assertRaises(RateLimitExhausted):
+                processor._run_with_registry_fallback(lambda client: None)
+        sleep_mock.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+registry状态缓存测试
+使用本地registry验证token和认证质询缓存在多个客户端（进程）之间复用
+"""
+
+import os
+import sys
+import json
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker.create_rootfs_tar import DockerRegistryClient
+from android_docker.http_transport import HttpTransport
+from android_docker.registry_cache import ChallengeCache, JsonStateFile, TokenCache
+
+
+class _AuthRegistryHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    valid_tokens = set()
+    issued = 0
+    expires_in = 300
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        cls = type(self)
+        cls.requests.append(self.path)
+        if self.path.startswith('/token'):
+            cls.issued += 1
+            token = f'token-{cls.issued}'
+            cls.valid_tokens.add(token)
+            body = json.dumps({'token': token, 'expires_in': cls.expires_in}).encode()
+            return self._reply(200, body, {'Content-Type': 'application/json'})
+
+        token = (self.headers.get('Authorization') or '')[len('Bearer '):]
+        if token not in cls.valid_tokens:
+            port = self.server.server_address[1]
+            repository = self.path[len('/v2/'):].split('/manifests/')[0]
+            challenge = (f'Bearer realm="http://127.0.0.1:{port}/token",service="test",'
+                         f'scope="repository:{repository}:pull"')
+            return self._reply(401, b'{}', {'WWW-Authenticate': challenge})
+        return self._reply(200, b'{"schemaVersion": 2, "layers": []}',
+                           {'Content-Type': 'application/vnd.oci.image.manifest.v1+json'})
+
+
+class TestTokenCache(unittest.TestCase):
+    """bearer token的持久化缓存"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _AuthRegistryHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.registry_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='test_registry_cache_')
+        _AuthRegistryHandler.requests = []
+        _AuthRegistryHandler.valid_tokens = set()
+        _AuthRegistryHandler.expires_in = 300
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _pull_manifest(self, image_name='test/image'):
+        client = DockerRegistryClient(self.registry_url, image_name, transport=HttpTransport(proxies={}),
+                                      token_cache=TokenCache(self.cache_dir),
+                                      challenge_cache=ChallengeCache(self.cache_dir))
+        client.get_manifest()
+        return client
+
+    def test_warm_pull_skips_probe_and_token_exchange(self):
+        self._pull_manifest()
+        self.assertEqual(len(_AuthRegistryHandler.requests), 3)
+
+        _AuthRegistryHandler.requests = []
+        self._pull_manifest()
+
+        self.assertEqual(_AuthRegistryHandler.requests, ['/v2/test/image/manifests/latest'])
+
+    def test_token_near_expiry_is_not_reused(self):
+        _AuthRegistryHandler.expires_in = 10
+        self._pull_manifest()
+
+        _AuthRegistryHandler.requests = []
+        self._pull_manifest()
+
+        self.assertTrue(any(path.startswith('/token') for path in _AuthRegistryHandler.requests))
+
+    def test_rejected_cached_token_is_replaced(self):
+        self._pull_manifest()
+        _AuthRegistryHandler.valid_tokens = set()
+
+        client = self._pull_manifest()
+
+        self.assertIn(client.auth_token, _AuthRegistryHandler.valid_tokens)
+        cache = TokenCache(self.cache_dir)
+        self.assertEqual(cache.find(self.registry_url, 'repository:test/image:pull'), client.auth_token)
+
+    def test_tokens_are_keyed_by_account(self):
+        cache = TokenCache(self.cache_dir)
+        cache.put('https://auth', 'svc', 'repository:a:pull', {'token': 't', 'issued_at': '2000-01-01T00:00:00Z',
+                                                               'expires_in': 10 ** 10})
+
+        self.assertEqual(cache.get('https://auth', 'svc', 'repository:a:pull'), 't')
+        self.assertIsNone(cache.get('https://auth', 'svc', 'repository:a:pull', account='alice'))
+        self.assertIsNone(cache.get('https://auth', 'svc', 'repository:b:pull'))
+
+    def test_issued_at_is_respected(self):
+        cache = TokenCache(self.cache_dir)
+        cache.put('https://auth', 'svc', 'repository:a:pull',
+                  {'token': 't', 'issued_at': '2000-01-01T00:00:00Z', 'expires_in': 300})
+
+        self.assertIsNone(cache.get('https://auth', 'svc', 'repository:a:pull'))
+
+    def test_token_file_is_private(self):
+        self._pull_manifest()
+
+        self.assertEqual(os.stat(TokenCache(self.cache_dir).state.path).st_mode & 0o777, 0o600)
+
+
+    def test_cached_challenge_skips_probe_for_other_repository(self):
+        self._pull_manifest()
+
+        _AuthRegistryHandler.requests = []
+        self._pull_manifest('test/other')
+
+        self.assertEqual(len(_AuthRegistryHandler.requests), 2)
+        self.assertIn('scope=repository:test/other:pull', _AuthRegistryHandler.requests[0])
+        self.assertEqual(_AuthRegistryHandler.requests[1], '/v2/test/other/manifests/latest')
+
+    def test_changed_challenge_triggers_reauthentication(self):
+        ChallengeCache(self.cache_dir).put(self.registry_url, {
+            'scheme': 'bearer', 'realm': 'http://127.0.0.1:1/token', 'service': 'old',
+        })
+
+        client = self._pull_manifest()
+
+        self.assertIn(client.auth_token, _AuthRegistryHandler.valid_tokens)
+        cached = ChallengeCache(self.cache_dir).get(self.registry_url)
+        self.assertEqual(cached['service'], 'test')
+        self.assertNotIn('scope', cached)
+
+
+
+class TestJsonStateFile(unittest.TestCase):
+    """多个进程同时更新同一个状态文件"""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='test_json_state_')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_concurrent_processes_do_not_lose_updates(self):
+        path = os.path.join(self.cache_dir, 'registry', 'ratelimits.json')
+        script = (
+            "import sys\n"
+            f"sys.path.insert(0, {os.path.dirname(os.path.dirname(os.path.abspath(__file__)))!r})\n"
+            "from android_docker.registry_cache import JsonStateFile\n"
+            "state = JsonStateFile(sys.argv[1])\n"
+            "for _ in range(50):\n"
+            "    state.update(lambda data: data.update(count=data.get('count', 0) + 1))\n"
+        )
+        workers = [subprocess.Popen([sys.executable, '-c', script, path]) for _ in range(4)]
+        for worker in workers:
+            self.assertEqual(worker.wait(timeout=60), 0)
+
+        self.assertEqual(JsonStateFile(path).load()['count'], 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
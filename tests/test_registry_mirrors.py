@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+registry mirror选择与回退测试
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker.create_rootfs_tar import DockerImageToRootFS
+from android_docker.registry_mirrors import MirrorSelector, RegistryEndpoint, load_mirror_config
+
+
+def _make_handler(delay=0.0, status=200):
+    class _Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(status)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+    return _Handler
+
+
+class TestRegistryMirrors(unittest.TestCase):
+    """mirror配置解析、延迟排序与回退"""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='test_registry_mirrors_')
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _serve(self, delay=0.0, status=200):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _make_handler(delay, status))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    def _write_config(self, mirrors):
+        with open(os.path.join(self.cache_dir, 'config.json'), 'w') as f:
+            json.dump({'auths': {}, 'registry-mirrors': mirrors}, f)
+
+    def test_config_accepts_docker_style_list_and_prefixes(self):
+        self._write_config(['swr.cn-north-4.myhuaweicloud.com/ddn-k8s/docker.io'])
+
+        mirrors = load_mirror_config(self.cache_dir)
+        endpoint = RegistryEndpoint.from_mirror(mirrors['docker.io'][0])
+
+        self.assertEqual(endpoint.registry_url, 'https://swr.cn-north-4.myhuaweicloud.com')
+        self.assertEqual(endpoint.repository('library/alpine'), 'ddn-k8s/docker.io/library/alpine')
+
+    def test_fastest_healthy_mirror_comes_first_and_upstream_last(self):
+        slow = self._serve(delay=0.3)
+        fast = self._serve()
+        broken = self._serve(status=503)
+        selector = MirrorSelector(self.cache_dir, mirrors={'docker.io': [slow, broken, fast]})
+
+        candidates = selector.candidates('https://registry-1.docker.io')
+
+        self.assertEqual([c.label for c in candidates], [fast, slow, 'https://registry-1.docker.io'])
+
+    def test_recorded_choice_skips_probing(self):
+        mirror = self._serve()
+        selector = MirrorSelector(self.cache_dir, mirrors={'ghcr.io': [mirror]})
+        selector.record_result('https://ghcr.io', RegistryEndpoint.from_mirror(mirror), True,
+                               bytes_received=1000, elapsed=0.5)
+
+        with mock.patch.object(MirrorSelector, 'probe') as probe_mock:
+            candidates = selector.candidates('https://ghcr.io')
+
+        probe_mock.assert_not_called()
+        self.assertEqual(candidates[0].label, mirror)
+        record = selector.state.load()['ghcr.io']
+        self.assertEqual(record['endpoints'][mirror]['throughput_bps'], 2000)
+
+    def test_pull_falls_back_to_next_mirror(self):
+        first, second = self._serve(), self._serve()
+        self._write_config({'docker.io': [first, f"{second}/prefix"]})
+        processor = DockerImageToRootFS('alpine:latest', architecture='amd64', cache_dir=self.cache_dir)
+        used = []
+
+        def fake_download(client, oci_dir):
+            used.append((client.registry_url, client.image_name, client.username))
+            if client.registry_url == first:
+                raise RuntimeError('HTTP 500')
+            return oci_dir
+
+        processor.temp_dir = self.cache_dir
+        processor.username = 'alice'
+        with mock.patch.object(MirrorSelector, 'probe', return_value=0.01), \
+                mock.patch.object(processor, '_download_image_with_client', side_effect=fake_download):
+            processor._download_image_with_python()
+
+        self.assertEqual(used, [(first, 'library/alpine', None), (second, 'prefix/library/alpine', None)])
+        record = MirrorSelector(self.cache_dir).state.load()['docker.io']
+        self.assertEqual(record['chosen'], f"{second}/prefix")
+        self.assertEqual(record['endpoints'][first]['failures'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
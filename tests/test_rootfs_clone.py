@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+容器根文件系统克隆策略测试
+显式选择 hardlink 时不可变文件与快照共用，可写目录和镜像声明的卷总是私有副本；auto 在 reflink 不可用时复制
+"""
+
+import os
+import sys
+import json
+import errno
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker import rootfs_clone
+from android_docker.rootfs_clone import materialize_snapshot, resolve_clone_strategy
+from android_docker.rootfs_snapshot import remove_tree
+
+
+class TestRootfsClone(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='test_rootfs_clone_')
+        self.snapshot = os.path.join(self.work_dir, 'snapshot')
+        for name, data in [('usr/bin/tool', b'tool' * 1024), ('etc/motd', b'snapshot\n'),
+                           ('data/db', b'db'), ('lib/libc.so', b'libc')]:
+            path = os.path.join(self.snapshot, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+        os.symlink('tool', os.path.join(self.snapshot, 'usr', 'bin', 'alias'))
+        with open(os.path.join(self.snapshot, '.image_config.json'), 'w') as f:
+            json.dump({'config': {'Volumes': {'/data': {}}}}, f)
+        rootfs_clone._support.clear()
+
+    def tearDown(self):
+        rootfs_clone._support.clear()
+        remove_tree(self.work_dir)
+
+    def _same_file(self, name, rootfs):
+        return os.stat(os.path.join(self.snapshot, name)).st_ino == os.stat(os.path.join(rootfs, name)).st_ino
+
+    def test_hardlink_farm_keeps_writable_paths_private(self):
+        rootfs = materialize_snapshot(self.snapshot, os.path.join(self.work_dir, 'c1'), 'hardlink')
+
+        self.assertTrue(self._same_file('usr/bin/tool', rootfs))
+        self.assertTrue(self._same_file('lib/libc.so', rootfs))
+        self.assertFalse(self._same_file('etc/motd', rootfs))
+        self.assertFalse(self._same_file('data/db', rootfs))
+        self.assertEqual(os.readlink(os.path.join(rootfs, 'usr', 'bin', 'alias')), 'tool')
+
+        with open(os.path.join(rootfs, 'etc', 'motd'), 'w') as f:
+            f.write('changed\n')
+        with open(os.path.join(self.snapshot, 'etc', 'motd')) as f:
+            self.assertEqual(f.read(), 'snapshot\n')
+
+    def test_auto_without_reflink_copies_instead_of_hardlinking(self):
+        unsupported = OSError(errno.EOPNOTSUPP, 'Operation not supported')
+        with mock.patch.object(rootfs_clone.fcntl, 'ioctl', side_effect=unsupported) as ioctl, \
+                self.assertLogs('android_docker.rootfs_clone', level='INFO') as logs:
+            rootfs = materialize_snapshot(self.snapshot, os.path.join(self.work_dir, 'c1'), 'auto')
+
+        # 同一文件系统只探测一次
+        self.assertEqual(ioctl.call_count, 1)
+        self.assertIn('auto → copy', logs.output[-1])
+        self.assertIn('与快照共享 0.00 MB', logs.output[-1])
+        self.assertIn('copy 5', logs.output[-1])
+
+        # 可写目录之外的文件就地写入也不影响快照
+        with open(os.path.join(rootfs, 'usr', 'bin', 'tool'), 'ab') as f:
+            f.write(b'patched')
+        os.chmod(os.path.join(rootfs, 'usr', 'bin', 'tool'), 0o600)
+        with open(os.path.join(self.snapshot, 'usr', 'bin', 'tool'), 'rb') as f:
+            self.assertEqual(f.read(), b'tool' * 1024)
+        self.assertNotEqual(os.stat(os.path.join(self.snapshot, 'usr', 'bin', 'tool')).st_mode & 0o777, 0o600)
+
+    def test_copy_strategy_shares_nothing(self):
+        with mock.patch.dict(os.environ, {rootfs_clone.CLONE_STRATEGY_ENV: 'copy'}):
+            rootfs = materialize_snapshot(self.snapshot, os.path.join(self.work_dir, 'c1'))
+
+        for name in ('usr/bin/tool', 'lib/libc.so', 'etc/motd'):
+            self.assertFalse(self._same_file(name, rootfs))
+        with open(os.path.join(rootfs, 'usr', 'bin', 'tool'), 'rb') as f:
+            self.assertEqual(f.read(), b'tool' * 1024)
+
+    def test_unknown_strategy_falls_back_to_auto(self):
+        self.assertEqual(resolve_clone_strategy('zfs'), 'auto')
+        self.assertEqual(resolve_clone_strategy(' Reflink '), 'reflink')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+根文件系统快照测试
+snapshot 模式下拉取结果保存为快照目录而不是tar.gz，容器根文件系统直接从快照复制，修改不影响快照
+"""
+
+import io
+import os
+import sys
+import json
+import gzip
+import hashlib
+import tarfile
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker.blob_store import TagIndex
+from android_docker.create_rootfs_tar import DockerImageToRootFS
+from android_docker.proot_runner import ProotRunner
+from android_docker.rootfs_snapshot import copy_tree, remove_tree, snapshot_path
+
+OCI_MANIFEST = 'application/vnd.oci.image.manifest.v1+json'
+
+
+def _digest(data):
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+
+def _layer():
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for name, data in [('bin/sh', b'#!shell\n'), ('lib/libc.so', b'libc'), ('usr/bin/env', b'env'),
+                           ('etc/motd', b'snapshot\n')]:
+            member = tarfile.TarInfo(name)
+            member.size = len(data)
+            member.mode = 0o755
+            tar.addfile(member, io.BytesIO(data))
+        link = tarfile.TarInfo('bin/ash')
+        link.type = tarfile.SYMTYPE
+        link.linkname = 'sh'
+        tar.addfile(link)
+    return gzip.compress(buffer.getvalue())
+
+
+class TestRootfsSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='test_rootfs_snapshot_')
+        store_dir = os.path.join(self.cache_dir, 'blobs', 'sha256')
+        os.makedirs(store_dir)
+        layer, config = _layer(), b'{"architecture": "amd64", "os": "linux", "config": {"Cmd": ["/bin/sh"]}}'
+        manifest = json.dumps({
+            'schemaVersion': 2, 'mediaType': OCI_MANIFEST,
+            'config': {'digest': _digest(config), 'size': len(config)},
+            'layers': [{'mediaType': 'application/vnd.oci.image.layer.v1.tar+gzip',
+                        'digest': _digest(layer), 'size': len(layer)}],
+        }).encode()
+        for data in (layer, config, manifest):
+            with open(os.path.join(store_dir, _digest(data)[7:]), 'wb') as f:
+                f.write(data)
+        TagIndex(os.path.join(self.cache_dir, 'blobs', 'tags.json')).record(
+            'docker.io', 'library/alpine', 'latest', _digest(manifest), OCI_MANIFEST)
+        self.runner = ProotRunner(cache_dir=self.cache_dir)
+        self.cache_path = self.runner._get_image_cache_path('alpine')
+
+    def tearDown(self):
+        self.runner._cleanup()
+        remove_tree(self.cache_dir)
+
+    def _pull(self, image_store):
+        processor = DockerImageToRootFS('alpine', self.cache_path, architecture='amd64', cache_dir=self.cache_dir,
+                                        offline=True, image_store=image_store)
+        self.assertTrue(processor.create_rootfs_tar())
+        self.runner._save_cache_info('alpine', self.cache_path)
+
+    def test_pull_keeps_snapshot_instead_of_archive(self):
+        self._pull('snapshot')
+
+        snapshot = snapshot_path(self.cache_path)
+        self.assertFalse(os.path.exists(self.cache_path))
+        self.assertTrue(self.runner._is_image_cached('alpine'))
+        self.assertTrue(os.path.isfile(os.path.join(snapshot, '.image_config.json')))
+        self.assertEqual(os.readlink(os.path.join(snapshot, 'bin', 'ash')), 'sh')
+        self.assertGreater(self.runner._load_cache_info('alpine')['rootfs_size'], 0)
+
+    def test_container_rootfs_is_a_private_copy(self):
+        self._pull('snapshot')
+
+        rootfs = self.runner._extract_rootfs_if_needed(self.cache_path)
+        with open(os.path.join(rootfs, 'etc', 'motd'), 'w') as f:
+            f.write('changed\n')
+
+        with open(os.path.join(snapshot_path(self.cache_path), 'etc', 'motd')) as f:
+            self.assertEqual(f.read(), 'snapshot\n')
+        self.assertTrue(os.access(os.path.join(rootfs, 'bin', 'sh'), os.X_OK))
+
+    def test_archive_mode_replaces_snapshot_and_rmi_removes_it(self):
+        self._pull('snapshot')
+        self._pull('archive')
+        self.assertTrue(os.path.exists(self.cache_path))
+        self.assertFalse(os.path.exists(snapshot_path(self.cache_path)))
+
+        self._pull('snapshot')
+        self.runner.clear_cache('alpine')
+        self.assertFalse(self.runner._is_image_cached('alpine'))
+        self.assertFalse(os.path.exists(snapshot_path(self.cache_path)))
+
+    def test_copy_tree_preserves_hardlinks_and_read_only_dirs(self):
+        source = os.path.join(self.cache_dir, 'source')
+        os.makedirs(os.path.join(source, 'ro'))
+        with open(os.path.join(source, 'ro', 'a'), 'w') as f:
+            f.write('a')
+        os.link(os.path.join(source, 'ro', 'a'), os.path.join(source, 'b'))
+        os.chmod(os.path.join(source, 'ro'), 0o555)
+
+        target = os.path.join(self.cache_dir, 'target')
+        copy_tree(source, target)
+
+        self.assertEqual(os.stat(os.path.join(target, 'ro', 'a')).st_ino, os.stat(os.path.join(target, 'b')).st_ino)
+        self.assertNotEqual(os.stat(os.path.join(target, 'b')).st_ino, os.stat(os.path.join(source, 'b')).st_ino)
+        self.assertEqual(os.stat(os.path.join(target, 'ro')).st_mode & 0o777, 0o555)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+传输超时、卡住检测与退避重试测试
+"""
+
+import os
+import sys
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from android_docker.create_rootfs_tar import DockerRegistryClient, RegistryHTTPError
+from android_docker.http_transport import HttpTransport, RetryPolicy, TransferStalled
+
+
+class _FlakyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    data = b''
+    # 依次消费的故障：'503'、'drop'（发送一半后断开）、'trickle'、'hang'
+    faults = []
+    ranges = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        cls = type(self)
+        cls.ranges.append(self.headers.get('Range'))
+        fault = cls.faults.pop(0) if cls.faults else None
+        if fault in ('503', '404'):
+            self.send_response(int(fault))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = cls.data
+        start = int(self.headers['Range'][6:].split('-')[0]) if self.headers.get('Range') else 0
+        if start:
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+        else:
+            self.send_response(200)
+        body = body[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        if fault == 'drop':
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+        elif fault == 'trickle':
+            for i in range(20):
+                self.wfile.write(body[i:i + 1])
+                self.wfile.flush()
+                time.sleep(0.05)
+            self.close_connection = True
+        elif fault == 'hang':
+            time.sleep(1)
+            self.close_connection = True
+        else:
+            self.wfile.write(body)
+
+
+class TestTransferRetries(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _FlakyHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.registry_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix='test_transfer_retries_')
+        self.output_path = os.path.join(self.test_dir, 'blob')
+        _FlakyHandler.data = os.urandom(200000)
+        _FlakyHandler.faults = []
+        _FlakyHandler.ranges = []
+        self.digest = 'sha256:' + hashlib.sha256(_FlakyHandler.data).hexdigest()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _client(self, **transport_options):
+        transport = HttpTransport(proxies={}, **transport_options)
+        return DockerRegistryClient(self.registry_url, 'test/image', transport=transport,
+                                    retry_policy=RetryPolicy(attempts=3, base_delay=0.01))
+
+    def _download(self, client=None):
+        (client or self._client()).download_blob(self.digest, self.output_path)
+        with open(self.output_path, 'rb') as f:
+            return f.read()
+
+    def test_dropped_connection_resumes_from_partial(self):
+        _FlakyHandler.faults = ['drop']
+
+        self.assertEqual(self._download(), _FlakyHandler.data)
+        self.assertIsNone(_FlakyHandler.ranges[0])
+        self.assertTrue(_FlakyHandler.ranges[1].startswith('bytes='))
+        self.assertGreater(int(_FlakyHandler.ranges[1][6:].rstrip('-')), 0)
+
+    def test_server_errors_are_retried(self):
+        _FlakyHandler.faults = ['503', '503']
+
+        self.assertEqual(self._download(), _FlakyHandler.data)
+        self.assertEqual(len(_FlakyHandler.ranges), 3)
+
+    def test_client_errors_are_not_retried(self):
+        _FlakyHandler.faults = ['404']
+
+        with self.assertRaises(RegistryHTTPError):
+            self._download()
+        self.assertEqual(len(_FlakyHandler.ranges), 1)
+
+    def test_retries_are_bounded(self):
+        _FlakyHandler.faults = ['503'] * 5
+
+        with self.assertRaises(RegistryHTTPError):
+            self._download()
+        self.assertEqual(len(_FlakyHandler.ranges), 3)
+
+    def test_read_timeout_on_silent_connection(self):
+        _FlakyHandler.faults = ['hang']
+
+        self.assertEqual(self._download(self._client(timeout=0.3)), _FlakyHandler.data)
+
+    def test_slow_transfer_is_detected_as_stalled(self):
+        _FlakyHandler.faults = ['trickle']
+        transport = HttpTransport(proxies={}, low_speed_limit=10 ** 6, low_speed_time=0.2)
+
+        with self.assertRaises(TransferStalled):
+            transport.request('GET', f"{self.registry_url}/v2/test/image/blobs/x", sink=lambda chunk: None)
+
+    def test_backoff_delay_is_jittered_and_capped(self):
+        policy = RetryPolicy(base_delay=1, max_delay=5)
+
+        delays = [policy.delay(attempt) for attempt in range(1, 10) for _ in range(20)]
+
+        self.assertTrue(all(0 <= delay <= 5 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()